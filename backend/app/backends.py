@@ -0,0 +1,234 @@
+import os
+import logging
+import threading
+import numpy as np
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("ecotionbuddy.backends")
+
+BACKEND_CHOICES = ("auto", "savedmodel", "tflite", "onnx")
+
+
+class InferenceBackend:
+    """Runtime that turns a normalized float32 [B, H, W, 3] batch into top-1 predictions"""
+
+    name = "base"
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        self.model_path = model_path
+        self.num_threads = num_threads or None
+        self.input_size = (224, 224)  # (width, height), refined from the model on load
+        self.num_classes: Optional[int] = None
+
+    @property
+    def artefact_paths(self) -> List[str]:
+        """Files whose contents identify the model version"""
+        return [self.model_path]
+
+    def validate(self) -> bool:
+        if not os.path.isfile(self.model_path):
+            logger.error(f"{self.name} model file does not exist: {self.model_path}")
+            return False
+        return True
+
+    def load(self) -> None:
+        raise NotImplementedError
+
+    def run(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (top-1 class indices, top-1 softmax confidences) for the batch"""
+        raise NotImplementedError
+
+    def _set_input_shape(self, shape) -> None:
+        if len(shape) != 4 or shape[-1] != 3:
+            raise ValueError(f"Expected [batch, height, width, 3] input, got {shape}")
+        if shape[1] and shape[2] and shape[1] > 0 and shape[2] > 0:
+            self.input_size = (int(shape[2]), int(shape[1]))
+
+    @staticmethod
+    def _top1(logits: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Softmax in numpy, matching tf.nn.softmax in the SavedModel graph
+        logits = logits.astype(np.float32, copy=False)
+        exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        probs = exp / exp.sum(axis=-1, keepdims=True)
+        indices = probs.argmax(axis=-1)
+        return indices, probs[np.arange(len(probs)), indices]
+
+
+class SavedModelBackend(InferenceBackend):
+    """Full TensorFlow SavedModel through its serving_default signature"""
+
+    name = "savedmodel"
+
+    @property
+    def artefact_paths(self) -> List[str]:
+        # The variables index carries a checksum per tensor, so retrained weights
+        # with an identical graph still get a new version
+        paths = [os.path.join(self.model_path, "saved_model.pb")]
+        index = os.path.join(self.model_path, "variables", "variables.index")
+        if os.path.exists(index):
+            paths.append(index)
+        return paths
+
+    def validate(self) -> bool:
+        if not os.path.exists(self.model_path):
+            logger.error(f"Model path does not exist: {self.model_path}")
+            return False
+
+        # Check for required SavedModel files
+        if not os.path.exists(os.path.join(self.model_path, "saved_model.pb")):
+            logger.error(f"saved_model.pb not found in {self.model_path}")
+            return False
+
+        if not os.path.exists(os.path.join(self.model_path, "variables")):
+            logger.warning(f"variables/ directory not found in {self.model_path}")
+            # Some models might not have variables, continue anyway
+        return True
+
+    def load(self) -> None:
+        import tensorflow as tf
+
+        if self.num_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(self.num_threads)
+        self.model = tf.saved_model.load(self.model_path)
+
+        # Get inference function
+        self.infer = self.model.signatures["serving_default"]
+        logger.info(f"Model input signature: {list(self.infer.structured_input_signature[1].keys())}")
+        logger.info(f"Model output signature: {list(self.infer.structured_outputs.keys())}")
+        self._forward = self._build_forward(tf)
+
+    def _build_forward(self, tf):
+        """Resolve the serving signature once and compile forward pass, softmax and top-1"""
+        inputs = self.infer.structured_input_signature[1]
+        outputs = self.infer.structured_outputs
+        if len(inputs) != 1 or not outputs:
+            raise ValueError(f"Expected a single-input signature, got inputs={list(inputs)} outputs={list(outputs)}")
+        # Note: Input key might be different, common ones are:
+        # "input_1", "inputs", "input", "serving_default_input_1"
+        input_key = next(iter(inputs))
+        output_key = next(iter(outputs))
+        input_spec = inputs[input_key]
+
+        shape = input_spec.shape
+        if shape.rank != 4:
+            raise ValueError(f"Expected [batch, height, width, 3] input, got {shape}")
+        self._set_input_shape(shape.as_list())
+        num_classes = outputs[output_key].shape[-1]
+        if num_classes is not None:
+            self.num_classes = int(num_classes)
+
+        infer = self.infer
+        batch_spec = tf.TensorSpec([None, self.input_size[1], self.input_size[0], 3], input_spec.dtype)
+
+        @tf.function(input_signature=[batch_spec])
+        def forward(batch):
+            probs = tf.nn.softmax(infer(**{input_key: batch})[output_key])
+            top = tf.math.top_k(probs, k=1)
+            return top.indices[:, 0], top.values[:, 0]
+
+        return forward
+
+    def run(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # The compiled function copies the batch into a tensor, so callers may reuse it
+        indices, confidences = self._forward(batch)
+        return indices.numpy(), confidences.numpy()
+
+
+class TFLiteBackend(InferenceBackend):
+    """TFLite flatbuffer (float32, float16 or int8) via tflite-runtime, falling back to tf.lite"""
+
+    name = "tflite"
+
+    def load(self) -> None:
+        try:
+            from tflite_runtime.interpreter import Interpreter  # type: ignore
+        except ImportError:  # pragma: no cover - depends on deployment
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=self.model_path, num_threads=self.num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._set_input_shape(list(self._input["shape_signature"]))
+        self.num_classes = int(self._output["shape"][-1])
+        self._batch_size = int(self._input["shape"][0])
+        # The interpreter is not thread-safe; inference workers share it under a lock
+        self._lock = threading.Lock()
+        logger.info(f"TFLite input {self._input['dtype'].__name__}{list(self._input['shape'])}, "
+                    f"output {self._output['dtype'].__name__}{list(self._output['shape'])}")
+
+    def run(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            if len(batch) != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input["index"], [len(batch), *batch.shape[1:]])
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+                self._batch_size = len(batch)
+            self.interpreter.set_tensor(self._input["index"], self._quantize(batch, self._input))
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output["index"])
+        return self._top1(self._dequantize(output, self._output))
+
+    @staticmethod
+    def _quantize(batch: np.ndarray, detail) -> np.ndarray:
+        dtype = detail["dtype"]
+        if dtype == np.float32:
+            return batch
+        scale, zero_point = detail["quantization"]
+        if scale:
+            info = np.iinfo(dtype)
+            return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+        return batch.astype(dtype)
+
+    @staticmethod
+    def _dequantize(output: np.ndarray, detail) -> np.ndarray:
+        scale, zero_point = detail["quantization"]
+        if detail["dtype"] != np.float32 and scale:
+            return (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+class ONNXBackend(InferenceBackend):
+    """ONNX export (e.g. from tf2onnx) via onnxruntime on the CPU provider"""
+
+    name = "onnx"
+
+    def load(self) -> None:
+        import onnxruntime as ort  # type: ignore
+
+        options = ort.SessionOptions()
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(self.model_path, sess_options=options,
+                                            providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self._input_name = model_input.name
+        self._set_input_shape([d if isinstance(d, int) else None for d in model_input.shape])
+        classes = self.session.get_outputs()[0].shape[-1]
+        if isinstance(classes, int):
+            self.num_classes = classes
+
+    def run(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # onnxruntime sessions are safe to call from several threads
+        output = self.session.run(None, {self._input_name: batch})[0]
+        return self._top1(output)
+
+
+def create_backend(model_path: str, kind: str = "auto", num_threads: Optional[int] = None) -> InferenceBackend:
+    """Pick a backend explicitly or from the model path (directory, .tflite or .onnx)"""
+    kind = (kind or "auto").lower()
+    if kind not in BACKEND_CHOICES:
+        raise ValueError(f"Unknown model backend {kind!r}, expected one of {BACKEND_CHOICES}")
+    if kind == "auto":
+        lowered = model_path.lower()
+        if lowered.endswith(".tflite"):
+            kind = "tflite"
+        elif lowered.endswith(".onnx"):
+            kind = "onnx"
+        else:
+            kind = "savedmodel"
+    backend_cls = {"savedmodel": SavedModelBackend, "tflite": TFLiteBackend, "onnx": ONNXBackend}[kind]
+    return backend_cls(model_path, num_threads=num_threads)
@@ -0,0 +1,85 @@
+import io
+import logging
+import os
+import tarfile
+import zipfile
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("ecotionbuddy.batch")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+TAR_CONTENT_TYPES = ("application/x-tar", "application/gzip", "application/x-gzip", "application/x-gtar")
+
+
+class UnsupportedArchive(Exception):
+    """Raised when a batch body is neither a zip nor a tar archive"""
+
+
+class ArchiveTooLarge(Exception):
+    """Raised when the images in an archive inflate past the batch byte limit"""
+
+
+def _is_image_name(name: str) -> bool:
+    base = os.path.basename(name)
+    return not base.startswith(".") and base.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def read_archive_images(content_type: str, body: bytes, max_files: int,
+                        max_file_bytes: int, max_total_bytes: int) -> List[Tuple[str, Optional[bytes]]]:
+    """Extract (name, bytes) pairs for every image inside a zip or tar body.
+
+    Members over ``max_file_bytes`` are kept with ``None`` instead of their
+    bytes, so the caller can report them in order. Raises ``ArchiveTooLarge``
+    before the extracted images would pass ``max_total_bytes``, so a small
+    compressed body cannot inflate without bound. Blocking; call it from a
+    worker thread.
+    """
+    images: List[Tuple[str, Optional[bytes]]] = []
+    total = 0
+
+    def reserve(name: str, size: int) -> None:
+        # Declared sizes are what zipfile/tarfile read at most, so check before extracting
+        nonlocal total
+        total += size
+        if total > max_total_bytes:
+            raise ArchiveTooLarge(f"Archive images exceed {max_total_bytes} bytes at {name}")
+
+    if content_type in ZIP_CONTENT_TYPES or zipfile.is_zipfile(io.BytesIO(body)):
+        try:
+            with zipfile.ZipFile(io.BytesIO(body)) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not _is_image_name(info.filename):
+                        continue
+                    if info.file_size > max_file_bytes:
+                        logger.warning("Skipping oversized archive member: %s", info.filename)
+                        images.append((info.filename, None))
+                    else:
+                        reserve(info.filename, info.file_size)
+                        images.append((info.filename, archive.read(info)))
+                    if len(images) >= max_files:
+                        break
+            return images
+        except zipfile.BadZipFile as e:
+            raise UnsupportedArchive(str(e)) from e
+    if content_type in TAR_CONTENT_TYPES or content_type == "application/octet-stream":
+        try:
+            with tarfile.open(fileobj=io.BytesIO(body), mode="r:*") as archive:
+                for member in archive:
+                    if not member.isfile() or not _is_image_name(member.name):
+                        continue
+                    if member.size > max_file_bytes:
+                        logger.warning("Skipping oversized archive member: %s", member.name)
+                        images.append((member.name, None))
+                    else:
+                        reserve(member.name, member.size)
+                        fobj = archive.extractfile(member)
+                        if fobj is None:
+                            continue
+                        images.append((member.name, fobj.read()))
+                    if len(images) >= max_files:
+                        break
+            return images
+        except tarfile.TarError as e:
+            raise UnsupportedArchive(str(e)) from e
+    raise UnsupportedArchive(f"Unsupported content type: {content_type or 'unknown'}")
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Generic, Optional, Tuple, TypeVar
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+logger = logging.getLogger("ecotionbuddy.cache")
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """Thread-safe LRU with optional per-entry TTL and a total byte budget"""
+
+    def __init__(self, max_bytes: int, ttl_seconds: Optional[float] = None) -> None:
+        self.max_bytes = max(0, max_bytes)
+        self.ttl = ttl_seconds
+        self._data: "OrderedDict[str, Tuple[V, int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[V]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, stored_at = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: V, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, time.monotonic())
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._data:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class PredictionCache:
+    """In-process prediction cache keyed by image content hash and model version"""
+
+    # Rough per-entry overhead of the key, tuple and float on top of the label
+    ENTRY_OVERHEAD = 160
+
+    def __init__(self, max_bytes: int = 1024 * 1024, ttl_seconds: float = 600.0) -> None:
+        self._lru: LRUCache[Tuple[str, float]] = LRUCache(max_bytes, ttl_seconds)
+
+    @staticmethod
+    def make_key(image_bytes: bytes, model_version: str) -> str:
+        digest = hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+        return f"{model_version}:{digest}"
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        return self._lru.get(key)
+
+    def put(self, key: str, prediction: Tuple[str, float]) -> None:
+        self._lru.put(key, prediction, self.ENTRY_OVERHEAD + len(key) + len(prediction[0]))
+
+    def stats(self) -> Dict[str, Any]:
+        return self._lru.stats()
+
+
+class MongoPredictionCache:
+    """Optional shared second tier so restarts and replicas reuse earlier predictions"""
+
+    def __init__(self, collection: AsyncIOMotorCollection, ttl_seconds: int = 86400) -> None:
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def get(self, key: str) -> Optional[Tuple[str, float]]:
+        try:
+            doc = await self.collection.find_one({"_id": key})
+        except Exception as e:  # noqa: BLE001
+            self.errors += 1
+            logger.warning("Prediction cache lookup failed: %s", e)
+            return None
+        if not doc:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return doc["label"], float(doc["confidence"])
+
+    async def put(self, key: str, prediction: Tuple[str, float], model_version: str) -> None:
+        try:
+            await self.collection.update_one(
+                {"_id": key},
+                {"$set": {
+                    "label": prediction[0],
+                    "confidence": prediction[1],
+                    "modelVersion": model_version,
+                    "createdAt": datetime.utcnow(),
+                }},
+                upsert=True,
+            )
+        except Exception as e:  # noqa: BLE001
+            self.errors += 1
+            logger.warning("Prediction cache write failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "errors": self.errors}
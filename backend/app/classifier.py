@@ -1,135 +1,222 @@
 import os
 import io
+import hashlib
 import logging
+import threading
 import numpy as np
 from PIL import Image
-import tensorflow as tf
-from typing import Tuple, Optional, List
+from typing import TYPE_CHECKING, Tuple, Optional, List
+
+from .backends import InferenceBackend, create_backend
+from .cache import PredictionCache
+
+if TYPE_CHECKING:  # TensorFlow is imported lazily by the backends; it takes seconds
+    import tensorflow as tf
 
 logger = logging.getLogger("ecotionbuddy.classifier")
 
 class TrashClassifier:
     """MobileNetV2-based trash classifier for waste categorization"""
     
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, version: Optional[str] = None,
+                 cache: Optional[PredictionCache] = None,
+                 backend: str = "auto", num_threads: Optional[int] = None):
         self.model_path = model_path
-        self.model = None
+        self.model: Optional[InferenceBackend] = None
+        self.backend_kind = backend
+        self.num_threads = num_threads
+        self.version = version or "unversioned"
+        self._explicit_version = version is not None
+        self.cache = cache
+        self.inflight = 0  # predictions currently using this instance (see ModelRegistry.retire)
         self.class_names = [
             "cardboard", "glass", "metal", "paper", "plastic", "trash"
         ]  # Common waste categories - will be auto-detected from model
         self.input_size = (224, 224)  # MobileNetV2 standard input size
+        self.num_classes = len(self.class_names)
+        self._buffers = threading.local()  # per-thread float32 batch buffers
         
     def load_model(self) -> bool:
-        """Load the TensorFlow SavedModel"""
+        """Load the model through the configured backend (SavedModel, TFLite or ONNX)"""
         try:
-            if not os.path.exists(self.model_path):
-                logger.error(f"Model path does not exist: {self.model_path}")
+            backend = create_backend(self.model_path, self.backend_kind, self.num_threads)
+            if not backend.validate():
                 return False
-                
-            # Check for required SavedModel files
-            pb_file = os.path.join(self.model_path, "saved_model.pb")
-            variables_dir = os.path.join(self.model_path, "variables")
             
-            if not os.path.exists(pb_file):
-                logger.error(f"saved_model.pb not found in {self.model_path}")
-                return False
-                
-            if not os.path.exists(variables_dir):
-                logger.warning(f"variables/ directory not found in {self.model_path}")
-                # Some models might not have variables, continue anyway
+            backend.load()
+            if not self._explicit_version:
+                self.version = self._fingerprint(backend.artefact_paths)
+            logger.info(f"Model {self.version} loaded successfully from {self.model_path} ({backend.name})")
             
-            self.model = tf.saved_model.load(self.model_path)
-            logger.info(f"Model loaded successfully from {self.model_path}")
-            
-            # Get inference function
-            self.infer = self.model.signatures["serving_default"]
-            logger.info(f"Model input signature: {list(self.infer.structured_input_signature[1].keys())}")
-            logger.info(f"Model output signature: {list(self.infer.structured_outputs.keys())}")
+            self.input_size = backend.input_size
+            if backend.num_classes is not None:
+                self.num_classes = backend.num_classes
+                self._resolve_class_names()
             
+            self._warmup(backend)
+            self.model = backend
             return True
             
         except Exception as e:
             logger.exception(f"Failed to load model: {e}")
             return False
     
-    def preprocess_image(self, image_bytes: bytes) -> Optional[tf.Tensor]:
-        """Preprocess image for MobileNetV2 inference"""
+    def _resolve_class_names(self):
+        """Match class names to the model output width, preferring labels.txt next to the model"""
+        labels_file = os.path.join(self.model_path, "labels.txt")
+        if os.path.exists(labels_file):
+            with open(labels_file, encoding="utf-8") as f:
+                labels = [line.strip() for line in f if line.strip()]
+            if len(labels) == self.num_classes:
+                self.class_names = labels
+                logger.info(f"Class names loaded from {labels_file}")
+                return
+            logger.warning(f"{labels_file} lists {len(labels)} classes, model outputs {self.num_classes}")
+        if len(self.class_names) != self.num_classes:
+            logger.warning(f"Model outputs {self.num_classes} classes, {len(self.class_names)} names configured")
+            names = self.class_names[:self.num_classes]
+            names += [f"class_{i}" for i in range(len(names), self.num_classes)]
+            self.class_names = names
+    
+    def _warmup(self, backend: InferenceBackend):
+        """Trace and initialise the graph with a dummy batch so the first upload is not slow"""
+        dummy = np.zeros((1, self.input_size[1], self.input_size[0], 3), dtype=np.float32)
+        backend.run(dummy)
+        logger.info(f"Model warmed up ({self.num_classes} classes, input {self.input_size})")
+    
+    @staticmethod
+    def _fingerprint(artefacts: List[str]) -> str:
+        """Derive a stable model version from the model graph and weight contents"""
+        digest = hashlib.sha1()
+        for artefact in artefacts:
+            with open(artefact, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()[:12]
+    
+    def cache_key(self, image_bytes: bytes) -> str:
+        """Prediction cache key for these image bytes under the loaded model version"""
+        return PredictionCache.make_key(image_bytes, self.version)
+    
+    def decode_image(self, image_bytes: bytes) -> Optional[np.ndarray]:
+        """Decode image bytes into a [224, 224, 3] uint8 RGB array"""
         try:
             # Load image from bytes
             image = Image.open(io.BytesIO(image_bytes))
             
+            # Let libjpeg downscale in the DCT domain (1/2, 1/4, 1/8) so a UXGA
+            # frame is never decoded at full resolution; keeps size >= input_size
+            if image.format == "JPEG":
+                image.draft("RGB", self.input_size)
+            
             # Convert to RGB if needed
             if image.mode != 'RGB':
                 image = image.convert('RGB')
             
-            # Resize to model input size
-            image = image.resize(self.input_size, Image.Resampling.LANCZOS)
-            
-            # Convert to numpy array and normalize
-            img_array = np.array(image, dtype=np.float32)
-            
-            # MobileNetV2 preprocessing: scale to [-1, 1]
-            img_array = (img_array / 127.5) - 1.0
-            
-            # Add batch dimension
-            img_array = np.expand_dims(img_array, axis=0)
+            # Resize to model input size. After draft the source is at most ~2x the
+            # target, where bilinear matches LANCZOS top-1 at a fraction of the cost
+            if image.size != self.input_size:
+                image = image.resize(self.input_size, Image.Resampling.BILINEAR)
             
-            # Convert to TensorFlow tensor
-            return tf.constant(img_array)
+            return np.asarray(image, dtype=np.uint8)
             
         except Exception as e:
             logger.exception(f"Image preprocessing failed: {e}")
             return None
     
-    def predict(self, image_bytes: bytes) -> Tuple[str, float]:
+    def _normalize(self, images: List[np.ndarray]) -> np.ndarray:
+        """MobileNetV2 preprocessing into a reused float32 buffer: scale to [-1, 1]"""
+        buffer = getattr(self._buffers, "batch", None)
+        if buffer is None or buffer.shape[0] < len(images):
+            buffer = np.empty((len(images), *self.input_size[::-1], 3), dtype=np.float32)
+            self._buffers.batch = buffer
+        batch = buffer[:len(images)]
+        for out, image in zip(batch, images):
+            np.multiply(image, 1.0 / 127.5, out=out)
+        batch -= 1.0
+        return batch
+    
+    def preprocess_image(self, image_bytes: bytes) -> Optional["tf.Tensor"]:
+        """Preprocess image for MobileNetV2 inference"""
+        import tensorflow as tf
+        
+        img_array = self.decode_image(image_bytes)
+        if img_array is None:
+            return None
+        
+        # Normalize with batch dimension and convert to TensorFlow tensor
+        return tf.constant(self._normalize([img_array]))
+    
+    def predict_arrays(self, images: List[np.ndarray]) -> List[Tuple[str, float]]:
         """
-        Classify trash image and return label with confidence
+        Classify a batch of decoded images with a single forward pass
         
         Returns:
-            Tuple[str, float]: (predicted_class, confidence_score)
+            List[Tuple[str, float]]: (predicted_class, confidence_score) per image
         """
         if self.model is None:
             logger.error("Model not loaded. Call load_model() first.")
-            return "unknown", 0.0
+            return [("unknown", 0.0)] * len(images)
+        if not images:
+            return []
         
         try:
-            # Preprocess image
-            processed_image = self.preprocess_image(image_bytes)
-            if processed_image is None:
-                return "unknown", 0.0
-            
-            # Run inference
-            # Note: Input key might be different, common ones are:
-            # "input_1", "inputs", "input", "serving_default_input_1"
-            input_keys = list(self.infer.structured_input_signature[1].keys())
-            input_key = input_keys[0] if input_keys else "input_1"
-            
-            predictions = self.infer(**{input_key: processed_image})
-            
-            # Get output tensor (usually the first/only output)
-            output_keys = list(predictions.keys())
-            output_key = output_keys[0] if output_keys else "predictions"
-            output_tensor = predictions[output_key]
-            
-            # Convert to numpy and get probabilities
-            probs = tf.nn.softmax(output_tensor).numpy()[0]
-            
-            # Get predicted class and confidence
-            predicted_idx = np.argmax(probs)
-            confidence = float(probs[predicted_idx])
-            
-            # Map to class name
-            if predicted_idx < len(self.class_names):
-                predicted_class = self.class_names[predicted_idx]
-            else:
-                predicted_class = f"class_{predicted_idx}"
-            
-            logger.info(f"Prediction: {predicted_class} (confidence: {confidence:.3f})")
-            return predicted_class, confidence
+            # Backends copy the batch in, so the thread-local buffer is free for the next call
+            indices, confidences = self.model.run(self._normalize(images))
+            
+            results = []
+            for predicted_idx, confidence in zip(indices.tolist(), confidences.tolist()):
+                # Map to class name
+                if predicted_idx < len(self.class_names):
+                    predicted_class = self.class_names[predicted_idx]
+                else:
+                    predicted_class = f"class_{predicted_idx}"
+                results.append((predicted_class, float(confidence)))
+            return results
             
         except Exception as e:
             logger.exception(f"Prediction failed: {e}")
+            return [("unknown", 0.0)] * len(images)
+    
+    def predict(self, image_bytes: bytes) -> Tuple[str, float]:
+        """
+        Classify trash image and return label with confidence
+        
+        Identical image bytes are answered from the prediction cache when one is attached.
+        
+        Returns:
+            Tuple[str, float]: (predicted_class, confidence_score)
+        """
+        if self.cache is None:
+            return self.predict_uncached(image_bytes)
+        key = self.cache_key(image_bytes)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        result = self.predict_uncached(image_bytes)
+        if result[0] != "unknown":
+            self.cache.put(key, result)
+        return result
+    
+    def predict_uncached(self, image_bytes: bytes) -> Tuple[str, float]:
+        """Decode and classify without consulting the prediction cache"""
+        if self.model is None:
+            logger.error("Model not loaded. Call load_model() first.")
+            return "unknown", 0.0
+        
+        # Preprocess image
+        img_array = self.decode_image(image_bytes)
+        if img_array is None:
             return "unknown", 0.0
+        
+        predicted_class, confidence = self.predict_arrays([img_array])[0]
+        logger.info(f"Prediction: {predicted_class} (confidence: {confidence:.3f})")
+        return predicted_class, confidence
+    
+    def unload(self):
+        """Release the backend so its memory can be reclaimed"""
+        self.model = None
+        self._buffers = threading.local()
     
     def get_class_names(self) -> List[str]:
         """Get list of class names"""
@@ -140,30 +227,3 @@ class TrashClassifier:
         self.class_names = class_names
         logger.info(f"Updated class names: {self.class_names}")
 
-
-# Global classifier instance
-_classifier_instance: Optional[TrashClassifier] = None
-
-def get_classifier() -> Optional[TrashClassifier]:
-    """Get global classifier instance"""
-    return _classifier_instance
-
-def initialize_classifier(model_path: str) -> bool:
-    """Initialize global classifier instance"""
-    global _classifier_instance
-    
-    try:
-        _classifier_instance = TrashClassifier(model_path)
-        success = _classifier_instance.load_model()
-        
-        if not success:
-            _classifier_instance = None
-            return False
-            
-        logger.info("Trash classifier initialized successfully")
-        return True
-        
-    except Exception as e:
-        logger.exception(f"Failed to initialize classifier: {e}")
-        _classifier_instance = None
-        return False
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+logger = logging.getLogger("ecotionbuddy.devices")
+
+
+class DeviceRegistry:
+    """In-memory binId -> deviceId routing table plus per-device liveness.
+
+    The ``devices`` collection is loaded at startup and reloaded on every change
+    stream event; deployments without a replica set (no change streams) fall back
+    to reloading every ``refresh_s``. Registrations through the API update the
+    table immediately. Unknown bins route to ``default_device``.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, default_device: str = "esp32cam-1",
+                 refresh_s: float = 300.0, online_window_s: float = 120.0) -> None:
+        self.collection = collection
+        self.default_device = default_device
+        self.refresh_s = refresh_s
+        self.online_window_s = online_window_s
+        self._by_bin: Dict[str, str] = {}
+        self._last_seen: Dict[str, float] = {}
+        self._last_seen_at: Dict[str, datetime] = {}
+        self._loaded_at: Optional[datetime] = None
+        self.mode = "polling"
+        self.reloads = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self) -> None:
+        mapping: Dict[str, str] = {}
+        async for doc in self.collection.find({}, {"binId": 1, "deviceId": 1}):
+            if doc.get("binId") and doc.get("deviceId"):
+                mapping[doc["binId"]] = doc["deviceId"]
+        self._by_bin = mapping
+        self._loaded_at = datetime.utcnow()
+        self.reloads += 1
+        logger.info("Loaded %d bin -> device routes", len(mapping))
+
+    async def run(self) -> None:
+        """Keep the table current: change streams if available, else periodic reloads"""
+        while True:
+            try:
+                await self.load()
+                async with self.collection.watch() as stream:
+                    self.mode = "changeStream"
+                    async for _ in stream:
+                        # The collection is tiny; reloading beats patching from deltas
+                        await self.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # noqa: BLE001 - standalone mongod rejects watch()
+                if self.mode != "polling":
+                    logger.info("Device change stream unavailable (%s); polling every %.0fs", e, self.refresh_s)
+                self.mode = "polling"
+            # Retry soon if the initial load failed, else wait a full refresh period
+            await asyncio.sleep(self.refresh_s if self._loaded_at else min(self.refresh_s, 5.0))
+
+    def route(self, bin_id: Optional[str]) -> Optional[str]:
+        """Registered device for a bin, without falling back to the default"""
+        routed = self._by_bin.get(bin_id) if bin_id else None
+        if routed:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return routed
+
+    def device_for(self, bin_id: Optional[str], device_id: Optional[str] = None) -> str:
+        """Control-topic device for a bin: explicit id, registered route, else the default"""
+        return device_id or self.route(bin_id) or self.default_device
+
+    async def register(self, bin_id: str, device_id: str, name: Optional[str] = None) -> None:
+        update: Dict[str, Any] = {"deviceId": device_id, "updatedAt": datetime.utcnow()}
+        if name is not None:
+            update["name"] = name
+        await self.collection.update_one({"binId": bin_id}, {"$set": update}, upsert=True)
+        self._by_bin[bin_id] = device_id
+
+    def seen(self, device_id: Optional[str]) -> None:
+        """Record traffic from a device (MQTT message or upload)"""
+        if not device_id:
+            return
+        self._last_seen[device_id] = time.monotonic()
+        self._last_seen_at[device_id] = datetime.utcnow()
+
+    def is_online(self, device_id: str) -> bool:
+        last = self._last_seen.get(device_id)
+        return last is not None and time.monotonic() - last <= self.online_window_s
+
+    def describe(self) -> List[Dict[str, Any]]:
+        devices: Dict[str, Dict[str, Any]] = {}
+        for bin_id, device_id in sorted(self._by_bin.items()):
+            devices.setdefault(device_id, {"deviceId": device_id, "binIds": []})["binIds"].append(bin_id)
+        for device_id in self._last_seen:
+            devices.setdefault(device_id, {"deviceId": device_id, "binIds": []})
+        for device_id, entry in devices.items():
+            seen_at = self._last_seen_at.get(device_id)
+            entry["online"] = self.is_online(device_id)
+            entry["lastSeen"] = seen_at.isoformat() if seen_at else None
+        return list(devices.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "routes": len(self._by_bin),
+            "mode": self.mode,
+            "reloads": self.reloads,
+            "loadedAt": self._loaded_at.isoformat() if self._loaded_at else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "online": sum(self.is_online(d) for d in self._last_seen),
+        }
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from .pagination import dumps
+
+logger = logging.getLogger("ecotionbuddy.event_hub")
+
+# What a subscriber's full buffer does with the next event
+DROP_POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+# Filter fields, most selective first (a subscription is indexed under the first one it sets)
+FILTER_FIELDS = ("sessionId", "userId", "binId")
+
+
+class EventHubFull(Exception):
+    """Raised when the hub already has its maximum number of subscribers"""
+
+
+class Subscription:
+    """One live client: its filters and a bounded buffer of serialized events"""
+
+    def __init__(self, transport: str, filters: Dict[str, str], max_queue: int, policy: str) -> None:
+        self.transport = transport
+        self.filters = filters
+        self.max_queue = max(1, max_queue)
+        self.policy = policy
+        self._queue: Deque[str] = deque()
+        self._ready = asyncio.Event()
+        self.closed = False
+        self.overflowed = False
+        self.delivered = 0
+        self.dropped = 0
+
+    def matches(self, keys: Dict[str, str]) -> bool:
+        return all(keys.get(field) == value for field, value in self.filters.items())
+
+    def offer(self, message: str) -> bool:
+        """Buffer ``message`` without waiting; False if it was dropped instead"""
+        if self.closed:
+            return False
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            if self.policy == "drop_newest":
+                return False
+            if self.policy == "disconnect":
+                self.overflowed = True
+                self._queue.clear()
+                self.close()
+                return False
+            self._queue.popleft()
+        self._queue.append(message)
+        self.delivered += 1
+        self._ready.set()
+        return True
+
+    def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+    async def get(self) -> Optional[str]:
+        """Next buffered event, or None once the subscription is closed and drained"""
+        while not self._queue:
+            if self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        return self._queue.popleft()
+
+
+class EventHub:
+    """In-process fan-out of live events to WebSocket and SSE clients.
+
+    Publishers (uploads, camera results, app events, the MQTT worker) call
+    ``publish`` on the event loop; it serializes the event once and appends the
+    line to the buffer of every matching subscriber without awaiting anything,
+    so a slow or stalled client never holds up ingestion. Each buffer holds at
+    most ``max_queue`` events; when full the subscriber's policy drops the
+    oldest event, drops the new one, or disconnects the client so it can
+    reconnect and catch up from ``/events/latest``. Subscriptions are indexed by
+    their most selective filter, so an event is only matched against the
+    clients watching its session, user or bin (plus unfiltered ones).
+    """
+
+    def __init__(self, max_queue: int = 256, policy: str = "drop_oldest", max_subscribers: int = 1000) -> None:
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy {policy!r} (expected one of {', '.join(DROP_POLICIES)})")
+        self.max_queue = max(1, max_queue)
+        self.policy = policy
+        self.max_subscribers = max(1, max_subscribers)
+        self._unfiltered: Set[Subscription] = set()
+        self._by_key: Dict[Tuple[str, str], Set[Subscription]] = {}
+        self._count = 0
+        self._by_transport: Dict[str, int] = {}
+        self._seq = 0
+        self.peak = 0
+        self.rejected = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.overflow_disconnects = 0
+
+    def subscribe(self, transport: str, user_id: Optional[str] = None, session_id: Optional[str] = None,
+                  bin_id: Optional[str] = None, policy: Optional[str] = None,
+                  max_queue: Optional[int] = None) -> Subscription:
+        policy = policy or self.policy
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy {policy!r} (expected one of {', '.join(DROP_POLICIES)})")
+        if self._count >= self.max_subscribers:
+            self.rejected += 1
+            raise EventHubFull(f"{self._count} subscribers connected")
+        values = {"sessionId": session_id, "userId": user_id, "binId": bin_id}
+        filters = {field: str(values[field]) for field in FILTER_FIELDS if values[field]}
+        # The client may ask for a smaller buffer, never a larger one
+        sub = Subscription(transport, filters, min(max_queue or self.max_queue, self.max_queue), policy)
+        if filters:
+            self._by_key.setdefault(next(iter(filters.items())), set()).add(sub)
+        else:
+            self._unfiltered.add(sub)
+        self._count += 1
+        self._by_transport[transport] = self._by_transport.get(transport, 0) + 1
+        self.peak = max(self.peak, self._count)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        sub.close()
+        key = next(iter(sub.filters.items()), None)
+        bucket = self._by_key.get(key, set()) if key else self._unfiltered
+        if sub not in bucket:
+            return
+        bucket.discard(sub)
+        if key and not bucket:
+            del self._by_key[key]
+        self._count -= 1
+        self._by_transport[sub.transport] -= 1
+
+    def publish(self, kind: str, data: Dict[str, Any], user_id: Optional[str] = None,
+                session_id: Optional[str] = None, bin_id: Optional[str] = None) -> int:
+        """Fan ``data`` out to matching subscribers; returns how many buffered it.
+
+        Filter keys default to the event's own ``userId``, ``sessionId`` (or
+        ``sid``) and ``binId`` fields.
+        """
+        self.published += 1
+        values = {
+            "userId": user_id or data.get("userId"),
+            "sessionId": session_id or data.get("sessionId") or data.get("sid"),
+            "binId": bin_id or data.get("binId"),
+        }
+        keys = {field: str(value) for field, value in values.items() if value}
+        targets: List[Subscription] = list(self._unfiltered)
+        for field, value in keys.items():
+            targets.extend(self._by_key.get((field, value), ()))
+        targets = [sub for sub in targets if sub.matches(keys)]
+        if not targets:
+            return 0
+        self._seq += 1
+        try:
+            line = dumps({"seq": self._seq, "type": kind, "ts": datetime.utcnow(), **keys, "data": data})
+        except (TypeError, ValueError) as e:
+            logger.warning("Dropping unserializable %s event: %s", kind, e)
+            return 0
+        buffered = 0
+        for sub in targets:
+            dropped = sub.dropped
+            if sub.offer(line):
+                buffered += 1
+            self.dropped += sub.dropped - dropped
+            if sub.overflowed:
+                self.overflow_disconnects += 1
+                logger.info("Disconnecting slow %s subscriber %s", sub.transport, sub.filters or "(all events)")
+                self.unsubscribe(sub)
+        self.delivered += buffered
+        return buffered
+
+    def close(self) -> None:
+        """End every subscription (on shutdown), letting the endpoints finish their streams"""
+        for sub in [*self._unfiltered, *(sub for bucket in self._by_key.values() for sub in bucket)]:
+            self.unsubscribe(sub)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connections": self._count,
+            "connectionsByTransport": dict(self._by_transport),
+            "peakConnections": self.peak,
+            "maxSubscribers": self.max_subscribers,
+            "rejected": self.rejected,
+            "queueMax": self.max_queue,
+            "policy": self.policy,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "overflowDisconnects": self.overflow_disconnects,
+        }
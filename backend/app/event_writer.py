@@ -0,0 +1,174 @@
+import asyncio
+import contextlib
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import BulkWriteError, ConnectionFailure, OperationFailure, PyMongoError
+
+from .metrics import Histogram
+
+logger = logging.getLogger("ecotionbuddy.events")
+
+DUPLICATE_KEY = 11000
+
+_Pending = Tuple[Dict[str, Any], Optional["asyncio.Future[None]"]]
+
+
+def _is_transient(error: PyMongoError) -> bool:
+    if isinstance(error, ConnectionFailure):  # includes AutoReconnect and NetworkTimeout
+        return True
+    return isinstance(error, OperationFailure) and error.has_error_label("RetryableWriteError")
+
+
+class EventWriter:
+    """Coalesces event inserts into unordered ``insert_many`` batches.
+
+    A batch is flushed once ``max_batch`` documents are buffered or the oldest has
+    waited ``flush_interval_ms``. Documents get their ``_id`` on submission, so a
+    batch retried after a transient error cannot insert duplicates: rows the
+    earlier attempt already wrote come back as duplicate-key errors and count as
+    written. ``write(doc)`` returns once buffered; ``write(doc, durable=True)``
+    returns once the batch holding it has been acknowledged by Mongo.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, max_batch: int = 500,
+                 flush_interval_ms: float = 25.0, max_buffer: int = 10000,
+                 retries: int = 3, retry_backoff_s: float = 0.2) -> None:
+        self.collection = collection
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000.0
+        self.max_buffer = max(self.max_batch, max_buffer)
+        self.retries = max(0, retries)
+        self.retry_backoff_s = retry_backoff_s
+        self._buffer: List[_Pending] = []
+        self._first_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._closed = False
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.failed = 0
+        self.retried = 0
+        self.batches = Histogram([1, 10, 50, 100, 250, 500, 1000])
+        self.flush_ms = Histogram([5, 10, 25, 50, 100, 250, 1000])
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop(), name="event_writer")
+
+    async def write(self, doc: Dict[str, Any], durable: bool = False) -> ObjectId:
+        """Buffer ``doc`` for insertion and return its ``_id``.
+
+        Waits for buffer space when Mongo falls behind; with ``durable`` it also
+        waits for the write and raises the Mongo error if it ultimately failed.
+        """
+        if self._closed:
+            raise RuntimeError("EventWriter is closed")
+        while len(self._buffer) >= self.max_buffer:
+            self._space.clear()
+            await self._space.wait()
+        doc.setdefault("_id", ObjectId())
+        future: Optional["asyncio.Future[None]"] = None
+        if durable:
+            future = asyncio.get_running_loop().create_future()
+        if not self._buffer:
+            self._first_at = time.monotonic()
+        self._buffer.append((doc, future))
+        if len(self._buffer) == 1 or len(self._buffer) >= self.max_batch:
+            # First document starts the flush timer; a full batch flushes at once
+            self._wakeup.set()
+        if future is not None:
+            await future
+        return doc["_id"]
+
+    async def _flush_loop(self) -> None:
+        while True:
+            if not self._buffer:
+                if self._closed:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # Let concurrent writers join the batch until it is full or old enough
+            remaining = self._first_at + self.flush_interval - time.monotonic()
+            if len(self._buffer) < self.max_batch and remaining > 0 and not self._closed:
+                self._wakeup.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                continue
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write one batch of buffered events now"""
+        batch, self._buffer = self._buffer[:self.max_batch], self._buffer[self.max_batch:]
+        if self._buffer:
+            self._first_at = time.monotonic()
+        self._space.set()
+        if not batch:
+            return
+        started = time.monotonic()
+        error = await self._insert([doc for doc, _ in batch])
+        self.flush_ms.observe((time.monotonic() - started) * 1000.0)
+        self.batches.observe(len(batch))
+        for _, future in batch:
+            if future is not None and not future.done():
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+    async def _insert(self, docs: List[Dict[str, Any]]) -> Optional[Exception]:
+        attempt = 0
+        while True:
+            try:
+                await self.collection.insert_many(docs, ordered=False)
+                self.written += len(docs)
+                return None
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                rejected = [err for err in errors if err.get("code") != DUPLICATE_KEY]
+                self.written += len(docs) - len(rejected)
+                if rejected:
+                    self.failed += len(rejected)
+                    logger.error("Rejected %d of %d events: %s", len(rejected), len(docs), rejected[0].get("errmsg"))
+                    return e
+                return None
+            except PyMongoError as e:
+                if not _is_transient(e) or attempt >= self.retries:
+                    self.failed += len(docs)
+                    logger.exception("Failed to write %d events: %s", len(docs), e)
+                    return e
+                attempt += 1
+                self.retried += 1
+                logger.warning("Transient error writing %d events (attempt %d): %s", len(docs), attempt, e)
+                await asyncio.sleep(self.retry_backoff_s * 2 ** (attempt - 1))
+            except Exception as e:  # noqa: BLE001
+                # e.g. bson.errors.InvalidDocument; never retried
+                self.failed += len(docs)
+                logger.exception("Failed to encode %d events: %s", len(docs), e)
+                return e
+
+    async def close(self) -> None:
+        """Flush everything still buffered and stop the background task"""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+        while self._buffer:
+            await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._buffer),
+            "maxBatch": self.max_batch,
+            "flushIntervalMs": self.flush_interval * 1000.0,
+            "written": self.written,
+            "failed": self.failed,
+            "retried": self.retried,
+            "batchSize": self.batches.snapshot(),
+            "flushMs": self.flush_ms.snapshot(),
+        }
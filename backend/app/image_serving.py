@@ -0,0 +1,183 @@
+import logging
+import re
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, Mapping, NamedTuple, Optional, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from .cache import LRUCache
+
+logger = logging.getLogger("ecotionbuddy.images")
+
+# Stored images are never rewritten (a new upload gets a new id), so clients may keep them forever
+IMMUTABLE = "public, max-age=31536000, immutable"
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class CachedImage(NamedTuple):
+    data: bytes
+    content_type: str
+    upload_date: Optional[datetime]
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) of a single ``bytes=`` range, or None to send the whole file.
+
+    Multi-range and malformed headers are ignored (RFC 9110 allows that);
+    a well-formed range outside the file raises 416.
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(0, size - int(last))
+        end = size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _not_modified(headers: Mapping[str, str], etag: str, last_modified: Optional[datetime]) -> bool:
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        # ETag wins over If-Modified-Since when both are sent
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+class GridFSImageServer:
+    """Serves GridFS images chunk by chunk with HTTP caching and range support.
+
+    The file is streamed from ``open_download_stream`` in ``read_size`` pieces,
+    so memory per request stays bounded whatever the image size. The file id is
+    the ETag and responses are marked immutable; conditional requests get 304
+    without reading any chunks. Images up to ``cache_item_max_bytes`` are kept
+    in an LRU of ``cache_max_bytes`` (0 disables it) once fully read, so hot
+    images skip GridFS entirely.
+    """
+
+    def __init__(self, bucket: AsyncIOMotorGridFSBucket, cache_max_bytes: int = 0,
+                 cache_item_max_bytes: int = 512 * 1024, read_size: int = 255 * 1024) -> None:
+        self.bucket = bucket
+        self.cache: Optional[LRUCache[CachedImage]] = LRUCache(cache_max_bytes) if cache_max_bytes > 0 else None
+        self.cache_item_max_bytes = cache_item_max_bytes
+        self.read_size = max(1, read_size)
+        self.served = 0
+        self.not_modified = 0
+        self.partial = 0
+        self.bytes_sent = 0
+
+    async def serve(self, file_id: ObjectId, headers: Mapping[str, str]) -> Response:
+        etag = f'"{file_id}"'
+        cached = self.cache.get(str(file_id)) if self.cache is not None else None
+        if cached is not None:
+            return self._from_memory(cached, etag, headers)
+        try:
+            grid_out = await self.bucket.open_download_stream(file_id)
+        except NoFile:
+            raise HTTPException(status_code=404, detail="Image not found")
+        size = grid_out.length
+        upload_date = grid_out.upload_date
+        content_type = (grid_out.metadata or {}).get("contentType") or "image/jpeg"
+        response_headers = self._headers(etag, upload_date)
+        if _not_modified(headers, etag, _utc(upload_date)):
+            self.not_modified += 1
+            return Response(status_code=304, headers=response_headers)
+        byte_range = parse_range(headers.get("range"), size)
+        start, end = byte_range or (0, size - 1)
+        if byte_range is not None:
+            grid_out.seek(start)
+            response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response_headers["Content-Length"] = str(end - start + 1)
+        cache_full = self.cache is not None and byte_range is None and size <= self.cache_item_max_bytes
+        self._count(byte_range is not None)
+        return StreamingResponse(
+            self._stream(grid_out, end - start + 1, file_id, content_type, upload_date, cache_full),
+            status_code=206 if byte_range is not None else 200,
+            media_type=content_type,
+            headers=response_headers,
+        )
+
+    async def _stream(self, grid_out: Any, remaining: int, file_id: ObjectId, content_type: str,
+                      upload_date: Optional[datetime], cache_full: bool) -> AsyncIterator[bytes]:
+        parts = []
+        while remaining > 0:
+            chunk = await grid_out.read(min(self.read_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            self.bytes_sent += len(chunk)
+            if cache_full:
+                parts.append(chunk)
+            yield chunk
+        if cache_full and remaining == 0 and self.cache is not None:
+            data = b"".join(parts)
+            self.cache.put(str(file_id), CachedImage(data, content_type, upload_date), len(data))
+
+    def _from_memory(self, image: CachedImage, etag: str, headers: Mapping[str, str]) -> Response:
+        response_headers = self._headers(etag, image.upload_date)
+        if _not_modified(headers, etag, _utc(image.upload_date)):
+            self.not_modified += 1
+            return Response(status_code=304, headers=response_headers)
+        size = len(image.data)
+        byte_range = parse_range(headers.get("range"), size)
+        self._count(byte_range is not None)
+        if byte_range is None:
+            self.bytes_sent += size
+            return Response(image.data, media_type=image.content_type, headers=response_headers)
+        start, end = byte_range
+        response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        self.bytes_sent += end - start + 1
+        return Response(image.data[start:end + 1], status_code=206, media_type=image.content_type,
+                        headers=response_headers)
+
+    @staticmethod
+    def _headers(etag: str, upload_date: Optional[datetime]) -> Dict[str, str]:
+        headers = {"ETag": etag, "Cache-Control": IMMUTABLE, "Accept-Ranges": "bytes"}
+        if upload_date is not None:
+            headers["Last-Modified"] = format_datetime(_utc(upload_date), usegmt=True)
+        return headers
+
+    def _count(self, partial: bool) -> None:
+        self.served += 1
+        if partial:
+            self.partial += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "served": self.served,
+            "notModified": self.not_modified,
+            "partial": self.partial,
+            "bytesSent": self.bytes_sent,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    # GridFS upload dates come back naive (UTC) unless the client is tz_aware
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
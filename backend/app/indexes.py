@@ -0,0 +1,128 @@
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger("ecotionbuddy.indexes")
+
+ASC, DESC = 1, -1
+
+
+class IndexSpec(NamedTuple):
+    collection: str
+    keys: List[Tuple[str, int]]
+    options: Dict[str, Any]
+    used_by: str
+
+    @property
+    def name(self) -> str:
+        return self.options.get("name") or "_".join(f"{field}_{direction}" for field, direction in self.keys)
+
+
+def _partial_unique(field: str) -> Dict[str, Any]:
+    # Only documents carrying the field take part; older rows predate it, and users
+    # upserted by userId from events have no email at all
+    return {"unique": True, "partialFilterExpression": {field: {"$exists": True}}}
+
+
+def declared_indexes(prediction_cache_ttl_s: Optional[int] = None, gridfs: bool = False,
+                     job_retention_s: Optional[int] = None) -> List[IndexSpec]:
+    """Indexes the API's query paths rely on, one entry per access pattern"""
+    specs = [
+        IndexSpec("events", [("ts", DESC), ("_id", DESC)], {}, "GET /events/latest (keyset pages)"),
+        IndexSpec("events", [("userId", ASC), ("eventType", ASC), ("ts", DESC), ("_id", DESC)], {},
+                  "GET /users/{id}, /users/{id}/history"),
+        IndexSpec("events", [("sessionId", ASC)], {}, "GET /session/{id}"),
+        IndexSpec("events", [("idempotencyKey", ASC)], _partial_unique("idempotencyKey"),
+                  "MQTT disposal_complete dedupe"),
+        IndexSpec("claims", [("idempotencyKey", ASC)], _partial_unique("idempotencyKey"),
+                  "MQTT disposal_complete dedupe"),
+        IndexSpec("claims", [("userId", ASC), ("ts", ASC)], {}, "mission progress recount, user_stats rebuild"),
+        IndexSpec("sessions", [("binId", ASC), ("status", ASC)], {}, "POST /iot/camera/upload"),
+        IndexSpec("sessions", [("userId", ASC), ("status", ASC), ("endedAt", DESC), ("_id", DESC)], {},
+                  "GET /users/{id}/history"),
+        IndexSpec("sessions", [("status", ASC), ("lastActionAt", ASC)], {}, "idle session sweeper"),
+        # Only sessions ended by a sweep carry sweepId
+        IndexSpec("sessions", [("sweepId", ASC)], {"sparse": True}, "idle session sweeper (read back by sweep)"),
+        IndexSpec("devices", [("binId", ASC)], {}, "POST /iot/camera/upload, POST /session/start"),
+        IndexSpec("users", [("userId", ASC)], {"unique": True}, "user lookups and point updates"),
+        IndexSpec("users", [("email", ASC)], _partial_unique("email"), "POST /users/register"),
+        IndexSpec("images", [("sessionId", ASC)], {}, "GET /session/{id}"),
+        IndexSpec("images", [("userId", ASC), ("ts", ASC)], {"partialFilterExpression": {"scanCounted": True}},
+                  "mission progress recount, user_stats rebuild"),
+        IndexSpec("completed_missions", [("userId", ASC), ("missionId", ASC), ("started_at", ASC)],
+                  {"unique": True}, "mission completion (exactly-once award)"),
+        IndexSpec("completed_missions", [("userId", ASC), ("completed_at", DESC)], {},
+                  "GET /users/{id}, /users/{id}/missions"),
+        IndexSpec("user_stats", [("userId", ASC), ("bucket", ASC)], {},
+                  "mission progress, GET /users/{id}/history summary"),
+        IndexSpec("jobs", [("sink", ASC), ("status", ASC), ("nextAttemptAt", ASC)], {}, "side-effect job claims"),
+    ]
+    if gridfs:
+        specs.append(IndexSpec("fs.files", [("metadata.sha256", ASC)], {}, "GridFS upload dedupe"))
+    if job_retention_s is not None:
+        specs.append(IndexSpec("jobs", [("finishedAt", ASC)], {"expireAfterSeconds": job_retention_s},
+                               "finished side-effect job expiry"))
+    if prediction_cache_ttl_s is not None:
+        specs.append(IndexSpec("prediction_cache", [("createdAt", ASC)],
+                               {"expireAfterSeconds": prediction_cache_ttl_s}, "prediction cache expiry"))
+    return specs
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase, specs: List[IndexSpec]) -> Dict[str, str]:
+    """Create every declared index; safe to rerun since existing ones are a no-op.
+
+    Failures (e.g. duplicate users blocking a unique index) are logged and
+    reported per index instead of stopping startup.
+    """
+    results: Dict[str, str] = {}
+    for spec in specs:
+        label = f"{spec.collection}.{spec.name}"
+        try:
+            await db[spec.collection].create_index(spec.keys, name=spec.name, **spec.options)
+            results[label] = "ok"
+        except PyMongoError as e:
+            results[label] = f"failed: {e}"
+            logger.error("Could not create index %s: %s", label, e)
+    logger.info("Index bootstrap done: %d/%d ok", sum(r == "ok" for r in results.values()), len(results))
+    return results
+
+
+async def index_report(db: AsyncIOMotorDatabase, specs: List[IndexSpec]) -> Dict[str, Any]:
+    """Declared indexes that are missing, and existing ones with no recorded use.
+
+    Usage comes from ``$indexStats``, whose counters reset when mongod restarts,
+    so "unused" means unused since ``since`` of that index.
+    """
+    report: Dict[str, Any] = {"missing": [], "unused": [], "undeclared": [], "collections": {}}
+    by_collection: Dict[str, List[IndexSpec]] = {}
+    for spec in specs:
+        by_collection.setdefault(spec.collection, []).append(spec)
+    for collection in sorted(by_collection):
+        existing = {idx["name"]: list(idx["key"].items()) async for idx in db[collection].list_indexes()}
+        try:
+            stats = await db[collection].aggregate([{"$indexStats": {}}]).to_list(length=None)
+        except PyMongoError as e:
+            logger.warning("$indexStats unavailable for %s: %s", collection, e)
+            stats = []
+        usage = {s["name"]: s.get("accesses", {}) for s in stats}
+        declared_keys = {tuple(spec.keys) for spec in by_collection[collection]}
+        for spec in by_collection[collection]:
+            if tuple(spec.keys) not in {tuple(keys) for keys in existing.values()}:
+                report["missing"].append({"collection": collection, "name": spec.name,
+                                          "keys": dict(spec.keys), "usedBy": spec.used_by})
+        for name, keys in existing.items():
+            if name == "_id_":
+                continue
+            if tuple(keys) not in declared_keys:
+                report["undeclared"].append({"collection": collection, "name": name, "keys": dict(keys)})
+            accesses = usage.get(name)
+            if accesses is not None and accesses.get("ops", 0) == 0:
+                since = accesses.get("since")
+                report["unused"].append({"collection": collection, "name": name,
+                                         "since": since.isoformat() if since else None})
+        report["collections"][collection] = {
+            name: usage.get(name, {}).get("ops") for name in existing
+        }
+    return report
@@ -0,0 +1,265 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .cache import MongoPredictionCache
+from .classifier import TrashClassifier
+from .metrics import Histogram
+
+logger = logging.getLogger("ecotionbuddy.inference")
+
+# (classifier, decoded image, caller future)
+_BatchItem = Tuple[TrashClassifier, np.ndarray, "asyncio.Future[Tuple[str, float]]"]
+
+
+class Prediction(NamedTuple):
+    label: str
+    confidence: float
+    model_version: Optional[str]
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the executor already holds its maximum number of pending jobs"""
+
+
+class InferenceExecutor:
+    """Bounded worker pool that keeps decoding and TF inference off the event loop.
+
+    With ``max_batch > 1`` decoded images from concurrent callers are collected for
+    up to ``max_wait_ms`` and classified with a single forward pass; up to
+    ``max_workers`` such batches run at once, one per pool thread.
+    """
+
+    def __init__(self, classifier_getter: Callable[[], Optional[TrashClassifier]],
+                 max_workers: int = 1, max_pending: int = 16,
+                 max_batch: int = 1, max_wait_ms: float = 5.0,
+                 shared_cache: Optional[MongoPredictionCache] = None) -> None:
+        self._get_classifier = classifier_getter
+        self.shared_cache = shared_cache
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._queue: Optional["asyncio.Queue[_BatchItem]"] = None
+        self._carry: Optional[_BatchItem] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._batch_slots: Optional[asyncio.Semaphore] = None
+        self._batch_tasks: "set[asyncio.Task]" = set()
+        bounds = [1]
+        while bounds[-1] < self.max_batch:
+            bounds.append(min(bounds[-1] * 2, self.max_batch))
+        self.batch_sizes = Histogram(bounds)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def is_full(self) -> bool:
+        return self._pending >= self.max_pending
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, fn, *args)
+
+    async def submit(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run ``fn(*args)`` on the pool, rejecting work once the backlog is full"""
+        if self.is_full():
+            self._rejected += 1
+            raise InferenceQueueFull(f"{self._pending} inference jobs pending")
+        self._pending += 1
+        try:
+            return await self._run(fn, *args)
+        finally:
+            self._pending -= 1
+            self._completed += 1
+
+    async def predict_async(self, image_bytes: bytes) -> Prediction:
+        """Classify image bytes on the inference pool, answering repeats from the cache"""
+        classifier = self._get_classifier()
+        if classifier is None:
+            logger.error("Classifier not initialized")
+            return Prediction("unknown", 0.0, None)
+        # Pin this instance: a hot swap must not unload it until we are done
+        classifier.inflight += 1
+        try:
+            key: Optional[str] = None
+            if classifier.cache is not None:
+                key = classifier.cache_key(image_bytes)
+                cached = await self._cached(classifier, key)
+                if cached is not None:
+                    return Prediction(*cached, classifier.version)
+            if self.max_batch <= 1:
+                result = await self.submit(classifier.predict_uncached, image_bytes)
+            else:
+                result = await self.submit_batched(classifier, image_bytes)
+            if key is not None:
+                self._remember(classifier, key, result)
+            return Prediction(*result, classifier.version)
+        finally:
+            classifier.inflight -= 1
+
+    async def _cached(self, classifier: TrashClassifier, key: str) -> Optional[Tuple[str, float]]:
+        assert classifier.cache is not None
+        cached = classifier.cache.get(key)
+        if cached is None and self.shared_cache is not None:
+            cached = await self.shared_cache.get(key)
+            if cached is not None:
+                classifier.cache.put(key, cached)
+        return cached
+
+    def _remember(self, classifier: TrashClassifier, key: str, result: Tuple[str, float]) -> None:
+        if classifier.cache is None or result[0] == "unknown":
+            return
+        classifier.cache.put(key, result)
+        if self.shared_cache is not None:
+            asyncio.create_task(self.shared_cache.put(key, result, classifier.version))
+
+    async def submit_batched(self, classifier: TrashClassifier, image_bytes: bytes) -> Tuple[str, float]:
+        if self.is_full():
+            self._rejected += 1
+            raise InferenceQueueFull(f"{self._pending} inference jobs pending")
+        self._pending += 1
+        try:
+            image = await self._run(classifier.decode_image, image_bytes)
+            if image is None:
+                return "unknown", 0.0
+            self._ensure_batcher()
+            assert self._queue is not None
+            future: "asyncio.Future[Tuple[str, float]]" = asyncio.get_running_loop().create_future()
+            await self._queue.put((classifier, image, future))
+            return await future
+        finally:
+            self._pending -= 1
+            self._completed += 1
+
+    async def predict_many(self, images: List[bytes]) -> List[Optional[Prediction]]:
+        """Decode a list of images in parallel and classify them in one vectorised call.
+
+        The whole list occupies a single pending slot. Entries that fail to decode
+        come back as ``None``.
+        """
+        classifier = self._get_classifier()
+        if classifier is None:
+            logger.error("Classifier not initialized")
+            return [Prediction("unknown", 0.0, None)] * len(images)
+        if self.is_full():
+            self._rejected += 1
+            raise InferenceQueueFull(f"{self._pending} inference jobs pending")
+        self._pending += 1
+        classifier.inflight += 1
+        try:
+            results: List[Optional[Tuple[str, float]]] = [None] * len(images)
+            cache = classifier.cache
+            keys: List[str] = []
+            todo: List[int] = []
+            if cache is not None:
+                # Hash on the pool: a chunk of camera frames is several MB
+                keys = await self._run(lambda: [classifier.cache_key(data) for data in images])
+            for i, key in enumerate(keys or [None] * len(images)):
+                cached = cache.get(key) if cache is not None else None
+                if cached is None:
+                    todo.append(i)
+                results[i] = cached
+            decoded = await asyncio.gather(*[self._run(classifier.decode_image, images[i]) for i in todo])
+            valid = [i for i, image in zip(todo, decoded) if image is not None]
+            arrays = [image for image in decoded if image is not None]
+            if valid:
+                self.batch_sizes.observe(len(valid))
+                predictions = await self._run(classifier.predict_arrays, arrays)
+                for i, prediction in zip(valid, predictions):
+                    results[i] = prediction
+                    if keys:
+                        self._remember(classifier, keys[i], prediction)
+            return [Prediction(*r, classifier.version) if r is not None else None for r in results]
+        finally:
+            classifier.inflight -= 1
+            self._pending -= 1
+            self._completed += 1
+
+    def _ensure_batcher(self) -> None:
+        if self._batcher is None or self._batcher.done():
+            self._queue = asyncio.Queue()
+            self._batch_slots = asyncio.Semaphore(self.max_workers)
+            self._batcher = asyncio.create_task(self._batch_loop(), name="inference_batcher")
+
+    async def _next_batch(self) -> List[_BatchItem]:
+        assert self._queue is not None
+        loop = asyncio.get_running_loop()
+        first = self._carry or await self._queue.get()
+        self._carry = None
+        batch = [first]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            try:
+                item = self._queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self._queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            if item[0] is not first[0]:
+                # Never mix models in one forward pass; start the next batch with it
+                self._carry = item
+                break
+            batch.append(item)
+        return batch
+
+    async def _batch_loop(self) -> None:
+        assert self._batch_slots is not None
+        while True:
+            # Wait for a free worker first, so the next batch keeps filling meanwhile
+            await self._batch_slots.acquire()
+            try:
+                batch = await self._next_batch()
+            except BaseException:
+                self._batch_slots.release()
+                raise
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: List[_BatchItem]) -> None:
+        assert self._batch_slots is not None
+        classifier = batch[0][0]
+        self.batch_sizes.observe(len(batch))
+        try:
+            results = await self._run(classifier.predict_arrays, [image for _, image, _ in batch])
+        except Exception as e:  # noqa: BLE001
+            logger.exception("Batched inference failed: %s", e)
+            results = [("unknown", 0.0)] * len(batch)
+        finally:
+            self._batch_slots.release()
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "maxPending": self.max_pending,
+            "maxBatch": self.max_batch,
+            "maxWaitMs": self.max_wait * 1000.0,
+            "pending": self._pending,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "batchSize": self.batch_sizes.snapshot(),
+        }
+
+    def cache_stats(self) -> Dict[str, Any]:
+        classifier = self._get_classifier()
+        return {
+            "local": classifier.cache.stats() if classifier is not None and classifier.cache is not None else None,
+            "shared": self.shared_cache.stats() if self.shared_cache is not None else None,
+        }
+
+    def shutdown(self) -> None:
+        if self._batcher is not None:
+            self._batcher.cancel()
+        for task in list(self._batch_tasks):
+            task.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,246 @@
+import asyncio
+import contextlib
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+
+from .metrics import Histogram
+
+logger = logging.getLogger("ecotionbuddy.jobs")
+
+Job = Dict[str, Any]
+
+
+class Sink:
+    """Destination for one kind of job. ``handle`` gets 1..``batch_size`` jobs sharing a group.
+
+    Raising fails the whole batch; an exception with a ``retry_after`` attribute
+    (seconds, e.g. Telegram flood control) delays the retry at least that long.
+    """
+
+    name = "sink"
+
+    def __init__(self, concurrency: int = 1, batch_size: int = 1) -> None:
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+
+    async def start(self) -> None:
+        return None
+
+    async def close(self) -> None:
+        return None
+
+    async def handle(self, jobs: List[Job]) -> None:
+        raise NotImplementedError
+
+
+class _SinkState:
+    def __init__(self, sink: Sink) -> None:
+        self.sink = sink
+        self.wakeup = asyncio.Event()
+        self.inflight = 0
+        self.done = 0
+        self.retried = 0
+        self.dead = 0
+        self.batch_sizes = Histogram([1, 2, 5, 10])
+        self.run_ms = Histogram([10, 50, 100, 250, 1000, 5000, 30000])
+
+
+class JobQueue:
+    """Durable side-effect queue in Mongo, drained by a worker pool per sink.
+
+    Jobs are documents in ``collection`` claimed atomically with
+    ``find_one_and_update``, so they survive restarts and are never run by two
+    workers at once; a job whose worker died is reclaimed once its lease
+    (``lease_s``) runs out. Failures are retried with exponential backoff up to
+    ``max_attempts``, after which the job is kept as ``failed``. A sink with
+    ``batch_size > 1`` receives the pending jobs of one group (e.g. a bin)
+    together. Finished jobs drop their payload and expire through a TTL index.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, sinks: List[Sink], max_attempts: int = 8,
+                 backoff_base_s: float = 2.0, backoff_max_s: float = 600.0, lease_s: float = 300.0,
+                 poll_interval_s: float = 5.0) -> None:
+        self.collection = collection
+        self._sinks: Dict[str, _SinkState] = {sink.name: _SinkState(sink) for sink in sinks}
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.lease = timedelta(seconds=lease_s)
+        self.poll_interval_s = poll_interval_s
+        self._tasks: List[asyncio.Task] = []
+        self._depth: Dict[str, Dict[str, int]] = {}
+        self.enqueued = 0
+        self.errors = 0
+
+    def has_sink(self, name: str) -> bool:
+        return name in self._sinks
+
+    async def start(self) -> None:
+        for name, state in self._sinks.items():
+            await state.sink.start()
+            for i in range(state.sink.concurrency):
+                self._tasks.append(asyncio.create_task(self._work(state), name=f"jobs_{name}_{i}"))
+        self._tasks.append(asyncio.create_task(self._monitor(), name="jobs_monitor"))
+
+    async def close(self) -> None:
+        """Stop the workers; jobs they were running are reclaimed after their lease"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for state in self._sinks.values():
+            with contextlib.suppress(Exception):
+                await state.sink.close()
+
+    async def enqueue(self, sink: str, payload: Dict[str, Any], group: Optional[str] = None,
+                      delay_s: float = 0.0) -> ObjectId:
+        """Persist a job; ``delay_s`` lets a burst for the same group collect into one batch"""
+        state = self._sinks[sink]
+        now = datetime.utcnow()
+        job = {
+            "sink": sink,
+            "status": "pending",
+            "group": group,
+            "payload": payload,
+            "attempts": 0,
+            "createdAt": now,
+            "nextAttemptAt": now + timedelta(seconds=delay_s),
+        }
+        result = await self.collection.insert_one(job)
+        self.enqueued += 1
+        if delay_s <= 0:
+            state.wakeup.set()
+        return result.inserted_id
+
+    async def _claim(self, sink: str, group: Any = None, grouped: bool = False) -> Optional[Job]:
+        now = datetime.utcnow()
+        query: Dict[str, Any] = {
+            "sink": sink,
+            "$or": [
+                {"status": "pending", "nextAttemptAt": {"$lte": now}},
+                {"status": "running", "lockedAt": {"$lt": now - self.lease}},
+            ],
+        }
+        if grouped:
+            query["group"] = group
+        return await self.collection.find_one_and_update(
+            query,
+            {"$set": {"status": "running", "lockedAt": now}, "$inc": {"attempts": 1}},
+            sort=[("nextAttemptAt", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _work(self, state: _SinkState) -> None:
+        sink = state.sink
+        while True:
+            try:
+                job = await self._claim(sink.name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # noqa: BLE001
+                self.errors += 1
+                logger.warning("Claiming %s jobs failed: %s", sink.name, e)
+                await asyncio.sleep(self.poll_interval_s)
+                continue
+            if job is None:
+                state.wakeup.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(state.wakeup.wait(), self.poll_interval_s)
+                continue
+            batch = [job]
+            try:
+                if sink.batch_size > 1 and job.get("group") is not None:
+                    while len(batch) < sink.batch_size:
+                        more = await self._claim(sink.name, job["group"], grouped=True)
+                        if more is None:
+                            break
+                        batch.append(more)
+                await self._run(state, batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # noqa: BLE001 - claimed jobs are retried once their lease expires
+                self.errors += 1
+                logger.exception("Running %s jobs failed: %s", sink.name, e)
+
+    async def _run(self, state: _SinkState, batch: List[Job]) -> None:
+        state.inflight += len(batch)
+        started = time.monotonic()
+        ids = [job["_id"] for job in batch]
+        try:
+            await state.sink.handle(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # noqa: BLE001
+            await self._failed(state, batch, e)
+        else:
+            state.done += len(batch)
+            await self.collection.update_many(
+                {"_id": {"$in": ids}},
+                {"$set": {"status": "done", "finishedAt": datetime.utcnow()}, "$unset": {"payload": ""}},
+            )
+        finally:
+            state.inflight -= len(batch)
+            state.batch_sizes.observe(len(batch))
+            state.run_ms.observe((time.monotonic() - started) * 1000.0)
+
+    async def _failed(self, state: _SinkState, batch: List[Job], error: Exception) -> None:
+        now = datetime.utcnow()
+        for job in batch:
+            attempts = job.get("attempts", 1)
+            if attempts >= self.max_attempts:
+                state.dead += 1
+                logger.error("%s job %s failed permanently after %d attempts: %s",
+                             state.sink.name, job["_id"], attempts, error)
+                update = {"status": "failed", "finishedAt": now, "lastError": str(error)}
+            else:
+                state.retried += 1
+                delay = min(self.backoff_max_s, self.backoff_base_s * 2 ** (attempts - 1))
+                delay = max(delay * random.uniform(0.8, 1.2), float(getattr(error, "retry_after", 0) or 0))
+                logger.warning("%s job %s failed (attempt %d), retrying in %.1fs: %s",
+                               state.sink.name, job["_id"], attempts, delay, error)
+                update = {"status": "pending", "nextAttemptAt": now + timedelta(seconds=delay),
+                          "lastError": str(error)}
+            await self.collection.update_one({"_id": job["_id"]}, {"$set": update})
+
+    async def _monitor(self) -> None:
+        """Refresh per-sink queue depth for ``stats()`` (counted in Mongo, so restarts included)"""
+        while True:
+            try:
+                depth: Dict[str, Dict[str, int]] = {name: {} for name in self._sinks}
+                pipeline = [
+                    {"$match": {"status": {"$in": ["pending", "running", "failed"]}}},
+                    {"$group": {"_id": {"sink": "$sink", "status": "$status"}, "n": {"$sum": 1}}},
+                ]
+                async for row in self.collection.aggregate(pipeline):
+                    depth.setdefault(row["_id"]["sink"], {})[row["_id"]["status"]] = row["n"]
+                self._depth = depth
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # noqa: BLE001
+                logger.warning("Job queue depth refresh failed: %s", e)
+            await asyncio.sleep(self.poll_interval_s)
+
+    def stats(self) -> Dict[str, Any]:
+        sinks = {}
+        for name, state in self._sinks.items():
+            depth = self._depth.get(name, {})
+            sinks[name] = {
+                "concurrency": state.sink.concurrency,
+                "pending": depth.get("pending", 0),
+                "running": depth.get("running", 0),
+                "failedJobs": depth.get("failed", 0),
+                "inflight": state.inflight,
+                "done": state.done,
+                "retried": state.retried,
+                "dead": state.dead,
+                "batchSize": state.batch_sizes.snapshot(),
+                "runMs": state.run_ms.snapshot(),
+            }
+        return {"enqueued": self.enqueued, "errors": self.errors, "sinks": sinks}
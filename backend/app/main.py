@@ -2,31 +2,42 @@ import os
 import asyncio
 import contextlib
 import logging
-import shutil
-import io
+import hmac
+import json
+import time
 from datetime import datetime, timedelta
-from typing import Optional, Any, Dict, List
+from typing import Optional, Any, Dict, List, Tuple
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
 from bson import ObjectId
-from fastapi.responses import StreamingResponse
+from pymongo.errors import DuplicateKeyError
+from fastapi.responses import Response, StreamingResponse
 
 from .mqtt_worker import MQTTWorker
-from .classifier import initialize_classifier, get_classifier
-from asyncio_mqtt import Client as MQTTClient  # publish control commands
-
-# Optional Telegram support
-try:  # Lazy import: keep backend running if package missing
-    from telegram import Bot  # type: ignore
-    TELEGRAM_AVAILABLE = True
-except Exception:  # pragma: no cover
-    Bot = None  # type: ignore
-    TELEGRAM_AVAILABLE = False
+from .mqtt_publisher import MQTTPublisher
+from .event_writer import EventWriter
+from .indexes import declared_indexes, ensure_indexes, index_report
+from .device_registry import DeviceRegistry
+from .session_index import ActiveSessionIndex, SessionSweeper
+from .model_registry import ModelLoadError, get_classifier, initialize_classifier, registry
+from .inference import InferenceExecutor, InferenceQueueFull, Prediction
+from .cache import MongoPredictionCache, PredictionCache
+from .batch_inputs import ArchiveTooLarge, UnsupportedArchive, read_archive_images
+from .shadow import ShadowEvaluator
+from .image_serving import GridFSImageServer
+from .storage import ImageStorage, create_storage
+from .jobs import JobQueue, Sink
+from .sinks import TELEGRAM_AVAILABLE, MirrorSink, TelegramSink
+from .user_stats import UserStats
+from .missions import AVAILABLE_MISSIONS, MissionEngine
+from .event_hub import EventHub, EventHubFull
+from .pagination import (decode_cursor, dumps, encode_cursor, keyset_filter, keyset_sort, merge_sorted,
+                         ndjson_lines, projection)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("ecotionbuddy.backend")
@@ -54,13 +65,98 @@ TELEGRAM_ENABLED = os.getenv("TELEGRAM_ENABLED", "false").lower() == "true"
 # Windows UNC path or mounted path inside container
 # e.g. r"\\\\192.168.1.104\\Roblox" (double-escaped in env) or "/mnt/share/Roblox"
 MIRROR_SHARE_PATH = os.getenv("MIRROR_SHARE_PATH") or os.getenv("TARGET_PC_FOLDER")
-
-# Image storage backend: "disk" (default) or "gridfs"
+# Side-effect jobs (Telegram, mirror) are queued in Mongo and retried with exponential backoff
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "8"))
+JOB_BACKOFF_BASE_S = float(os.getenv("JOB_BACKOFF_BASE_S", "2"))
+JOB_BACKOFF_MAX_S = float(os.getenv("JOB_BACKOFF_MAX_S", "600"))
+JOB_RETENTION_S = int(os.getenv("JOB_RETENTION_S", str(7 * 24 * 3600)))
+TELEGRAM_CONCURRENCY = int(os.getenv("TELEGRAM_CONCURRENCY", "1"))
+# Photos from one bin within this window are sent as a single media group
+TELEGRAM_BATCH_WINDOW_S = float(os.getenv("TELEGRAM_BATCH_WINDOW_S", "2"))
+MIRROR_CONCURRENCY = int(os.getenv("MIRROR_CONCURRENCY", "2"))
+
+# Image storage backend: "disk" (default), "gridfs" or "cas" (content-addressed files)
 IMAGE_STORAGE = os.getenv("IMAGE_STORAGE", "disk").lower()
+# Recent upload hashes remembered so a resent identical frame is not stored twice
+IMAGE_DEDUPE_MAX_KEYS = int(os.getenv("IMAGE_DEDUPE_MAX_KEYS", "1024"))
+# In-memory cache for hot GridFS images served by /images/{id} (0 disables)
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+IMAGE_CACHE_ITEM_MAX_BYTES = int(os.getenv("IMAGE_CACHE_ITEM_MAX_BYTES", str(512 * 1024)))
 
 # Model configuration
 MODEL_PATH = os.getenv("MODEL_PATH", "/app/model")
 MODEL_ENABLED = os.getenv("MODEL_ENABLED", "true").lower() == "true"
+# Inference runtime: auto (by MODEL_PATH: dir -> savedmodel, *.tflite, *.onnx), savedmodel, tflite, onnx
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "auto").lower()
+MODEL_NUM_THREADS = int(os.getenv("MODEL_NUM_THREADS", "0")) or None
+# Uploads that arrive while the model is still loading are answered with a "pending"
+# label and classified once it is ready; at most this many are held in memory
+MODEL_PENDING_MAX = int(os.getenv("MODEL_PENDING_MAX", "100"))
+MODEL_PENDING_TIMEOUT_S = float(os.getenv("MODEL_PENDING_TIMEOUT_S", "300"))
+# Inference pool: worker threads and how many uploads may wait before answering 503
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", "16"))
+# Micro-batching: concurrent uploads are grouped up to N images or T milliseconds (1 disables)
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+# Prediction cache for repeated frames (ESP32 retries, Android re-classification)
+PREDICTION_CACHE_ENABLED = os.getenv("PREDICTION_CACHE_ENABLED", "true").lower() == "true"
+PREDICTION_CACHE_TTL_S = float(os.getenv("PREDICTION_CACHE_TTL_S", "600"))
+PREDICTION_CACHE_MAX_BYTES = int(os.getenv("PREDICTION_CACHE_MAX_BYTES", str(1024 * 1024)))
+# Optional Mongo-backed second tier shared across restarts/replicas
+PREDICTION_CACHE_MONGO = os.getenv("PREDICTION_CACHE_MONGO", "false").lower() == "true"
+# /classify/batch limits: images per request, bytes per image, bytes per request, images per forward pass
+CLASSIFY_BATCH_MAX_FILES = int(os.getenv("CLASSIFY_BATCH_MAX_FILES", "500"))
+CLASSIFY_BATCH_MAX_FILE_BYTES = int(os.getenv("CLASSIFY_BATCH_MAX_FILE_BYTES", str(16 * 1024 * 1024)))
+CLASSIFY_BATCH_MAX_BYTES = int(os.getenv("CLASSIFY_BATCH_MAX_BYTES", str(128 * 1024 * 1024)))
+CLASSIFY_BATCH_CHUNK = int(os.getenv("CLASSIFY_BATCH_CHUNK", "32"))
+# Rows fetched from Mongo per round trip when paging and streaming NDJSON exports
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+# Shadow evaluation: a candidate model scores a sample of uploads off the request path.
+# SHADOW_MODEL_PATH loads one at startup; /admin/shadow can switch to any loaded version
+SHADOW_MODEL_PATH = os.getenv("SHADOW_MODEL_PATH")
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.1"))
+# Fraction of one CPU core the candidate may use, and how many shadow jobs may queue
+SHADOW_CPU_BUDGET = float(os.getenv("SHADOW_CPU_BUDGET", "0.25"))
+SHADOW_MAX_PENDING = int(os.getenv("SHADOW_MAX_PENDING", "4"))
+
+# Shared secret for /admin endpoints (X-Admin-Token header); admin API is off when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Event inserts are coalesced into insert_many batches of up to N docs or T milliseconds
+EVENT_BATCH_MAX = int(os.getenv("EVENT_BATCH_MAX", "500"))
+EVENT_FLUSH_INTERVAL_MS = float(os.getenv("EVENT_FLUSH_INTERVAL_MS", "25"))
+EVENT_BUFFER_MAX = int(os.getenv("EVENT_BUFFER_MAX", "10000"))
+# Incoming device events: concurrent handlers (ordered per session) and per-handler backlog
+MQTT_WORKER_CONCURRENCY = int(os.getenv("MQTT_WORKER_CONCURRENCY", "4"))
+MQTT_WORKER_QUEUE_SIZE = int(os.getenv("MQTT_WORKER_QUEUE_SIZE", "64"))
+MQTT_WORKER_INTAKE_SIZE = int(os.getenv("MQTT_WORKER_INTAKE_SIZE", "1024"))
+# Redelivered disposal_complete messages are dropped by msgId or (sessionId, seq); payloads
+# without either count as repeats when the same label arrives again within the window
+DISPOSAL_DEDUPE_WINDOW_S = float(os.getenv("DISPOSAL_DEDUPE_WINDOW_S", "5"))
+DISPOSAL_DEDUPE_MAX_KEYS = int(os.getenv("DISPOSAL_DEDUPE_MAX_KEYS", "10000"))
+# binId -> deviceId routing is cached in memory; unknown bins use DEFAULT_DEVICE_ID.
+# Reloaded on change streams (replica set) or every DEVICE_REFRESH_S otherwise
+DEFAULT_DEVICE_ID = os.getenv("DEFAULT_DEVICE_ID", "esp32cam-1")
+DEVICE_REFRESH_S = float(os.getenv("DEVICE_REFRESH_S", "300"))
+DEVICE_ONLINE_WINDOW_S = float(os.getenv("DEVICE_ONLINE_WINDOW_S", "120"))
+# Uploads without ?sid attach to the bin's active session unless it has been idle this long
+SESSION_IDLE_TIMEOUT_S = float(os.getenv("SESSION_IDLE_TIMEOUT_S", "300"))
+# Idle sessions are ended (and their device deactivated) by a sweep this often; 0 disables
+SESSION_SWEEP_INTERVAL_S = float(os.getenv("SESSION_SWEEP_INTERVAL_S", "30"))
+# Device control commands go through one persistent connection; commands queued
+# during a broker outage are dropped after MQTT_COMMAND_TTL_S
+MQTT_PUBLISH_QOS = int(os.getenv("MQTT_PUBLISH_QOS", "1"))
+MQTT_PUBLISH_QUEUE_MAX = int(os.getenv("MQTT_PUBLISH_QUEUE_MAX", "256"))
+MQTT_COMMAND_TTL_S = float(os.getenv("MQTT_COMMAND_TTL_S", "15"))
+# Live event feed (/ws/events, /events/stream): events buffered per client before its drop
+# policy applies (drop_oldest, drop_newest or disconnect), and the number of clients allowed
+EVENT_HUB_QUEUE_MAX = int(os.getenv("EVENT_HUB_QUEUE_MAX", "256"))
+EVENT_HUB_DROP_POLICY = os.getenv("EVENT_HUB_DROP_POLICY", "drop_oldest").lower()
+EVENT_HUB_MAX_SUBSCRIBERS = int(os.getenv("EVENT_HUB_MAX_SUBSCRIBERS", "1000"))
+# Idle SSE streams get a comment this often so proxies do not close them
+EVENT_HUB_HEARTBEAT_S = float(os.getenv("EVENT_HUB_HEARTBEAT_S", "15"))
 
 # Public endpoints/hosts for external clients (Android/ESP32) to discover
 PUBLIC_API_BASE = os.getenv("PUBLIC_API_BASE")  # e.g. https://ecotionbuddy.ecotionbuddy.com/
@@ -68,40 +164,83 @@ PUBLIC_MQTT_HOST = os.getenv("PUBLIC_MQTT_HOST")  # e.g. 192.168.1.144
 PUBLIC_MQTT_PORT = int(os.getenv("PUBLIC_MQTT_PORT", os.getenv("MQTT_PORT", "1883")))
 
 
-async def _send_telegram_photo(local_path: str, caption: str) -> bool:
-    if not (TELEGRAM_ENABLED and TELEGRAM_AVAILABLE and TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID):
-        return False
+def _side_effect_sinks(storage: ImageStorage) -> List[Sink]:
+    # Jobs reference the stored upload; sinks read the bytes back from storage when they run
+    sinks: List[Sink] = []
+    if TELEGRAM_ENABLED and TELEGRAM_AVAILABLE and TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID:
+        sinks.append(TelegramSink(TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, storage.load, concurrency=TELEGRAM_CONCURRENCY))
+    if MIRROR_SHARE_PATH:
+        sinks.append(MirrorSink(MIRROR_SHARE_PATH, storage.load, concurrency=MIRROR_CONCURRENCY))
+    return sinks
+
+
+async def _load_classifier(app: FastAPI, cache: Optional[PredictionCache]) -> None:
+    """Import TF and load the model in a worker thread while the API already serves"""
+    app.state.model_state = "loading"
+    logger.info(f"Initializing classifier from {MODEL_PATH}")
+    started = time.monotonic()
     try:
-        assert Bot is not None  # for type checkers
-        bot = Bot(token=TELEGRAM_BOT_TOKEN)
-        # Open file in a thread to avoid blocking loop
-        def _open_bytes() -> bytes:
-            with open(local_path, "rb") as f:
-                return f.read()
-        photo_bytes = await asyncio.to_thread(_open_bytes)
-        await bot.send_photo(chat_id=TELEGRAM_CHAT_ID, photo=photo_bytes, caption=caption)
-        logger.info("Telegram photo sent: %s", os.path.basename(local_path))
-        return True
+        model_success = await asyncio.to_thread(
+            initialize_classifier, MODEL_PATH, cache=cache, backend=MODEL_BACKEND, num_threads=MODEL_NUM_THREADS
+        )
+    except Exception:  # noqa: BLE001
+        logger.exception("Classifier initialization crashed")
+        model_success = False
+    if model_success:
+        app.state.model_state = "ready"
+        logger.info("Classifier initialized successfully in %.1fs", time.monotonic() - started)
+    else:
+        app.state.model_state = "failed"
+        logger.warning("Classifier initialization failed - using placeholder labels")
+    # Wake pending classifications either way; they give up if the model failed
+    app.state.model_ready.set()
+
+
+async def _bootstrap_indexes(app: FastAPI) -> None:
+    try:
+        app.state.index_status = await ensure_indexes(app.state.db, app.state.index_specs)
     except Exception as e:  # noqa: BLE001
-        logger.exception("Failed to send Telegram photo: %s", e)
-        return False
+        logger.exception("Index bootstrap failed: %s", e)
 
 
-async def _mirror_to_share(local_path: str, filename: str) -> bool:
-    if not MIRROR_SHARE_PATH:
-        return False
+async def _load_shadow_model(app: FastAPI) -> None:
+    """Load the startup shadow candidate once the primary model is serving"""
+    await app.state.model_ready.wait()
+    if get_classifier() is None:
+        return
     try:
-        # Validate dest directory exists (inside host or container namespace)
-        if not os.path.exists(MIRROR_SHARE_PATH):
-            logger.warning("Mirror path not accessible: %s", MIRROR_SHARE_PATH)
-            return False
-        dest_path = os.path.join(MIRROR_SHARE_PATH, filename)
-        await asyncio.to_thread(shutil.copy2, local_path, dest_path)
-        logger.info("Mirrored file to share: %s", dest_path)
-        return True
+        candidate = await registry.load_async(SHADOW_MODEL_PATH, activate=False)
     except Exception as e:  # noqa: BLE001
-        logger.exception("Failed to mirror to share: %s", e)
-        return False
+        logger.exception("Failed to load shadow model from %s: %s", SHADOW_MODEL_PATH, e)
+        return
+    app.state.shadow.configure(candidate.version)
+
+
+async def _classify_when_ready(image_id: ObjectId, data: bytes) -> None:
+    """Classify an upload that arrived before the model finished loading"""
+    try:
+        await asyncio.wait_for(app.state.model_ready.wait(), timeout=MODEL_PENDING_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        logger.warning("Model still not ready, leaving image %s pending", image_id)
+        return
+    if get_classifier() is None:
+        return
+    while True:
+        try:
+            prediction = await app.state.inference.predict_async(data)
+            break
+        except InferenceQueueFull:
+            await asyncio.sleep(0.5)
+    await app.state.db.images.update_one(
+        {"_id": image_id},
+        {"$set": {
+            "label": prediction.label,
+            "confidence": prediction.confidence,
+            "modelVersion": prediction.model_version,
+            "classifiedAt": datetime.utcnow(),
+        }},
+    )
+    logger.info("Deferred classification for image %s: %s (%.3f)", image_id, prediction.label, prediction.confidence)
 
 
 @asynccontextmanager
@@ -118,37 +257,192 @@ async def lifespan(app: FastAPI):
     if IMAGE_STORAGE == "gridfs":
         try:
             app.state.gridfs = AsyncIOMotorGridFSBucket(db)
+            app.state.image_server = GridFSImageServer(
+                app.state.gridfs,
+                cache_max_bytes=IMAGE_CACHE_MAX_BYTES,
+                cache_item_max_bytes=IMAGE_CACHE_ITEM_MAX_BYTES,
+            )
             logger.info("GridFS storage enabled")
         except Exception as e:  # noqa: BLE001
             logger.exception("Failed to init GridFS bucket: %s", e)
             raise
+    app.state.storage = create_storage(
+        IMAGE_STORAGE,
+        UPLOADS_DIR,
+        bucket=getattr(app.state, "gridfs", None),
+        files=db["fs.files"],
+        dedupe_max_keys=IMAGE_DEDUPE_MAX_KEYS,
+    )
 
     # expose for endpoints/publishers
     app.state.mqtt_host = mqtt_host
     app.state.mqtt_port = mqtt_port
 
-    worker = MQTTWorker(db=db, host=mqtt_host, port=mqtt_port)
+    event_writer = EventWriter(
+        db.events,
+        max_batch=EVENT_BATCH_MAX,
+        flush_interval_ms=EVENT_FLUSH_INTERVAL_MS,
+        max_buffer=EVENT_BUFFER_MAX,
+    )
+    event_writer.start()
+    app.state.event_writer = event_writer
+
+    devices = DeviceRegistry(
+        db.devices,
+        default_device=DEFAULT_DEVICE_ID,
+        refresh_s=DEVICE_REFRESH_S,
+        online_window_s=DEVICE_ONLINE_WINDOW_S,
+    )
+    app.state.devices = devices
+    devices_task = asyncio.create_task(devices.run(), name="device_registry")
+
+    event_hub = EventHub(
+        max_queue=EVENT_HUB_QUEUE_MAX,
+        policy=EVENT_HUB_DROP_POLICY,
+        max_subscribers=EVENT_HUB_MAX_SUBSCRIBERS,
+    )
+    app.state.event_hub = event_hub
+
+    user_stats = UserStats(db.user_stats)
+    app.state.user_stats = user_stats
+    missions = MissionEngine(db.users, db.completed_missions)
+    app.state.missions = missions
+
+    active_sessions = ActiveSessionIndex(db.sessions, idle_timeout_s=SESSION_IDLE_TIMEOUT_S)
+    app.state.active_sessions = active_sessions
+    sessions_task = asyncio.create_task(active_sessions.rebuild(), name="active_session_rebuild")
+
+    worker = MQTTWorker(
+        db=db,
+        host=mqtt_host,
+        port=mqtt_port,
+        concurrency=MQTT_WORKER_CONCURRENCY,
+        queue_size=MQTT_WORKER_QUEUE_SIZE,
+        intake_size=MQTT_WORKER_INTAKE_SIZE,
+        event_writer=event_writer,
+        dedupe_window_s=DISPOSAL_DEDUPE_WINDOW_S,
+        dedupe_max_keys=DISPOSAL_DEDUPE_MAX_KEYS,
+        device_registry=devices,
+        active_sessions=active_sessions,
+        user_stats=user_stats,
+        missions=missions,
+        event_hub=event_hub,
+    )
+
     app.state.mqtt_worker = worker
     mqtt_task = asyncio.create_task(worker.run(), name="mqtt_worker")
-
-    # Initialize ML model if enabled
+    publisher = MQTTPublisher(
+        host=mqtt_host,
+        port=mqtt_port,
+        qos=MQTT_PUBLISH_QOS,
+        max_queue=MQTT_PUBLISH_QUEUE_MAX,
+        command_ttl_s=MQTT_COMMAND_TTL_S,
+    )
+    app.state.mqtt_publisher = publisher
+    publisher_task = asyncio.create_task(publisher.run(), name="mqtt_publisher")
+
+    jobs = JobQueue(
+        db.jobs,
+        _side_effect_sinks(app.state.storage),
+        max_attempts=JOB_MAX_ATTEMPTS,
+        backoff_base_s=JOB_BACKOFF_BASE_S,
+        backoff_max_s=JOB_BACKOFF_MAX_S,
+    )
+    await jobs.start()
+    app.state.jobs = jobs
+
+    sweeper = SessionSweeper(
+        db.sessions,
+        active_sessions,
+        publisher.publish,
+        default_device=DEFAULT_DEVICE_ID,
+        ttl_s=SESSION_IDLE_TIMEOUT_S,
+        interval_s=SESSION_SWEEP_INTERVAL_S,
+        user_stats=user_stats,
+        missions=missions,
+        event_hub=event_hub,
+    )
+    app.state.session_sweeper = sweeper
+    sweeper_task: Optional[asyncio.Task] = None
+    if SESSION_SWEEP_INTERVAL_S > 0:
+        sweeper_task = asyncio.create_task(sweeper.run(), name="session_sweeper")
+
+    prediction_cache: Optional[PredictionCache] = None
+    shared_cache: Optional[MongoPredictionCache] = None
+    if PREDICTION_CACHE_ENABLED:
+        prediction_cache = PredictionCache(PREDICTION_CACHE_MAX_BYTES, PREDICTION_CACHE_TTL_S)
+        if PREDICTION_CACHE_MONGO:
+            shared_cache = MongoPredictionCache(db.prediction_cache)
+
+    # Create indexes in the background; queries work (slower) until they are built
+    app.state.index_specs = declared_indexes(
+        shared_cache.ttl_seconds if shared_cache else None,
+        gridfs=IMAGE_STORAGE == "gridfs",
+        job_retention_s=JOB_RETENTION_S,
+    )
+    app.state.index_status = {}
+    index_task = asyncio.create_task(_bootstrap_indexes(app), name="index_bootstrap")
+
+    # Initialize ML model in the background so non-ML endpoints are up immediately
+    app.state.model_ready = asyncio.Event()
+    app.state.pending_classifications = set()
+    app.state.admin_tasks = set()
+    model_task: Optional[asyncio.Task] = None
     if MODEL_ENABLED:
-        logger.info(f"Initializing classifier from {MODEL_PATH}")
-        model_success = initialize_classifier(MODEL_PATH)
-        if model_success:
-            logger.info("Classifier initialized successfully")
-        else:
-            logger.warning("Classifier initialization failed - using placeholder labels")
+        model_task = asyncio.create_task(_load_classifier(app, prediction_cache), name="model_loader")
+        if SHADOW_MODEL_PATH:
+            shadow_task = asyncio.create_task(_load_shadow_model(app), name="shadow_model_loader")
+            app.state.admin_tasks.add(shadow_task)
+            shadow_task.add_done_callback(app.state.admin_tasks.discard)
     else:
+        app.state.model_state = "disabled"
+        app.state.model_ready.set()
         logger.info("Model disabled - using placeholder labels")
+    app.state.inference = InferenceExecutor(
+        get_classifier,
+        max_workers=INFERENCE_WORKERS,
+        max_pending=INFERENCE_MAX_PENDING,
+        max_batch=INFERENCE_MAX_BATCH,
+        max_wait_ms=INFERENCE_MAX_WAIT_MS,
+        shared_cache=shared_cache,
+    )
+    app.state.shadow = ShadowEvaluator(
+        db.images,
+        registry.get,
+        sample_rate=SHADOW_SAMPLE_RATE,
+        cpu_budget=SHADOW_CPU_BUDGET,
+        max_pending=SHADOW_MAX_PENDING,
+    )
 
     try:
         yield
     finally:
+        # Ends open WebSocket/SSE streams so the server is not kept waiting on them
+        event_hub.close()
+        index_task.cancel()
+        devices_task.cancel()
+        sessions_task.cancel()
+        if sweeper_task is not None:
+            sweeper_task.cancel()
+        if model_task is not None:
+            model_task.cancel()
+        for task in list(app.state.admin_tasks):
+            task.cancel()
+        for task in list(app.state.pending_classifications):
+            task.cancel()
+        app.state.inference.shutdown()
+        app.state.shadow.shutdown()
         worker.stop()
+        publisher.stop()
         mqtt_task.cancel()
+        publisher_task.cancel()
         with contextlib.suppress(asyncio.CancelledError):
             await mqtt_task
+        with contextlib.suppress(asyncio.CancelledError):
+            await publisher_task
+        await jobs.close()
+        # After the MQTT worker stopped so its last events are included
+        await event_writer.close()
         mongo_client.close()
         logger.info("Backend shutdown complete")
 
@@ -218,17 +512,13 @@ class AndroidEvent(BaseModel):
     payload: Optional[Dict[str, Any]] = Field(default=None)
 
 
-# ===== Helper: MQTT publish (ad-hoc connection) =====
+# ===== Helper: MQTT publish (persistent publisher) =====
 async def mqtt_publish(app: FastAPI, topic: str, payload: Dict[str, Any]) -> None:
-    host: str = getattr(app.state, "mqtt_host", "mqtt")
-    port: int = getattr(app.state, "mqtt_port", 1883)
+    # Enqueue only; the lifespan-owned publisher delivers and retries in the background
     try:
-        async with MQTTClient(host, port) as client:
-            import json as _json
-            await client.publish(topic, _json.dumps(payload))
-            logger.info("Published MQTT to %s: %s", topic, payload)
+        app.state.mqtt_publisher.publish(topic, payload)
     except Exception as e:  # noqa: BLE001
-        logger.exception("Failed to publish MQTT to %s: %s", topic, e)
+        logger.exception("Failed to queue MQTT publish to %s: %s", topic, e)
 
 
 @app.post("/iot/camera/upload", tags=["iot"])  # Content-Type: image/jpeg, raw body
@@ -237,87 +527,125 @@ async def iot_camera_upload(request: Request, deviceId: Optional[str] = None, bi
         data = await request.body()
         if not data:
             raise HTTPException(status_code=400, detail="Empty body")
+        app.state.devices.seen(deviceId)
+        classifier = get_classifier()
+        if classifier and MODEL_ENABLED and app.state.inference.is_full():
+            # Fail fast before storing anything so the device can retry later
+            raise HTTPException(status_code=503, detail="Classifier busy")
         ts = datetime.utcnow()
-        fname = ts.strftime("%Y%m%dT%H%M%S%f") + ".jpg"
-        fpath = os.path.join(UPLOADS_DIR, fname)
-        with open(fpath, "wb") as f:
-            f.write(data)
-        # Decide storage URL and optionally upload to GridFS
-        url = f"/uploads/{fname}"
-        gridfs_id: Optional[ObjectId] = None
-        if IMAGE_STORAGE == "gridfs":
+        # Persist (off the event loop) while the model runs; the response waits for both
+        store_task = asyncio.create_task(app.state.storage.save(
+            data,
+            ts,
+            {"deviceId": deviceId, "binId": binId, "contentType": "image/jpeg", "origin": "iot"},
+        ))
+
+        # ML model classification
+        model_pending = False
+        classifier_busy = False
+        model_version: Optional[str] = None
+        prediction: Optional[Prediction] = None
+        if classifier and MODEL_ENABLED:
             try:
-                gridfs_id = await app.state.gridfs.upload_from_stream(
-                    fname,
-                    io.BytesIO(data),
-                    metadata={
-                        "deviceId": deviceId,
-                        "binId": binId,
-                        "contentType": "image/jpeg",
-                        "ts": ts,
-                        "origin": "iot",
-                    },
-                )
-                url = f"/images/{str(gridfs_id)}"
-                logger.info("Stored image in GridFS: %s", gridfs_id)
-            except Exception as e:  # noqa: BLE001
-                logger.exception("GridFS upload failed, falling back to disk url: %s", e)
+                started = time.perf_counter()
+                prediction = await app.state.inference.predict_async(data)
+                primary_ms = (time.perf_counter() - started) * 1000.0
+                label, confidence, model_version = prediction
+                logger.info(f"Model prediction: {label} (confidence: {confidence:.3f})")
+            except InferenceQueueFull:
+                # The image may already be written; keep it on record and still answer 503
+                classifier_busy = True
+                label = "unclassified"
+                confidence = 0.0
+            except Exception as e:
+                logger.exception(f"Model inference failed: {e}")
+                label = "unknown"
+                confidence = 0.0
+        elif MODEL_ENABLED and app.state.model_state == "loading":
+            # Model still loading: answer now, classify in the background once ready
+            model_pending = True
+            label = "pending"
+            confidence = 0.0
+        else:
+            # Fallback to placeholder
+            label = "placeholder"
+            confidence = 0.099
 
+        stored = await store_task
         doc = {
             "deviceId": deviceId,
             "binId": binId,
-            "filename": fname,
-            "path": fpath,
-            "url": url,
+            "filename": stored.filename,
+            "path": stored.path,
+            "url": stored.url,
             "size": len(data),
+            "sha256": stored.digest,
             "contentType": "image/jpeg",
             "ts": ts,
             "origin": "iot",
-            "storage": IMAGE_STORAGE,
+            "storage": stored.storage,
+            "label": label,
+            "confidence": confidence,
+            "modelVersion": model_version,
         }
-        if gridfs_id is not None:
-            doc["gridfsId"] = str(gridfs_id)
+        if stored.gridfs_id is not None:
+            doc["gridfsId"] = str(stored.gridfs_id)
+        if stored.deduplicated:
+            doc["deduplicated"] = True
+        # Attach to the bin's active session before inserting, so the image is one write
+        if not sid and binId:
+            sid = await app.state.active_sessions.lookup(binId)
         if sid:
             doc["sessionId"] = sid
+            # An upload is session activity: keep it from going idle (index lookups, sweeper)
+            app.state.active_sessions.touch(sid, ts)
+            if ObjectId.is_valid(sid):
+                await app.state.db.sessions.update_one(
+                    {"_id": ObjectId(sid), "status": "active"}, {"$set": {"lastActionAt": ts}}
+                )
+        session_user = app.state.active_sessions.user_for(sid) if sid else None
+        # A bin-camera classification during a user's session counts as that user's scan
+        counts_as_scan = bool(session_user and prediction is not None and prediction.label != "unknown")
+        if counts_as_scan and stored.deduplicated:
+            # Once per frame: device retries of a frame already counted in this session are not
+            # counted again, while a retry after a 503 (never counted) still is
+            counts_as_scan = await app.state.db.images.find_one(
+                {"sessionId": sid, "sha256": stored.digest, "scanCounted": True}, {"_id": 1}
+            ) is None
+        if counts_as_scan:
+            # Marks the image for UserStats.rebuild, which counts the same scans
+            doc["userId"] = session_user
+            doc["scanCounted"] = True
         insert_res = await app.state.db.images.insert_one(doc)
         image_id = insert_res.inserted_id
-
-        # Try to attach to active session by binId if no sid provided
-        active_session: Optional[Dict[str, Any]] = None
-        if not sid and binId:
-            active_session = await app.state.db.sessions.find_one({
-                "binId": binId,
-                "status": "active",
-            })
-            if active_session:
-                sid = str(active_session.get("_id"))
-                doc["sessionId"] = sid
-                await app.state.db.images.update_one({"_id": image_id}, {"$set": {"sessionId": sid}})
-
-        # ML model classification
-        classifier = get_classifier()
-        if classifier and MODEL_ENABLED:
-            try:
-                label, confidence = classifier.predict(data)
-                logger.info(f"Model prediction: {label} (confidence: {confidence:.3f})")
-            except Exception as e:
-                logger.exception(f"Model inference failed: {e}")
-                label = "unknown"
-                confidence = 0.0
-        else:
-            # Fallback to placeholder
-            label = "placeholder"
-            confidence = 0.099
+        if classifier_busy:
+            # Recorded as unclassified; no scan, open command or side effects, and the device retries
+            raise HTTPException(status_code=503, detail="Classifier busy")
+        if model_pending and len(app.state.pending_classifications) < MODEL_PENDING_MAX:
+            task = asyncio.create_task(_classify_when_ready(image_id, data))
+            app.state.pending_classifications.add(task)
+            task.add_done_callback(app.state.pending_classifications.discard)
+        app.state.event_hub.publish("image", {
+            "imageId": image_id,
+            "deviceId": deviceId,
+            "url": doc["url"],
+            "label": label,
+            "confidence": confidence,
+            "modelVersion": model_version,
+        }, user_id=session_user, session_id=sid, bin_id=binId)
+        if prediction is not None and prediction.label != "unknown":
+            app.state.shadow.maybe_submit(image_id, data, prediction, primary_ms)
+            if counts_as_scan:
+                await app.state.user_stats.record_scan(session_user, prediction.label, ts)
+                await app.state.missions.on_scan(session_user, prediction.label, ts)
 
         # If session exists and classified compatible, command device to open
         try:
             if binId:
-                # resolve deviceId mapping if missing
+                # resolve deviceId mapping if missing (in-memory routing table)
                 if not deviceId:
-                    dev_map = await app.state.db.devices.find_one({"binId": binId})
-                    if dev_map:
-                        deviceId = dev_map.get("deviceId")
-                target_device = deviceId or "esp32cam-1"
+                    deviceId = app.state.devices.route(binId)
+                target_device = deviceId or app.state.devices.default_device
                 topic = f"ecotionbuddy/ctrl/{target_device}"
                 payload = {"action": "open", "angle": 180, "reason": "classification", "binId": binId}
                 if sid:
@@ -325,16 +653,23 @@ async def iot_camera_upload(request: Request, deviceId: Optional[str] = None, bi
                 await mqtt_publish(app, topic, payload)
         except Exception:  # noqa: BLE001
             logger.exception("Failed to publish open command")
-        # Schedule best-effort side effects (non-blocking)
+        # Queue best-effort side effects; the job workers deliver and retry them
         caption = f"Deteksi baru pada {ts.isoformat()}"
         try:
-            asyncio.create_task(_send_telegram_photo(fpath, caption))
+            if app.state.jobs.has_sink("telegram"):
+                await app.state.jobs.enqueue(
+                    "telegram",
+                    {"image": stored.ref(), "filename": stored.filename, "caption": caption},
+                    group=binId or deviceId,
+                    delay_s=TELEGRAM_BATCH_WINDOW_S,
+                )
         except Exception:  # noqa: BLE001
-            logger.exception("Failed to schedule telegram task")
+            logger.exception("Failed to queue telegram job")
         try:
-            asyncio.create_task(_mirror_to_share(fpath, fname))
+            if app.state.jobs.has_sink("mirror"):
+                await app.state.jobs.enqueue("mirror", {"image": stored.ref(), "filename": stored.filename})
         except Exception:  # noqa: BLE001
-            logger.exception("Failed to schedule mirror task")
+            logger.exception("Failed to queue mirror job")
 
         return {
             "status": "ok",
@@ -344,12 +679,14 @@ async def iot_camera_upload(request: Request, deviceId: Optional[str] = None, bi
             "binId": binId,
             "sessionId": sid,
             "sideEffects": {
-                "telegramScheduled": bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID and TELEGRAM_AVAILABLE),
-                "mirrorScheduled": bool(MIRROR_SHARE_PATH),
+                "telegramScheduled": app.state.jobs.has_sink("telegram"),
+                "mirrorScheduled": app.state.jobs.has_sink("mirror"),
             },
-            "storage": IMAGE_STORAGE,
+            "storage": stored.storage,
+            "deduplicated": stored.deduplicated,
             "label": label,
             "confidence": confidence,
+            "modelVersion": model_version,
         }
     except HTTPException:
         raise
@@ -363,10 +700,33 @@ async def iot_camera_result(evt: IoTCameraResult):
     doc = evt.model_dump()
     doc["origin"] = "iot"
     doc["ts"] = datetime.utcnow()
-    await app.state.db.events.insert_one(doc)
+    await app.state.event_writer.write(doc)
+    sid = await app.state.active_sessions.lookup(evt.binId) if evt.binId else None
+    app.state.event_hub.publish("camera_result", doc, user_id=app.state.active_sessions.user_for(sid) if sid else None,
+                                session_id=sid)
     return {"status": "ok"}
 
 
+# ===== Device routing =====
+class RegisterDeviceRequest(BaseModel):
+    binId: str
+    deviceId: str
+    name: Optional[str] = None
+
+
+@app.post("/devices/register", tags=["iot"])
+async def register_device(req: RegisterDeviceRequest):
+    """Map a bin to the ESP32 whose control topic opens it; takes effect immediately"""
+    await app.state.devices.register(req.binId, req.deviceId, req.name)
+    return {"status": "ok", "binId": req.binId, "deviceId": req.deviceId}
+
+
+@app.get("/devices", tags=["iot"])
+async def list_devices():
+    """Known devices with their bins and online state (traffic within DEVICE_ONLINE_WINDOW_S)"""
+    return {"devices": app.state.devices.describe(), "defaultDeviceId": app.state.devices.default_device}
+
+
 # ===== QR-driven sessions =====
 class StartSessionRequest(BaseModel):
     userId: str
@@ -379,13 +739,7 @@ class StartSessionRequest(BaseModel):
 async def start_session(req: StartSessionRequest):
     ts = datetime.utcnow()
     # resolve deviceId mapping
-    device_id = req.deviceId
-    if not device_id:
-        dev_map = await app.state.db.devices.find_one({"binId": req.binId})
-        if dev_map:
-            device_id = dev_map.get("deviceId")
-    if not device_id:
-        device_id = "esp32cam-1"
+    device_id = app.state.devices.device_for(req.binId, req.deviceId)
 
     # create session
     session = {
@@ -398,6 +752,7 @@ async def start_session(req: StartSessionRequest):
     }
     result = await app.state.db.sessions.insert_one(session)
     sid = str(result.inserted_id)
+    app.state.active_sessions.start(req.binId, sid, req.userId, device_id, ts)
 
     # publish activation to device
     topic = f"ecotionbuddy/ctrl/{device_id}"
@@ -418,10 +773,21 @@ async def end_session(req: EndSessionRequest):
     sdoc = await app.state.db.sessions.find_one({"_id": ObjectId(sid)})
     if not sdoc:
         raise HTTPException(status_code=404, detail="Session not found")
-    await app.state.db.sessions.update_one({"_id": ObjectId(sid)}, {"$set": {"status": "ended", "endedAt": datetime.utcnow(), "reason": req.reason or "client_end"}})
+    ended_at = datetime.utcnow()
+    result = await app.state.db.sessions.update_one(
+        {"_id": ObjectId(sid), "status": {"$ne": "ended"}},
+        {"$set": {"status": "ended", "endedAt": ended_at, "reason": req.reason or "client_end"}},
+    )
+    app.state.active_sessions.end(sid)
+    if result.modified_count:
+        # Only the call that actually ended it counts towards the user's sessions
+        await app.state.user_stats.record_session_end(sdoc.get("userId"), ended_at)
+        await app.state.missions.on_session_end(sdoc.get("userId"), ended_at)
+        app.state.event_hub.publish("session_ended", {"reason": req.reason or "client_end", "endedAt": ended_at},
+                                    user_id=sdoc.get("userId"), session_id=sid, bin_id=sdoc.get("binId"))
     # Optionally notify device
     try:
-        device_id = sdoc.get("deviceId") or "esp32cam-1"
+        device_id = sdoc.get("deviceId") or app.state.devices.device_for(sdoc.get("binId"))
         await mqtt_publish(app, f"ecotionbuddy/ctrl/{device_id}", {"action": "deactivate", "sessionId": sid})
     except Exception:
         logger.exception("Failed to publish deactivate")
@@ -433,32 +799,139 @@ async def post_event(evt: AndroidEvent):
     doc = evt.model_dump()
     doc["origin"] = "android"
     doc["ts"] = datetime.utcnow()
-    await app.state.db.events.insert_one(doc)
+    # Queryable like the other event sources (history and claims filter on eventType)
+    doc["eventType"] = evt.action
+    payload = evt.payload or {}
+    for field in ("category", "label", "confidence", "points"):
+        if field in payload:
+            doc.setdefault(field, payload[field])
+    # Durable: the app reads its events back (history, mission progress) right after posting
+    await app.state.event_writer.write(doc, durable=True)
     
     # Award points for scan events
-    if evt.action == "scan" and evt.payload and "points" in evt.payload:
-        points_to_add = evt.payload["points"]
-        await app.state.db.users.update_one(
-            {"userId": evt.userId},
-            {"$inc": {"points": points_to_add}},
-            upsert=True
-        )
+    if evt.action == "scan":
+        points_to_add = payload.get("points", 0)
+        if points_to_add:
+            await app.state.db.users.update_one(
+                {"userId": evt.userId},
+                {"$inc": {"points": points_to_add}},
+                upsert=True
+            )
+        await app.state.user_stats.record_scan(evt.userId, payload.get("category"), doc["ts"], points_to_add)
+        await app.state.missions.on_scan(evt.userId, payload.get("category"), doc["ts"])
     
+    app.state.event_hub.publish("app_event", doc, session_id=payload.get("sessionId"))
     return {"status": "ok"}
 
 
 @app.get("/events/latest", tags=["events"])  # Fetch recent events for app UI
-async def get_latest_events(limit: int = 50):
-    if limit <= 0:
-        limit = 1
-    if limit > 200:
-        limit = 200
-    cursor = app.state.db.events.find().sort("ts", -1).limit(limit)
-    docs: List[Dict[str, Any]] = await cursor.to_list(length=limit)
-    for d in docs:
-        if "_id" in d:
-            d["_id"] = str(d["_id"])
-    return {"events": docs}
+async def get_latest_events(limit: Optional[int] = None, cursor: Optional[str] = None, direction: str = "next",
+                            fields: Optional[str] = None, format: str = "json"):
+    """Newest events first, keyset-paginated on (ts, _id).
+
+    Pass ``nextCursor`` back as ``cursor`` for older events, or ``prevCursor``
+    with ``direction=prev`` for newer ones. ``fields`` limits the returned
+    fields; ``format=ndjson`` streams every event after the cursor (or the
+    first ``limit``) as one JSON line each.
+    """
+    if direction not in ("next", "prev") or format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="direction must be next|prev and format json|ndjson")
+    after = decode_cursor(cursor) if cursor else None
+    descending = direction == "next"
+    find = app.state.db.events.find(keyset_filter(after, "ts", descending), projection(fields))
+    find = find.sort(keyset_sort("ts", descending))
+    if format == "ndjson":
+        if limit:
+            find = find.limit(limit)
+        return StreamingResponse(ndjson_lines(find.batch_size(EXPORT_BATCH_SIZE)), media_type="application/x-ndjson")
+    limit = min(max(limit or 50, 1), 200)
+    # One extra row tells whether there is a next page
+    docs: List[Dict[str, Any]] = await find.limit(limit + 1).to_list(length=limit + 1)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    if not descending:
+        docs.reverse()
+    # Older rows exist if this page was cut short or we paged back; newer ones if we paged forward
+    older = has_more if descending else bool(docs)
+    newer = after is not None if descending else has_more
+    return Response(dumps({
+        "events": docs,
+        "nextCursor": encode_cursor(docs[-1]["ts"], docs[-1]["_id"]) if docs and older else None,
+        "prevCursor": encode_cursor(docs[0]["ts"], docs[0]["_id"]) if docs and newer else None,
+    }), media_type="application/json")
+
+
+# ===== Live event feed (pushed instead of polling /events/latest and /session/{id}) =====
+@app.websocket("/ws/events")
+async def events_websocket(websocket: WebSocket, userId: Optional[str] = None, sessionId: Optional[str] = None,
+                           binId: Optional[str] = None, policy: Optional[str] = None):
+    """One JSON message per live event matching every filter given"""
+    try:
+        sub = app.state.event_hub.subscribe("websocket", userId, sessionId, binId, policy=policy)
+    except EventHubFull:
+        await websocket.close(code=1013)  # try again later
+        return
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    disconnected = False
+
+    async def _watch_disconnect() -> None:
+        nonlocal disconnected
+        # Clients only listen, but reading is how a closed socket is noticed
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+        disconnected = True
+        sub.close()
+
+    watcher = asyncio.create_task(_watch_disconnect())
+    try:
+        while (line := await sub.get()) is not None:
+            await websocket.send_text(line)
+    except Exception:  # noqa: BLE001 - client went away mid-send
+        pass
+    finally:
+        watcher.cancel()
+        app.state.event_hub.unsubscribe(sub)
+    if not disconnected:
+        # Dropped for falling behind (reconnect and backfill from /events/latest) or shutting down
+        with contextlib.suppress(Exception):
+            await websocket.close(code=1008 if sub.overflowed else 1001)
+
+
+@app.get("/events/stream", tags=["events"])  # Server-Sent Events, same filters as /ws/events
+async def events_stream(userId: Optional[str] = None, sessionId: Optional[str] = None,
+                        binId: Optional[str] = None, policy: Optional[str] = None):
+    try:
+        sub = app.state.event_hub.subscribe("sse", userId, sessionId, binId, policy=policy)
+    except EventHubFull:
+        raise HTTPException(status_code=503, detail="Too many live subscribers")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def _stream():
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(sub.get(), EVENT_HUB_HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if line is None:
+                    break
+                yield f"data: {line}\n\n"
+            if sub.overflowed:
+                # The client fell behind; it should reconnect and backfill from /events/latest
+                yield "event: overflow\ndata: {}\n\n"
+        finally:
+            app.state.event_hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 class UserRegistrationRequest(BaseModel):
@@ -492,7 +965,11 @@ async def register_user(req: UserRegistrationRequest):
         "lastActive": datetime.utcnow()
     }
     
-    result = await app.state.db.users.insert_one(new_user)
+    try:
+        result = await app.state.db.users.insert_one(new_user)
+    except DuplicateKeyError:
+        # Concurrent registration won the race past the checks above
+        raise HTTPException(status_code=400, detail="User ID or email already registered")
     new_user["_id"] = str(result.inserted_id)
     
     return {
@@ -531,32 +1008,20 @@ async def get_user(user_id: str):
         "points": user_doc.get("points", 0),
         "level": user_doc.get("level", 1),
         "claimsCount": user_doc.get("claimsCount", 0),
-        "completedMissions": user_doc.get("completedMissions", []),
+        "completedMissions": user_doc.get("completedMissions", []) + await app.state.missions.completed(user_id),
         "activeMissions": user_doc.get("activeMissions", []),
         "recentClaims": [_jsonify_id(claim) for claim in recent_claims]
     }
 
 
-@app.get("/users/{user_id}/history", tags=["users"])
-async def get_user_history(user_id: str, limit: int = 50):
-    """Get user's activity history including scans, missions, and achievements"""
-    if limit <= 0:
-        limit = 1
-    if limit > 200:
-        limit = 200
-    
-    # Get user's events and sessions
-    user_events = []
-    
-    # Get scan events
-    scan_cursor = app.state.db.events.find({
-        "userId": user_id,
-        "eventType": {"$in": ["scan", "classification"]}
-    }).sort("ts", -1).limit(limit)
-    scan_docs = await scan_cursor.to_list(length=limit)
-    
-    for doc in scan_docs:
-        user_events.append({
+def _history_time(doc: Dict[str, Any]) -> datetime:
+    # Scans have ts; sessions carry startedAt/endedAt (there is no createdAt)
+    return doc.get("ts") or doc.get("endedAt") or doc.get("startedAt") or doc["_id"].generation_time.replace(tzinfo=None)
+
+
+def _history_item(doc: Dict[str, Any]) -> Dict[str, Any]:
+    if "ts" in doc:
+        return {
             "id": str(doc["_id"]),
             "type": "waste_scanned",
             "title": f"Scanned {doc.get('category', 'Unknown')} Waste",
@@ -564,31 +1029,64 @@ async def get_user_history(user_id: str, limit: int = 50):
             "pointsEarned": doc.get("points", 50),
             "timestamp": int(doc["ts"].timestamp() * 1000),
             "category": doc.get("category", "unknown").lower()
-        })
+        }
+    return {
+        "id": str(doc["_id"]),
+        "type": "mission_completed",
+        "title": f"Completed Disposal Session",
+        "description": f"Successfully disposed waste at bin {doc.get('binId', 'Unknown')}",
+        "pointsEarned": doc.get("points", 100),
+        "timestamp": int(_history_time(doc).timestamp() * 1000),
+        "category": "general"
+    }
+
+
+@app.get("/users/{user_id}/history", tags=["users"])
+async def get_user_history(user_id: str, limit: Optional[int] = None, days: int = 7,
+                           cursor: Optional[str] = None, format: str = "json"):
+    """Get user's activity history including scans, missions, and achievements.
+
+    Newest first; pass ``nextCursor`` back as ``cursor`` for the next page, or
+    use ``format=ndjson`` to stream the whole history.
+    """
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    days = min(max(days, 1), 90)
+    after = decode_cursor(cursor) if cursor else None
     
-    # Get session events (mission completions)
-    session_cursor = app.state.db.sessions.find({
-        "userId": user_id,
-        "status": "ended"
-    }).sort("createdAt", -1).limit(limit)
-    session_docs = await session_cursor.to_list(length=limit)
+    # Scan events and ended sessions, each read in (time, _id) order and merged as they stream
+    scans = app.state.db.events.find(
+        {"userId": user_id, "eventType": {"$in": ["scan", "classification"]}, **keyset_filter(after, "ts")},
+        {"ts": 1, "category": 1, "label": 1, "confidence": 1, "points": 1},
+    ).sort(keyset_sort("ts"))
+    sessions = app.state.db.sessions.find(
+        {"userId": user_id, "status": "ended", **keyset_filter(after, "endedAt")},
+        {"binId": 1, "points": 1, "startedAt": 1, "endedAt": 1},
+    ).sort(keyset_sort("endedAt"))
+    rows = merge_sorted([scans.batch_size(EXPORT_BATCH_SIZE), sessions.batch_size(EXPORT_BATCH_SIZE)],
+                        key=lambda doc: (_history_time(doc), doc["_id"]))
+    if format == "ndjson":
+        return StreamingResponse(ndjson_lines(rows, _history_item), media_type="application/x-ndjson")
     
-    for doc in session_docs:
-        user_events.append({
-            "id": str(doc["_id"]),
-            "type": "mission_completed",
-            "title": f"Completed Disposal Session",
-            "description": f"Successfully disposed waste at bin {doc.get('binId', 'Unknown')}",
-            "pointsEarned": doc.get("points", 100),
-            "timestamp": int(doc["createdAt"].timestamp() * 1000),
-            "category": "general"
-        })
+    limit = min(max(limit or 50, 1), 200)
+    page: List[Dict[str, Any]] = []
+    has_more = False
+    async for doc in rows:
+        if len(page) == limit:
+            has_more = True
+            break
+        page.append(doc)
     
-    # Sort by timestamp and limit
-    user_events.sort(key=lambda x: x["timestamp"], reverse=True)
-    user_events = user_events[:limit]
+    # Totals over the last `days` from the hourly user_stats buckets
+    since = datetime.utcnow() - timedelta(days=days)
+    summary = UserStats.summarize(await app.state.user_stats.buckets(user_id, since))
+    summary["days"] = days
     
-    return {"history": user_events}
+    return {
+        "history": [_history_item(doc) for doc in page],
+        "summary": summary,
+        "nextCursor": encode_cursor(_history_time(page[-1]), page[-1]["_id"]) if page and has_more else None,
+    }
 
 
 # Mission System
@@ -605,49 +1103,7 @@ class Mission(BaseModel):
 @app.get("/missions", tags=["missions"])
 async def get_available_missions():
     """Get all available missions"""
-    missions = [
-        {
-            "id": "daily_scan_5",
-            "title": "Scan 5 Items Today",
-            "description": "Scan 5 different waste items to learn about recycling",
-            "type": "scan",
-            "target": 5,
-            "reward_points": 100,
-            "duration_days": 1,
-            "requirements": {"scan_count": 5}
-        },
-        {
-            "id": "weekly_plastic_10",
-            "title": "Plastic Warrior",
-            "description": "Scan 10 plastic items this week",
-            "type": "scan",
-            "target": 10,
-            "reward_points": 500,
-            "duration_days": 7,
-            "requirements": {"category": "plastic", "scan_count": 10}
-        },
-        {
-            "id": "dispose_session_3",
-            "title": "Disposal Champion",
-            "description": "Complete 3 disposal sessions",
-            "type": "dispose",
-            "target": 3,
-            "reward_points": 300,
-            "duration_days": 7,
-            "requirements": {"session_count": 3}
-        },
-        {
-            "id": "eco_explorer",
-            "title": "Eco Explorer",
-            "description": "Scan items from 3 different categories",
-            "type": "scan",
-            "target": 3,
-            "reward_points": 200,
-            "duration_days": 3,
-            "requirements": {"unique_categories": 3}
-        }
-    ]
-    return {"missions": missions}
+    return {"missions": AVAILABLE_MISSIONS}
 
 @app.post("/users/{user_id}/missions/{mission_id}/start", tags=["missions"])
 async def start_mission(user_id: str, mission_id: str):
@@ -656,29 +1112,29 @@ async def start_mission(user_id: str, mission_id: str):
     if not user_doc:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Check if mission is already active
-    active_missions = user_doc.get("activeMissions", [])
-    if any(m["id"] == mission_id for m in active_missions):
-        raise HTTPException(status_code=400, detail="Mission already active")
-    
     # Get mission details
-    missions_response = await get_available_missions()
-    mission = next((m for m in missions_response["missions"] if m["id"] == mission_id), None)
+    mission = next((m for m in AVAILABLE_MISSIONS if m["id"] == mission_id), None)
     if not mission:
         raise HTTPException(status_code=404, detail="Mission not found")
     
     # Add mission to user's active missions
+    now = datetime.utcnow()
     new_mission = {
         **mission,
-        "started_at": datetime.utcnow(),
-        "expires_at": datetime.utcnow() + timedelta(days=mission["duration_days"]),
+        "started_at": now,
+        "expires_at": now + timedelta(days=mission["duration_days"]),
         "progress": 0
     }
+    if "unique_categories" in mission["requirements"]:
+        new_mission["categories"] = []
     
-    await app.state.db.users.update_one(
-        {"userId": user_id},
+    # Conditional push: two concurrent starts cannot both add the mission
+    result = await app.state.db.users.update_one(
+        {"userId": user_id, "activeMissions.id": {"$ne": mission_id}},
         {"$push": {"activeMissions": new_mission}}
     )
+    if not result.modified_count:
+        raise HTTPException(status_code=400, detail="Mission already active")
     
     return {"status": "success", "message": "Mission started", "mission": new_mission}
 
@@ -690,7 +1146,8 @@ async def get_user_missions(user_id: str):
         raise HTTPException(status_code=404, detail="User not found")
     
     active_missions = user_doc.get("activeMissions", [])
-    completed_missions = user_doc.get("completedMissions", [])
+    # Completions live in their own collection; older ones may still be on the user document
+    completed_missions = user_doc.get("completedMissions", []) + await app.state.missions.completed(user_id)
     
     # Check for expired missions
     current_time = datetime.utcnow()
@@ -704,11 +1161,11 @@ async def get_user_missions(user_id: str):
         else:
             still_active.append(mission)
     
-    # Remove expired missions
+    # Remove expired missions; a $pull leaves concurrent progress and completions intact
     if expired_missions:
         await app.state.db.users.update_one(
             {"userId": user_id},
-            {"$set": {"activeMissions": still_active}}
+            {"$pull": {"activeMissions": {"expires_at": {"$lt": current_time}}}}
         )
     
     return {
@@ -719,7 +1176,11 @@ async def get_user_missions(user_id: str):
 
 @app.post("/users/{user_id}/missions/check_progress", tags=["missions"])
 async def check_mission_progress(user_id: str):
-    """Check and update mission progress based on user activities"""
+    """Recount mission progress from the user's counters and complete missions that are done.
+
+    Progress normally advances as events arrive; this catches up missions
+    after a user_stats backfill or a lost update.
+    """
     user_doc = await app.state.db.users.find_one({"userId": user_id})
     if not user_doc:
         raise HTTPException(status_code=404, detail="User not found")
@@ -728,81 +1189,51 @@ async def check_mission_progress(user_id: str):
     if not active_missions:
         return {"message": "No active missions"}
     
-    completed_missions = []
-    updated_missions = []
+    # One read of the user's hourly counters covers every active mission
+    now = datetime.utcnow()
+    starts = [m.get("started_at") if isinstance(m.get("started_at"), datetime) else now for m in active_missions]
+    buckets = await app.state.user_stats.buckets(user_id, min(starts))
     
-    for mission in active_missions:
+    # Missions started together that count the same thing share one recount
+    totals_by_window: Dict[tuple, Dict[str, Any]] = {}
+    for mission, started_at in zip(active_missions, starts):
         mission_type = mission.get("type")
         requirements = mission.get("requirements", {})
+        if mission_type == "scan":
+            source = "scans"
+        else:
+            source = "disposals" if "disposal_count" in requirements else "sessions"
+        if (started_at, source) not in totals_by_window:
+            totals_by_window[(started_at, source)] = await app.state.user_stats.totals_since(
+                app.state.db, user_id, started_at, buckets, (source,)
+            )
+        totals = totals_by_window[(started_at, source)]
         
         if mission_type == "scan":
-            # Count scans based on requirements
-            query = {"userId": user_id, "eventType": "scan"}
-            
-            if "category" in requirements:
-                query["category"] = requirements["category"]
-            
-            # Count scans since mission started
-            started_at = mission.get("started_at", datetime.utcnow())
-            query["ts"] = {"$gte": started_at}
-            
+            # Count scans since mission started, based on requirements
             if "unique_categories" in requirements:
-                # Count unique categories
-                pipeline = [
-                    {"$match": query},
-                    {"$group": {"_id": "$category"}},
-                    {"$count": "unique_count"}
-                ]
-                result = await app.state.db.events.aggregate(pipeline).to_list(length=1)
-                progress = result[0]["unique_count"] if result else 0
+                progress = totals["uniqueCategories"]
+            elif "category" in requirements:
+                progress = totals["scansByCategory"].get(str(requirements["category"]).lower(), 0)
             else:
-                progress = await app.state.db.events.count_documents(query)
+                progress = totals["scans"]
             
         elif mission_type == "dispose":
-            # Count disposal sessions
-            query = {
-                "userId": user_id,
-                "status": "ended"
-            }
-            started_at = mission.get("started_at", datetime.utcnow())
-            query["createdAt"] = {"$gte": started_at}
-            
-            progress = await app.state.db.sessions.count_documents(query)
+            # Items put in a bin, or disposal sessions ended, since the mission started
+            progress = totals["disposals"] if "disposal_count" in requirements else totals["sessionsEnded"]
         
         else:
             progress = 0
         
-        mission["progress"] = progress
-        
-        # Check if mission is completed
-        if progress >= mission.get("target", 1):
-            mission["completed_at"] = datetime.utcnow()
-            completed_missions.append(mission)
-            
-            # Award points
-            points_to_add = mission.get("reward_points", 0)
-            await app.state.db.users.update_one(
-                {"userId": user_id},
-                {"$inc": {"points": points_to_add}}
-            )
-        else:
-            updated_missions.append(mission)
+        if progress > mission.get("progress", 0):
+            await app.state.missions.set_progress(user_id, mission, progress)
     
-    # Update user missions
-    all_completed = user_doc.get("completedMissions", []) + completed_missions
-    await app.state.db.users.update_one(
-        {"userId": user_id},
-        {
-            "$set": {
-                "activeMissions": updated_missions,
-                "completedMissions": all_completed
-            }
-        }
-    )
+    completed_missions = await app.state.missions.complete_ready(user_id)
+    user_doc = await app.state.db.users.find_one({"userId": user_id}, {"activeMissions": 1})
     
     return {
         "completed_missions": completed_missions,
-        "updated_missions": updated_missions,
+        "updated_missions": (user_doc or {}).get("activeMissions", []),
         "points_earned": sum(m.get("reward_points", 0) for m in completed_missions)
     }
 
@@ -819,7 +1250,13 @@ async def get_public_config(request: Request):
     model_status = {
         "enabled": MODEL_ENABLED,
         "loaded": classifier is not None,
-        "classes": classifier.get_class_names() if classifier else []
+        "state": getattr(app.state, "model_state", "loading"),
+        "pendingClassifications": len(app.state.pending_classifications),
+        "classes": classifier.get_class_names() if classifier else [],
+        "backend": classifier.model.name if classifier and classifier.model else None,
+        "version": classifier.version if classifier else None,
+        "inference": app.state.inference.stats(),
+        "cache": app.state.inference.cache_stats(),
     }
     
     return {
@@ -830,6 +1267,144 @@ async def get_public_config(request: Request):
     }
 
 
+@app.get("/metrics", tags=["meta"])  # Runtime counters for dashboards
+async def get_metrics():
+    return {
+        "time": datetime.utcnow().isoformat(),
+        "inference": app.state.inference.stats(),
+        "predictionCache": app.state.inference.cache_stats(),
+        "shadow": app.state.shadow.stats(),
+        "mqttPublisher": app.state.mqtt_publisher.stats(),
+        "mqttWorker": app.state.mqtt_worker.stats(),
+        "eventWriter": app.state.event_writer.stats(),
+        "devices": app.state.devices.stats(),
+        "activeSessions": app.state.active_sessions.stats(),
+        "sessionSweeper": app.state.session_sweeper.stats(),
+        "storage": app.state.storage.stats(),
+        "jobs": app.state.jobs.stats(),
+        "userStats": app.state.user_stats.stats(),
+        "missions": app.state.missions.stats(),
+        "eventHub": app.state.event_hub.stats(),
+        "images": app.state.image_server.stats() if IMAGE_STORAGE == "gridfs" else None,
+    }
+
+
+# ===== Admin: model registry =====
+def _require_admin(request: Request) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled (set ADMIN_TOKEN)")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+class LoadModelRequest(BaseModel):
+    path: str
+    version: Optional[str] = None
+    activate: bool = True
+
+
+async def _load_model_version(req: LoadModelRequest) -> None:
+    try:
+        await registry.load_async(req.path, req.version, activate=req.activate)
+    except Exception as e:  # noqa: BLE001
+        logger.exception("Background model load from %s failed: %s", req.path, e)
+        return
+    if req.activate:
+        app.state.model_state = "ready"
+        app.state.model_ready.set()
+
+
+@app.get("/admin/models", tags=["admin"])
+async def list_models(request: Request):
+    _require_admin(request)
+    return registry.describe()
+
+
+@app.post("/admin/models/load", tags=["admin"], status_code=202)
+async def load_model_version(req: LoadModelRequest, request: Request):
+    """Load a SavedModel/TFLite/ONNX artefact in the background and optionally swap it in"""
+    _require_admin(request)
+    if registry.describe()["loading"].get(req.path) == "loading":
+        raise HTTPException(status_code=409, detail="Model already loading")
+    if req.version and registry.get(req.version) is not None:
+        raise HTTPException(status_code=409, detail="Model version already loaded")
+    task = asyncio.create_task(_load_model_version(req), name="model_load")
+    app.state.admin_tasks.add(task)
+    task.add_done_callback(app.state.admin_tasks.discard)
+    return {"status": "loading", "path": req.path, "activate": req.activate}
+
+
+@app.post("/admin/models/{version}/activate", tags=["admin"])
+async def activate_model_version(version: str, request: Request):
+    """Route new predictions to an already loaded version; the previous one stays loaded for rollback"""
+    _require_admin(request)
+    try:
+        previous = registry.activate(version)
+    except ModelLoadError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"status": "ok", "active": version, "previous": previous.version if previous else None}
+
+
+@app.delete("/admin/models/{version}", tags=["admin"])
+async def retire_model_version(version: str, request: Request):
+    """Unload an inactive version once its in-flight predictions finish"""
+    _require_admin(request)
+    if registry.get(version) is None:
+        raise HTTPException(status_code=404, detail="Model version not loaded")
+    if app.state.shadow.version == version:
+        app.state.shadow.configure(None)
+    try:
+        await registry.retire(version)
+    except ModelLoadError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "ok", "retired": version}
+
+
+@app.get("/admin/indexes", tags=["admin"])
+async def get_index_report(request: Request):
+    """Declared indexes that are missing and existing ones unused since the last mongod restart"""
+    _require_admin(request)
+    report = await index_report(app.state.db, app.state.index_specs)
+    report["bootstrap"] = app.state.index_status
+    return report
+
+
+class ShadowConfigRequest(BaseModel):
+    version: Optional[str] = None  # None disables shadow scoring
+    sampleRate: Optional[float] = Field(default=None, ge=0.0, le=1.0)
+
+
+@app.put("/admin/shadow", tags=["admin"])
+async def configure_shadow(req: ShadowConfigRequest, request: Request):
+    """Shadow-score a sample of uploads with a loaded, non-active model version"""
+    _require_admin(request)
+    if req.version is not None:
+        if registry.get(req.version) is None:
+            raise HTTPException(status_code=404, detail="Model version not loaded")
+        if registry.active is not None and registry.active.version == req.version:
+            raise HTTPException(status_code=409, detail="Model version is active")
+    app.state.shadow.configure(req.version, req.sampleRate)
+    return app.state.shadow.stats()
+
+
+@app.get("/admin/shadow/report", tags=["admin"])
+async def shadow_report(request: Request, version: Optional[str] = None, hours: Optional[float] = None):
+    """Agreement with the primary model and latency of a shadow candidate"""
+    _require_admin(request)
+    if not (version or app.state.shadow.version):
+        raise HTTPException(status_code=404, detail="No shadow candidate configured")
+    since = datetime.utcnow() - timedelta(hours=hours) if hours else None
+    return await app.state.shadow.report(version, since)
+
+
+@app.post("/admin/user_stats/rebuild", tags=["admin"])
+async def rebuild_user_stats(request: Request, userId: Optional[str] = None):
+    """Recompute the hourly user_stats counters from events, images, claims and sessions"""
+    _require_admin(request)
+    buckets = await app.state.user_stats.rebuild(app.state.db, userId)
+    return {"status": "ok", "userId": userId, "buckets": buckets}
+
+
 @app.post("/classify", tags=["ml"])  # Test classification endpoint for Android app
 async def classify_image(request: Request):
     """Test endpoint for image classification without IoT workflow"""
@@ -841,18 +1416,24 @@ async def classify_image(request: Request):
         # Get classifier and predict
         classifier = get_classifier()
         if not classifier or not MODEL_ENABLED:
+            if MODEL_ENABLED and app.state.model_state == "loading":
+                raise HTTPException(status_code=503, detail="Model loading", headers={"Retry-After": "5"})
             raise HTTPException(status_code=503, detail="Model not available")
         
-        label, confidence = classifier.predict(data)
+        try:
+            prediction = await app.state.inference.predict_async(data)
+        except InferenceQueueFull:
+            raise HTTPException(status_code=503, detail="Classifier busy")
         
         return {
             "status": "ok",
             "prediction": {
-                "label": label,
-                "confidence": confidence,
+                "label": prediction.label,
+                "confidence": prediction.confidence,
                 "classes": classifier.get_class_names()
             },
-            "model": "MobileNetV2"
+            "model": "MobileNetV2",
+            "modelVersion": prediction.model_version,
         }
         
     except HTTPException:
@@ -862,6 +1443,105 @@ async def classify_image(request: Request):
         raise HTTPException(status_code=500, detail="Classification failed")
 
 
+def _batch_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Batch larger than {CLASSIFY_BATCH_MAX_BYTES} bytes")
+
+
+async def _read_batch_body(request: Request) -> bytes:
+    # Archives are read into memory, so stop at the request limit instead of buffering any size
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > CLASSIFY_BATCH_MAX_BYTES:
+        raise _batch_too_large()
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > CLASSIFY_BATCH_MAX_BYTES:
+            raise _batch_too_large()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def _read_batch_images(request: Request) -> List[Tuple[str, Optional[bytes]]]:
+    """(name, bytes) per input image, with None for images over the per-file limit"""
+    content_type = (request.headers.get("content-type") or "").split(";")[0].strip().lower()
+    if content_type == "multipart/form-data":
+        declared = request.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > CLASSIFY_BATCH_MAX_BYTES:
+            raise _batch_too_large()
+        form = await request.form()
+        images: List[Tuple[str, Optional[bytes]]] = []
+        total = 0
+        for name, value in form.multi_items():
+            if not hasattr(value, "read"):
+                continue
+            filename = value.filename or name
+            # Parts are spooled by the form parser; only read the ones within the limits
+            if value.size is not None and value.size > CLASSIFY_BATCH_MAX_FILE_BYTES:
+                images.append((filename, None))
+            else:
+                data = await value.read()
+                total += len(data)
+                if total > CLASSIFY_BATCH_MAX_BYTES:
+                    raise _batch_too_large()
+                if data:
+                    images.append((filename, data if len(data) <= CLASSIFY_BATCH_MAX_FILE_BYTES else None))
+            if len(images) >= CLASSIFY_BATCH_MAX_FILES:
+                break
+        return images
+    body = await _read_batch_body(request)
+    if not body:
+        raise HTTPException(status_code=400, detail="Empty body")
+    try:
+        return await asyncio.to_thread(
+            read_archive_images, content_type, body, CLASSIFY_BATCH_MAX_FILES, CLASSIFY_BATCH_MAX_FILE_BYTES,
+            CLASSIFY_BATCH_MAX_BYTES,
+        )
+    except ArchiveTooLarge:
+        raise _batch_too_large()
+    except UnsupportedArchive as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+
+@app.post("/classify/batch", tags=["ml"])  # multipart, zip or tar of images -> NDJSON stream
+async def classify_batch(request: Request):
+    """Classify many images per request, streaming one JSON line per image"""
+    classifier = get_classifier()
+    if not classifier or not MODEL_ENABLED:
+        raise HTTPException(status_code=503, detail="Model not available")
+    images = await _read_batch_images(request)
+    if not images:
+        raise HTTPException(status_code=400, detail="No images found")
+
+    async def _stream():
+        chunk_size = max(1, CLASSIFY_BATCH_CHUNK)
+        for start in range(0, len(images), chunk_size):
+            chunk = images[start:start + chunk_size]
+            accepted = [data for _, data in chunk if data is not None]
+            results: List[Any] = []
+            while accepted:
+                try:
+                    results = await app.state.inference.predict_many(accepted)
+                    break
+                except InferenceQueueFull:
+                    # Live uploads take priority; wait for a free slot instead of failing mid-stream
+                    await asyncio.sleep(0.05)
+            predictions = iter(results)
+            for offset, (name, data) in enumerate(chunk):
+                line: Dict[str, Any] = {"index": start + offset, "name": name}
+                # Every input gets a line, so clients can match results to what they sent
+                result = next(predictions) if data is not None else None
+                if data is None:
+                    line["error"] = "too_large"
+                elif result is None:
+                    line["error"] = "decode_failed"
+                else:
+                    line["label"], line["confidence"], line["modelVersion"] = result
+                yield json.dumps(line) + "\n"
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+
 def _jsonify_id(doc: Dict[str, Any]) -> Dict[str, Any]:
     out = dict(doc)
     if "_id" in out:
@@ -892,8 +1572,8 @@ async def get_session(sessionId: str):
     return out
 
 
-@app.get("/images/{file_id}", tags=["images"])  # Stream image from GridFS
-async def get_image(file_id: str):
+@app.get("/images/{file_id}", tags=["images"])  # Stream image from GridFS (Range, ETag, 304)
+async def get_image(file_id: str, request: Request):
     if IMAGE_STORAGE != "gridfs":
         raise HTTPException(status_code=404, detail="GridFS storage not enabled")
     try:
@@ -901,10 +1581,9 @@ async def get_image(file_id: str):
     except Exception:  # noqa: BLE001
         raise HTTPException(status_code=400, detail="Invalid image id")
     try:
-        buf = io.BytesIO()
-        await app.state.gridfs.download_to_stream(oid, buf)
-        buf.seek(0)
-        return StreamingResponse(buf, media_type="image/jpeg")
+        return await app.state.image_server.serve(oid, request.headers)
+    except HTTPException:
+        raise
     except Exception as e:  # noqa: BLE001
         logger.exception("GridFS read failed: %s", e)
         raise HTTPException(status_code=404, detail="Image not found")
@@ -0,0 +1,29 @@
+from typing import Any, Dict, Sequence
+
+
+class Histogram:
+    """Counts observations into fixed upper-bound buckets for the /metrics endpoint"""
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self._counts[i] += 1
+                return
+        self._counts[-1] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        buckets = {f"le_{bound:g}": n for bound, n in zip(self.buckets, self._counts)}
+        buckets["inf"] = self._counts[-1]
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 3) if self.count else 0.0,
+            "buckets": buckets,
+        }
@@ -0,0 +1,175 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger("ecotionbuddy.missions")
+
+AVAILABLE_MISSIONS: List[Dict[str, Any]] = [
+    {
+        "id": "daily_scan_5",
+        "title": "Scan 5 Items Today",
+        "description": "Scan 5 different waste items to learn about recycling",
+        "type": "scan",
+        "target": 5,
+        "reward_points": 100,
+        "duration_days": 1,
+        "requirements": {"scan_count": 5}
+    },
+    {
+        "id": "weekly_plastic_10",
+        "title": "Plastic Warrior",
+        "description": "Scan 10 plastic items this week",
+        "type": "scan",
+        "target": 10,
+        "reward_points": 500,
+        "duration_days": 7,
+        "requirements": {"category": "plastic", "scan_count": 10}
+    },
+    {
+        "id": "dispose_session_3",
+        "title": "Disposal Champion",
+        "description": "Complete 3 disposal sessions",
+        "type": "dispose",
+        "target": 3,
+        "reward_points": 300,
+        "duration_days": 7,
+        "requirements": {"session_count": 3}
+    },
+    {
+        "id": "eco_explorer",
+        "title": "Eco Explorer",
+        "description": "Scan items from 3 different categories",
+        "type": "scan",
+        "target": 3,
+        "reward_points": 200,
+        "duration_days": 3,
+        "requirements": {"unique_categories": 3}
+    }
+]
+
+
+def _window(name: str, ts: datetime) -> Dict[str, Any]:
+    # Only missions running at the time of the event
+    return {f"{name}.started_at": {"$lte": ts}, f"{name}.expires_at": {"$gt": ts}}
+
+
+class MissionEngine:
+    """Advances users' active missions as events are ingested.
+
+    Progress lives on the ``activeMissions`` elements of the user document and
+    is bumped by one update per event, using ``arrayFilters`` to pick the
+    missions the event counts towards. A mission that reaches its target is
+    recorded in ``completed_missions`` (keyed by user, mission and start time)
+    and then pulled from ``activeMissions`` in the same update that adds its
+    reward, conditioned on it still being there, so the reward is paid exactly
+    once however many events or check_progress calls race to complete it. The
+    record is flagged ``awarded`` afterwards, and a mission whose record is
+    already awarded is only pulled, never paid again.
+    """
+
+    def __init__(self, users: AsyncIOMotorCollection, completed: AsyncIOMotorCollection) -> None:
+        self.users = users
+        self.completed_collection = completed
+        self.updates = 0
+        self.completions = 0
+        self.errors = 0
+
+    async def on_scan(self, user_id: Optional[str], category: Any, ts: datetime) -> None:
+        category = str(category or "unknown").lower()
+        await self._advance(user_id, {
+            "$inc": {
+                "activeMissions.$[count].progress": 1,
+                "activeMissions.$[cat].progress": 1,
+                "activeMissions.$[uniq].progress": 1,
+            },
+            "$addToSet": {"activeMissions.$[uniq].categories": category},
+        }, [
+            {"count.type": "scan", "count.requirements.scan_count": {"$exists": True},
+             "count.requirements.category": {"$exists": False}, **_window("count", ts)},
+            {"cat.type": "scan", "cat.requirements.category": category, **_window("cat", ts)},
+            # Counts a category only the first time it is seen
+            {"uniq.type": "scan", "uniq.requirements.unique_categories": {"$exists": True},
+             "uniq.categories": {"$ne": category}, **_window("uniq", ts)},
+        ])
+
+    async def on_disposal(self, user_id: Optional[str], ts: datetime) -> None:
+        await self._advance(user_id, {"$inc": {"activeMissions.$[m].progress": 1}}, [
+            {"m.type": "dispose", "m.requirements.disposal_count": {"$exists": True}, **_window("m", ts)},
+        ])
+
+    async def on_session_end(self, user_id: Optional[str], ts: datetime) -> None:
+        await self._advance(user_id, {"$inc": {"activeMissions.$[m].progress": 1}}, [
+            {"m.type": "dispose", "m.requirements.session_count": {"$exists": True}, **_window("m", ts)},
+        ])
+
+    async def _advance(self, user_id: Optional[str], update: Dict[str, Any], array_filters: List[Dict[str, Any]]) -> None:
+        if not user_id:
+            return
+        try:
+            result = await self.users.update_one(
+                {"userId": user_id, "activeMissions.0": {"$exists": True}}, update, array_filters=array_filters,
+            )
+            if result.modified_count:
+                self.updates += 1
+                await self.complete_ready(user_id)
+        except Exception as e:  # noqa: BLE001 - mission progress must not fail ingestion
+            self.errors += 1
+            logger.warning("Mission progress update for %s failed: %s", user_id, e)
+
+    async def set_progress(self, user_id: str, mission: Dict[str, Any], progress: int) -> None:
+        """Raise one mission's progress to at least ``progress`` (recount from user_stats)"""
+        await self.users.update_one(
+            {"userId": user_id},
+            {"$max": {"activeMissions.$[m].progress": progress}},
+            array_filters=[{"m.id": mission["id"], "m.started_at": mission.get("started_at")}],
+        )
+
+    async def complete_ready(self, user_id: str) -> List[Dict[str, Any]]:
+        """Complete every active mission at or over its target; returns the ones completed now"""
+        user_doc = await self.users.find_one({"userId": user_id}, {"activeMissions": 1})
+        completed = []
+        for mission in (user_doc or {}).get("activeMissions", []):
+            if mission.get("progress", 0) >= mission.get("target", 1):
+                if await self._complete(user_id, mission):
+                    completed.append(mission)
+        return completed
+
+    async def _complete(self, user_id: str, mission: Dict[str, Any]) -> bool:
+        now = datetime.utcnow()
+        started_at = mission.get("started_at")
+        key = {"userId": user_id, "missionId": mission["id"], "started_at": started_at}
+        pull = {"$pull": {"activeMissions": {"id": mission["id"], "started_at": started_at}}}
+        try:
+            # Recorded first: if we stop before the award below, the next event retries it
+            await self.completed_collection.insert_one({**mission, **key, "completed_at": now, "awarded": False})
+        except DuplicateKeyError:
+            existing = await self.completed_collection.find_one(key, {"awarded": 1})
+            # Records from before the flag existed were always paid
+            if existing is None or existing.get("awarded", True):
+                # Already paid; if the mission is back in activeMissions, drop it without paying again
+                await self.users.update_one({"userId": user_id}, pull)
+                return False
+        result = await self.users.update_one(
+            {"userId": user_id, "activeMissions": {"$elemMatch": {
+                "id": mission["id"], "started_at": started_at, "progress": {"$gte": mission.get("target", 1)},
+            }}},
+            {**pull, "$inc": {"points": mission.get("reward_points", 0), "missionsCompleted": 1}},
+        )
+        if not result.modified_count:
+            return False
+        await self.completed_collection.update_one(key, {"$set": {"awarded": True}})
+        self.completions += 1
+        mission["completed_at"] = now
+        logger.info("User %s completed mission %s (+%s points)", user_id, mission["id"], mission.get("reward_points", 0))
+        return True
+
+    async def completed(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        return await self.completed_collection.find(
+            {"userId": user_id}, {"_id": 0, "userId": 0, "missionId": 0, "awarded": 0}
+        ).sort("completed_at", -1).limit(limit).to_list(length=limit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"updates": self.updates, "completions": self.completions, "errors": self.errors}
@@ -0,0 +1,151 @@
+import asyncio
+import gc
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .cache import PredictionCache
+from .classifier import TrashClassifier
+
+logger = logging.getLogger("ecotionbuddy.models")
+
+
+class ModelLoadError(Exception):
+    """Raised when a model version cannot be loaded or activated"""
+
+
+class ModelRegistry:
+    """Versioned TrashClassifier instances and the one currently serving traffic.
+
+    Swapping only replaces the ``active`` reference, so requests that already picked
+    a classifier finish on it; retired models are unloaded once their in-flight
+    count (maintained by the inference executor) drops to zero.
+    """
+
+    def __init__(self) -> None:
+        self.cache: Optional[PredictionCache] = None
+        self.backend = "auto"
+        self.num_threads: Optional[int] = None
+        self._models: Dict[str, TrashClassifier] = {}
+        self._loaded_at: Dict[str, datetime] = {}
+        self._loading: Dict[str, str] = {}  # model path -> state of background loads
+        self._active: Optional[TrashClassifier] = None
+        self._lock = threading.Lock()
+
+    def configure(self, cache: Optional[PredictionCache] = None, backend: str = "auto",
+                  num_threads: Optional[int] = None) -> None:
+        self.cache = cache
+        self.backend = backend
+        self.num_threads = num_threads
+
+    @property
+    def active(self) -> Optional[TrashClassifier]:
+        return self._active
+
+    def get(self, version: str) -> Optional[TrashClassifier]:
+        return self._models.get(version)
+
+    def load(self, model_path: str, version: Optional[str] = None) -> TrashClassifier:
+        """Load and warm up a model; blocking, call it from a worker thread"""
+        if version and version in self._models:
+            raise ModelLoadError(f"Model version {version} already loaded")
+        classifier = TrashClassifier(model_path, version=version, cache=self.cache,
+                                     backend=self.backend, num_threads=self.num_threads)
+        if not classifier.load_model():
+            raise ModelLoadError(f"Failed to load model from {model_path}")
+        with self._lock:
+            if classifier.version in self._models:
+                classifier.unload()
+                raise ModelLoadError(f"Model version {classifier.version} already loaded")
+            self._models[classifier.version] = classifier
+            self._loaded_at[classifier.version] = datetime.utcnow()
+        return classifier
+
+    def activate(self, version: str) -> Optional[TrashClassifier]:
+        """Atomically route new predictions to ``version``; returns the previous model"""
+        classifier = self._models.get(version)
+        if classifier is None:
+            raise ModelLoadError(f"Model version {version} is not loaded")
+        previous, self._active = self._active, classifier
+        logger.info("Active model: %s (was %s)", version, previous.version if previous else None)
+        return previous
+
+    async def load_async(self, model_path: str, version: Optional[str] = None,
+                         activate: bool = True, drain_timeout: float = 60.0) -> TrashClassifier:
+        """Load off the event loop, optionally swap it in and retire the old model"""
+        self._loading[model_path] = "loading"
+        try:
+            classifier = await asyncio.to_thread(self.load, model_path, version)
+        except Exception as e:
+            self._loading[model_path] = f"failed: {e}"
+            raise
+        self._loading.pop(model_path, None)
+        if activate:
+            previous = self.activate(classifier.version)
+            if previous is not None and previous is not classifier:
+                await self.retire(previous.version, drain_timeout)
+        return classifier
+
+    async def retire(self, version: str, drain_timeout: float = 60.0) -> None:
+        """Drop a non-active model once its in-flight predictions have finished"""
+        classifier = self._models.get(version)
+        if classifier is None:
+            return
+        if classifier is self._active:
+            raise ModelLoadError(f"Model version {version} is active; activate another first")
+        with self._lock:
+            self._models.pop(version, None)
+            self._loaded_at.pop(version, None)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + drain_timeout
+        while classifier.inflight > 0 and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        if classifier.inflight > 0:
+            logger.warning("Unloading model %s with %d predictions still in flight", version, classifier.inflight)
+        classifier.unload()
+        del classifier
+        # Backends hold large graphs/buffers in reference cycles; free them now
+        await asyncio.to_thread(gc.collect)
+        logger.info("Retired model %s", version)
+
+    def describe(self) -> Dict[str, Any]:
+        models: List[Dict[str, Any]] = []
+        for version, classifier in list(self._models.items()):
+            models.append({
+                "version": version,
+                "path": classifier.model_path,
+                "backend": classifier.model.name if classifier.model else None,
+                "classes": classifier.get_class_names(),
+                "active": classifier is self._active,
+                "inflight": classifier.inflight,
+                "loadedAt": self._loaded_at[version].isoformat() if version in self._loaded_at else None,
+            })
+        return {
+            "active": self._active.version if self._active else None,
+            "models": models,
+            "loading": dict(self._loading),
+        }
+
+
+# Global registry used by the API and inference executor
+registry = ModelRegistry()
+
+
+def get_classifier() -> Optional[TrashClassifier]:
+    """Get the classifier currently serving predictions"""
+    return registry.active
+
+
+def initialize_classifier(model_path: str, cache: Optional[PredictionCache] = None,
+                          backend: str = "auto", num_threads: Optional[int] = None) -> bool:
+    """Load the startup model into the registry and activate it"""
+    registry.configure(cache=cache, backend=backend, num_threads=num_threads)
+    try:
+        classifier = registry.load(model_path)
+        registry.activate(classifier.version)
+        logger.info("Trash classifier initialized successfully")
+        return True
+    except Exception as e:
+        logger.exception(f"Failed to initialize classifier: {e}")
+        return False
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, NamedTuple
+
+from asyncio_mqtt import Client, MqttError
+
+from .metrics import Histogram
+
+logger = logging.getLogger("ecotionbuddy.mqtt.publisher")
+
+
+class _Command(NamedTuple):
+    topic: str
+    payload: str
+    enqueued_at: float
+
+
+class MQTTPublisher:
+    """Long-lived MQTT connection for device control commands.
+
+    ``publish`` only enqueues, so request handlers never wait on the broker. While
+    the broker is unreachable commands are buffered up to ``max_queue`` (the oldest
+    is dropped first) and discarded once older than ``command_ttl_s``: a stale
+    ``open`` must not fire minutes after the user walked away.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 1883, qos: int = 1,
+                 max_queue: int = 256, command_ttl_s: float = 15.0, publish_timeout_s: float = 5.0) -> None:
+        self.host = host
+        self.port = port
+        self.qos = qos
+        self.max_queue = max(1, max_queue)
+        self.command_ttl_s = command_ttl_s
+        self.publish_timeout_s = publish_timeout_s
+        self._queue: Deque[_Command] = deque()
+        self._wakeup = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self.connected = False
+        self.published = 0
+        self.dropped = 0
+        self.expired = 0
+        self.failed = 0
+        self.reconnects = 0
+        # Enqueue to broker acknowledgement (PUBACK for QoS 1), including time spent buffered
+        self.latency = Histogram([5, 10, 25, 50, 100, 250, 1000, 5000])
+
+    def publish(self, topic: str, payload: Dict[str, Any]) -> bool:
+        """Queue a command for delivery; returns False if it displaced an older one"""
+        accepted = True
+        if len(self._queue) >= self.max_queue:
+            stale = self._queue.popleft()
+            self.dropped += 1
+            accepted = False
+            logger.warning("MQTT publish queue full, dropped command to %s", stale.topic)
+        self._queue.append(_Command(topic, json.dumps(payload), time.monotonic()))
+        self._wakeup.set()
+        return accepted
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        """Keep a connection open and drain the queue, reconnecting with backoff"""
+        backoff = 1.0
+        while not self._stopped.is_set():
+            try:
+                logger.info("Connecting MQTT publisher to %s:%s", self.host, self.port)
+                async with Client(self.host, self.port) as client:
+                    self.connected = True
+                    backoff = 1.0
+                    logger.info("MQTT publisher connected")
+                    await self._drain(client)
+            except MqttError as e:
+                if self._stopped.is_set():
+                    break
+                logger.warning("MQTT publisher error: %s. Reconnecting in %.0fs...", e, backoff)
+            finally:
+                self.connected = False
+            if self._stopped.is_set():
+                break
+            self.reconnects += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 10.0)
+
+    async def _drain(self, client: Client) -> None:
+        while not self._stopped.is_set():
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            command = self._queue[0]
+            if time.monotonic() - command.enqueued_at > self.command_ttl_s:
+                self._queue.popleft()
+                self.expired += 1
+                logger.warning("Discarding expired MQTT command to %s", command.topic)
+                continue
+            try:
+                await client.publish(command.topic, command.payload, qos=self.qos, timeout=self.publish_timeout_s)
+            except MqttError:
+                # Keep the command at the head of the queue; it is retried after reconnecting
+                self.failed += 1
+                raise
+            if self._queue and self._queue[0] is command:
+                self._queue.popleft()
+            self.published += 1
+            self.latency.observe((time.monotonic() - command.enqueued_at) * 1000.0)
+            logger.info("Published MQTT to %s: %s", command.topic, command.payload)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connected": self.connected,
+            "qos": self.qos,
+            "queueDepth": len(self._queue),
+            "maxQueue": self.max_queue,
+            "published": self.published,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "failed": self.failed,
+            "reconnects": self.reconnects,
+            "publishLatencyMs": self.latency.snapshot(),
+        }
@@ -1,64 +1,264 @@
 import asyncio
 import json
 import logging
+import time
+import zlib
 from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
 
 from asyncio_mqtt import Client, MqttError
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+from .cache import LRUCache
+from .device_registry import DeviceRegistry
+from .session_index import ActiveSessionIndex
+from .event_hub import EventHub
+from .event_writer import EventWriter
+from .metrics import Histogram
+from .missions import MissionEngine
+from .user_stats import UserStats
 
 logger = logging.getLogger("ecotionbuddy.mqtt")
 
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 1000, 5000]
+
 
 class MQTTWorker:
+    """Consumes device events and processes them on ``concurrency`` handler tasks.
+
+    Messages are partitioned by sessionId (falling back to binId/deviceId), so
+    events of one session are handled in arrival order while other bins proceed
+    in parallel. Each partition queue holds at most ``queue_size`` messages; when
+    Mongo falls behind the dispatcher blocks on the full queue. The MQTT reader
+    itself never blocks: it hands payloads to an intake queue of
+    ``intake_size`` and counts messages that arrive while it is full as
+    ``dropped``, so a burst cannot grow memory without bound.
+
+    Redelivered disposals are dropped before any write. The idempotency key is
+    ``msgId``, else ``(sessionId, seq)``; payloads from firmware that sends
+    neither are treated as duplicates when the same session/device reports the
+    same label within ``dedupe_window_s``. Recent keys are remembered in memory,
+    and a unique index on ``claims.idempotencyKey`` catches the rest (e.g. after
+    a restart). A message whose writes fail before points are paid is
+    forgotten again, so its redelivery is processed rather than dropped.
+    """
+
     def __init__(self, db: AsyncIOMotorDatabase, host: str = "localhost", port: int = 1883,
-                 topic: str = "ecotionbuddy/events/disposal_complete") -> None:
+                 topic: str = "ecotionbuddy/events/disposal_complete",
+                 concurrency: int = 4, queue_size: int = 64, intake_size: int = 1024,
+                 event_writer: Optional[EventWriter] = None,
+                 dedupe_window_s: float = 5.0, dedupe_max_keys: int = 10000,
+                 dedupe_ttl_s: float = 3600.0,
+                 device_registry: Optional[DeviceRegistry] = None,
+                 active_sessions: Optional[ActiveSessionIndex] = None,
+                 user_stats: Optional[UserStats] = None,
+                 missions: Optional[MissionEngine] = None,
+                 event_hub: Optional[EventHub] = None) -> None:
         self.db = db
+        self.event_hub = event_hub
+        self.user_stats = user_stats
+        self.missions = missions
+        self.device_registry = device_registry
+        self.active_sessions = active_sessions
+        self.event_writer = event_writer
+        self.dedupe_window_s = dedupe_window_s
+        # Every entry has size 1, so the byte budget is a key count
+        self._recent_keys: LRUCache[float] = LRUCache(dedupe_max_keys, dedupe_ttl_s)
+        self.duplicates = 0
+        self.duplicates_by_index = 0
         self.host = host
         self.port = port
         self.topic = topic
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(1, queue_size)
+        self.intake_size = max(1, intake_size)
         self._stopped = asyncio.Event()
+        self._intake: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize=self.intake_size)
+        self._queues: List["asyncio.Queue[Tuple[float, Dict[str, Any]]]"] = []
+        self._handlers: List[asyncio.Task] = []
+        self.received = 0
+        self.processed = 0
+        self.errors = 0
+        self.invalid = 0
+        self.blocked = 0
+        self.dropped = 0
+        # Receipt to handler start, and handler duration
+        self.lag = Histogram(LATENCY_BUCKETS_MS)
+        self.processing = Histogram(LATENCY_BUCKETS_MS)
 
     def stop(self) -> None:
         self._stopped.set()
 
+    def _start_handlers(self) -> None:
+        if self._handlers:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.concurrency)]
+        self._handlers = [
+            asyncio.create_task(self._handle_partition(queue), name=f"mqtt_handler_{i}")
+            for i, queue in enumerate(self._queues)
+        ]
+        self._handlers.append(asyncio.create_task(self._drain_intake(), name="mqtt_intake"))
+
     async def run(self) -> None:
         """Run the MQTT consumer loop with basic reconnect logic."""
-        while not self._stopped.is_set():
+        self._start_handlers()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    logger.info("Connecting to MQTT %s:%s", self.host, self.port)
+                    async with Client(self.host, self.port) as client:
+                        # Bounded here too, though the loop below drains it without waiting
+                        async with client.unfiltered_messages(queue_maxsize=self.intake_size) as messages:
+                            await client.subscribe(self.topic)
+                            logger.info("Subscribed to topic: %s", self.topic)
+                            async for message in messages:
+                                if self._stopped.is_set():
+                                    break
+                                self._accept(message.payload)
+                except MqttError as e:
+                    if self._stopped.is_set():
+                        break
+                    logger.warning("MQTT error: %s. Reconnecting in 5s...", e)
+                    await asyncio.sleep(5)
+        finally:
+            for task in self._handlers:
+                task.cancel()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            self._handlers = []
+
+    def _accept(self, raw: bytes) -> None:
+        try:
+            self._intake.put_nowait(raw)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning("MQTT intake full (%d), %d messages dropped so far", self.intake_size, self.dropped)
+
+    async def _drain_intake(self) -> None:
+        while True:
+            raw = await self._intake.get()
             try:
-                logger.info("Connecting to MQTT %s:%s", self.host, self.port)
-                async with Client(self.host, self.port) as client:
-                    async with client.unfiltered_messages() as messages:
-                        await client.subscribe(self.topic)
-                        logger.info("Subscribed to topic: %s", self.topic)
-                        async for message in messages:
-                            if self._stopped.is_set():
-                                break
-                            try:
-                                payload = message.payload.decode("utf-8")
-                                await self._handle_message(payload)
-                            except Exception as e:  # noqa: BLE001
-                                logger.exception("Error handling MQTT message: %s", e)
-            except MqttError as e:
-                if self._stopped.is_set():
-                    break
-                logger.warning("MQTT error: %s. Reconnecting in 5s...", e)
-                await asyncio.sleep(5)
-
-    async def _handle_message(self, payload: str) -> None:
+                await self._dispatch(raw)
+            finally:
+                self._intake.task_done()
+
+    @staticmethod
+    def _partition_key(data: Dict[str, Any]) -> str:
+        return str(data.get("sessionId") or data.get("sid") or data.get("binId") or data.get("deviceId") or "")
+
+    async def _dispatch(self, raw: bytes) -> None:
         try:
-            data = json.loads(payload)
-        except json.JSONDecodeError:
-            logger.warning("Invalid JSON payload: %s", payload)
+            data = json.loads(raw.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            self.invalid += 1
+            logger.warning("Invalid JSON payload: %r", raw[:200])
+            return
+        if not isinstance(data, dict):
+            self.invalid += 1
+            logger.warning("Unexpected MQTT payload: %r", raw[:200])
             return
+        self.received += 1
+        if self.device_registry is not None:
+            self.device_registry.seen(data.get("deviceId"))
+        now = datetime.utcnow()
+        data["receivedAt"] = now.isoformat()
+        if "ts" in data:
+            data["deviceTs"] = data["ts"]
+        # Same sortable timestamp as the API's events, for /events/latest and keyset cursors
+        data["ts"] = now
+        queue = self._queues[zlib.crc32(self._partition_key(data).encode()) % len(self._queues)]
+        if queue.full():
+            self.blocked += 1
+        # Blocks while this partition is full: back-pressure instead of unbounded buffering
+        await queue.put((time.monotonic(), data))
+
+    async def _handle_partition(self, queue: "asyncio.Queue[Tuple[float, Dict[str, Any]]]") -> None:
+        while True:
+            received_at, data = await queue.get()
+            started = time.monotonic()
+            self.lag.observe((started - received_at) * 1000.0)
+            try:
+                await self._handle_message(data)
+                self.processed += 1
+            except Exception as e:  # noqa: BLE001
+                self.errors += 1
+                logger.exception("Error handling MQTT message: %s", e)
+            finally:
+                self.processing.observe((time.monotonic() - started) * 1000.0)
+                queue.task_done()
 
-        data["receivedAt"] = datetime.utcnow().isoformat()
-        await self.db.events.insert_one(data)
+    def stats(self) -> Dict[str, Any]:
+        depths = [queue.qsize() for queue in self._queues]
+        return {
+            "concurrency": self.concurrency,
+            "queueSize": self.queue_size,
+            "intakeSize": self.intake_size,
+            "intakeDepth": self._intake.qsize(),
+            "queueDepth": sum(depths),
+            "maxPartitionDepth": max(depths) if depths else 0,
+            "received": self.received,
+            "processed": self.processed,
+            "errors": self.errors,
+            "invalid": self.invalid,
+            "blocked": self.blocked,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+            "duplicatesByIndex": self.duplicates_by_index,
+            "recentKeys": len(self._recent_keys),
+            "lagMs": self.lag.snapshot(),
+            "processingMs": self.processing.snapshot(),
+        }
+
+    def _idempotency_key(self, data: Dict[str, Any], now: float) -> Tuple[str, str, bool]:
+        """Return (key, memo key, seen recently); the key is what the unique index enforces.
+
+        The memo key is the entry remembered in ``_recent_keys``; pop it when
+        handling fails so that a redelivery is processed again.
+        """
+        session_id = data.get("sessionId") or data.get("sid")
+        if data.get("msgId"):
+            key = f"msg:{data.get('deviceId') or ''}:{data['msgId']}"
+        elif session_id and data.get("seq") is not None:
+            key = f"seq:{session_id}:{data['seq']}"
+        else:
+            # Legacy firmware: no ids, so repeats of the same report within the window are duplicates
+            scope = f"{session_id or data.get('deviceId') or data.get('binId') or ''}:{data.get('label')}"
+            last = self._recent_keys.get(f"recent:{scope}")
+            self._recent_keys.put(f"recent:{scope}", now, 1)
+            window = max(self.dedupe_window_s, 1e-3)
+            return f"win:{scope}:{int(now // window)}", f"recent:{scope}", last is not None and now - last < window
+        seen = self._recent_keys.get(key) is not None
+        self._recent_keys.put(key, now, 1)
+        return key, key, seen
+
+    async def _handle_message(self, data: Dict[str, Any]) -> None:
+        key, memo_key, seen = self._idempotency_key(data, time.time())
+        if seen:
+            self.duplicates += 1
+            logger.info("Dropping duplicate MQTT event %s", key)
+            return
+        data["idempotencyKey"] = key
+        try:
+            if self.event_writer is not None:
+                # Fire-and-forget: the award logic below does not read the event back
+                await self.event_writer.write(data)
+            else:
+                await self.db.events.insert_one(data)
+        except Exception:
+            # Not stored: let a redelivery through instead of dropping it as a duplicate
+            self._recent_keys.pop(memo_key)
+            raise
         logger.info("Stored MQTT event: %s", data)
+        session_id = data.get("sessionId") or data.get("sid")
+        if self.event_hub is not None:
+            user_id = self.active_sessions.user_for(str(session_id)) if self.active_sessions and session_id else None
+            self.event_hub.publish("disposal", data, user_id=user_id)
 
         # If this is a disposal completion event with a session, award points
+        claim_inserted = points_applied = False
         try:
             # Expected fields from ESP32 event publisher
-            session_id = data.get("sessionId") or data.get("sid")
             label = data.get("label") or "unknown"
             bin_id = data.get("binId")
             if session_id:
@@ -78,11 +278,38 @@ class MQTTWorker:
                         "status": "awarded" if points > 0 else "skipped",
                         "source": "disposal_complete",
                     }
-                    await self.db.claims.insert_one(claim)
+                    claim["idempotencyKey"] = key
+                    try:
+                        await self.db.claims.insert_one(claim)
+                    except DuplicateKeyError:
+                        self.duplicates_by_index += 1
+                        logger.info("Claim for %s already recorded, not awarding again", key)
+                        return
+                    claim_inserted = True
                     if points > 0 and user_id:
                         await self.db.users.update_one({"userId": user_id}, {"$inc": {"points": points}}, upsert=True)
+                    points_applied = True
                     # Mark session lastAction and optionally keep active for multi-throw
-                    await self.db.sessions.update_one({"_id": sdoc["_id"]}, {"$set": {"lastActionAt": datetime.utcnow()}, "$inc": {"disposals": 1}})
+                    now = datetime.utcnow()
+                    if self.user_stats is not None:
+                        await self.user_stats.record_disposal(user_id, claim["ts"], points)
+                    if self.missions is not None:
+                        await self.missions.on_disposal(user_id, claim["ts"])
+                    await self.db.sessions.update_one({"_id": sdoc["_id"]}, {"$set": {"lastActionAt": now}, "$inc": {"disposals": 1}})
+                    if self.active_sessions is not None:
+                        self.active_sessions.touch(session_id, now)
+                    if self.event_hub is not None:
+                        self.event_hub.publish("points_awarded", {"points": points, "label": label, "ts": claim["ts"]},
+                                               user_id=user_id, session_id=session_id, bin_id=claim["binId"])
                     logger.info("Awarded %s points to %s for session %s", points, user_id, session_id)
         except Exception as e:  # noqa: BLE001
+            if not points_applied:
+                # Nothing was paid: forget the key, and the claim that would block the award,
+                # so that a redelivery retries it
+                self._recent_keys.pop(memo_key)
+                if claim_inserted:
+                    try:
+                        await self.db.claims.delete_one({"idempotencyKey": key})
+                    except Exception:  # noqa: BLE001
+                        logger.exception("Could not remove unpaid claim %s", key)
             logger.exception("Failed to process award: %s", e)
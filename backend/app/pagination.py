@@ -0,0 +1,101 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+
+_EPOCH = datetime(1970, 1, 1)
+
+Cursor = Tuple[datetime, ObjectId]
+
+
+def encode_cursor(ts: datetime, oid: ObjectId) -> str:
+    """Opaque page token for the row at (ts, _id); Mongo dates are millisecond precision"""
+    millis = (ts.replace(tzinfo=None) - _EPOCH) // timedelta(milliseconds=1)
+    return base64.urlsafe_b64encode(f"{millis}:{oid}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Cursor:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        millis, oid = raw.split(":", 1)
+        return _EPOCH + timedelta(milliseconds=int(millis)), ObjectId(oid)
+    except (binascii.Error, UnicodeDecodeError, ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_filter(cursor: Optional[Cursor], field: str = "ts", descending: bool = True) -> Dict[str, Any]:
+    """Rows strictly after ``cursor`` in (field, _id) order; _id breaks ties between equal timestamps.
+
+    Only rows whose ``field`` is a date are listed. Legacy rows holding e.g. a
+    device-supplied string sort after every date and never compare against a
+    date cursor, so they would otherwise end paging partway through.
+    """
+    dated = {field: {"$type": "date"}}
+    if cursor is None:
+        return dated
+    ts, oid = cursor
+    op = "$lt" if descending else "$gt"
+    return {**dated, "$or": [{field: {op: ts}}, {field: ts, "_id": {op: oid}}]}
+
+
+def keyset_sort(field: str = "ts", descending: bool = True) -> List[Tuple[str, int]]:
+    direction = -1 if descending else 1
+    return [(field, direction), ("_id", direction)]
+
+
+def projection(fields: Optional[str], required: Tuple[str, ...] = ("ts",)) -> Optional[Dict[str, int]]:
+    """Mongo projection from a comma-separated ``fields`` query parameter (None = all fields)"""
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    if any(name.startswith("$") for name in names):
+        raise HTTPException(status_code=400, detail="Invalid field name")
+    # _id is included by Mongo; the cursor also needs the sort field
+    return {name: 1 for name in (*names, *required)}
+
+
+def bson_default(value: Any) -> Any:
+    """``json.dumps`` hook for the BSON types stored in events"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    return str(value)
+
+
+def dumps(value: Any) -> str:
+    return json.dumps(value, default=bson_default, separators=(",", ":"))
+
+
+async def ndjson_lines(rows: AsyncIterator[Any], render: Callable[[Any], Any] = lambda row: row) -> AsyncIterator[str]:
+    """One JSON line per row, pulled from the Mongo cursor batch by batch"""
+    async for row in rows:
+        yield dumps(render(row)) + "\n"
+
+
+async def merge_sorted(streams: List[AsyncIterator[Any]], key: Callable[[Any], Any],
+                       descending: bool = True) -> AsyncIterator[Any]:
+    """Merge already-sorted async streams, holding one row per stream in memory"""
+    heads: List[Tuple[Any, int, AsyncIterator[Any]]] = []
+
+    async def advance(stream: AsyncIterator[Any], index: int) -> None:
+        try:
+            row = await stream.__anext__()
+        except StopAsyncIteration:
+            return
+        heads.append((row, index, stream))
+
+    for index, stream in enumerate(streams):
+        await advance(stream, index)
+    pick = max if descending else min
+    while heads:
+        row, index, stream = heads.pop(pick(range(len(heads)), key=lambda i: key(heads[i][0])))
+        yield row
+        await advance(stream, index)
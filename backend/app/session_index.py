@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, NamedTuple, Optional, Set
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from .event_hub import EventHub
+from .metrics import Histogram
+from .missions import MissionEngine
+from .user_stats import UserStats
+
+logger = logging.getLogger("ecotionbuddy.sessions")
+
+
+class ActiveSession(NamedTuple):
+    session_id: str
+    user_id: Optional[str]
+    device_id: Optional[str]
+    last_action_at: datetime
+
+
+class ActiveSessionIndex:
+    """binId -> active session, so uploads attach to a session without a query.
+
+    Kept current by session start/end and disposal events, rebuilt from Mongo at
+    startup (until then lookups go to Mongo). A session whose ``lastActionAt`` is
+    older than ``idle_timeout_s`` no longer receives uploads. Ends and touches
+    that arrive while a rebuild's query runs are replayed over its snapshot, so
+    a session ended meanwhile is not brought back.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, idle_timeout_s: float = 300.0) -> None:
+        self.collection = collection
+        self.idle_timeout = timedelta(seconds=idle_timeout_s)
+        self._by_bin: Dict[str, ActiveSession] = {}
+        self._bin_of: Dict[str, str] = {}  # sessionId -> binId
+        # Set while a rebuild reads Mongo: sessions ended / last touched since its query began
+        self._ended_during_rebuild: Optional[Set[str]] = None
+        self._touched_during_rebuild: Dict[str, datetime] = {}
+        self.ready = False
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    async def rebuild(self) -> None:
+        """Load active sessions, retrying until Mongo is reachable"""
+        while True:
+            self._ended_during_rebuild = set()
+            self._touched_during_rebuild = {}
+            try:
+                by_bin: Dict[str, ActiveSession] = {}
+                # Oldest first so the newest session per bin wins
+                async for doc in self.collection.find({"status": "active"}).sort("startedAt", 1):
+                    if doc.get("binId"):
+                        by_bin[doc["binId"]] = self._entry(doc)
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # noqa: BLE001
+                logger.warning("Active session rebuild failed: %s. Retrying in 5s...", e)
+                await asyncio.sleep(5)
+        ended, touched = self._ended_during_rebuild, self._touched_during_rebuild
+        self._ended_during_rebuild, self._touched_during_rebuild = None, {}
+        # Sessions started while the query ran are already in the index and newer
+        for bin_id, entry in by_bin.items():
+            if entry.session_id in ended:
+                continue
+            if entry.session_id in touched:
+                entry = entry._replace(last_action_at=max(entry.last_action_at, touched[entry.session_id]))
+            self._by_bin.setdefault(bin_id, entry)
+        self._bin_of = {entry.session_id: bin_id for bin_id, entry in self._by_bin.items()}
+        self.ready = True
+        logger.info("Active session index rebuilt: %d sessions", len(self._by_bin))
+
+    @staticmethod
+    def _entry(doc: Dict[str, Any]) -> ActiveSession:
+        return ActiveSession(str(doc["_id"]), doc.get("userId"), doc.get("deviceId"),
+                             doc.get("lastActionAt") or doc.get("startedAt") or datetime.utcnow())
+
+    def start(self, bin_id: str, session_id: str, user_id: Optional[str], device_id: Optional[str],
+              ts: datetime) -> None:
+        previous = self._by_bin.get(bin_id)
+        if previous is not None:
+            self._bin_of.pop(previous.session_id, None)
+        self._by_bin[bin_id] = ActiveSession(session_id, user_id, device_id, ts)
+        self._bin_of[session_id] = bin_id
+
+    def end(self, session_id: str) -> None:
+        if self._ended_during_rebuild is not None:
+            self._ended_during_rebuild.add(session_id)
+        bin_id = self._bin_of.pop(session_id, None)
+        entry = self._by_bin.get(bin_id) if bin_id else None
+        if entry is not None and entry.session_id == session_id:
+            del self._by_bin[bin_id]  # type: ignore[arg-type]
+
+    def user_for(self, session_id: str) -> Optional[str]:
+        """User of an indexed active session, if any"""
+        bin_id = self._bin_of.get(session_id)
+        entry = self._by_bin.get(bin_id) if bin_id else None
+        return entry.user_id if entry is not None and entry.session_id == session_id else None
+
+    def touch(self, session_id: str, ts: Optional[datetime] = None) -> None:
+        if self._ended_during_rebuild is not None:
+            self._touched_during_rebuild[session_id] = ts or datetime.utcnow()
+        bin_id = self._bin_of.get(session_id)
+        entry = self._by_bin.get(bin_id) if bin_id else None
+        if entry is not None and entry.session_id == session_id:
+            self._by_bin[bin_id] = entry._replace(last_action_at=ts or datetime.utcnow())  # type: ignore[index]
+
+    async def lookup(self, bin_id: str) -> Optional[str]:
+        """Active, non-idle session id for a bin"""
+        if not self.ready:
+            doc = await self.collection.find_one({"binId": bin_id, "status": "active"}, sort=[("startedAt", -1)])
+            return str(doc["_id"]) if doc else None
+        entry = self._by_bin.get(bin_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        if datetime.utcnow() - entry.last_action_at > self.idle_timeout:
+            self.expired += 1
+            self.end(entry.session_id)
+            return None
+        self.hits += 1
+        return entry.session_id
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "active": len(self._by_bin),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+        }
+
+
+class SessionSweeper:
+    """Ends sessions idle longer than ``ttl_s`` every ``interval_s``.
+
+    Each sweep is one ``update_many`` that tags the sessions it ends with a sweep
+    id; they are then read back by that tag (so a session touched between
+    selecting and updating is never deactivated by mistake), dropped from the
+    active-session index and sent ``deactivate`` in a single publish pass.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, index: ActiveSessionIndex,
+                 publish: Callable[[str, Dict[str, Any]], Any], default_device: str,
+                 ttl_s: float = 300.0, interval_s: float = 30.0,
+                 user_stats: Optional[UserStats] = None,
+                 missions: Optional[MissionEngine] = None,
+                 event_hub: Optional[EventHub] = None) -> None:
+        self.collection = collection
+        self.event_hub = event_hub
+        self.user_stats = user_stats
+        self.missions = missions
+        self.index = index
+        self.publish = publish
+        self.default_device = default_device
+        self.ttl = timedelta(seconds=ttl_s)
+        self.interval_s = interval_s
+        self.sweeps = 0
+        self.expired = 0
+        self.errors = 0
+        self.last_sweep_at: Optional[datetime] = None
+        self.last_expired = 0
+        self.duration_ms = Histogram([5, 10, 25, 50, 100, 250, 1000])
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_s)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # noqa: BLE001
+                self.errors += 1
+                logger.exception("Session sweep failed: %s", e)
+
+    async def sweep(self) -> int:
+        started = time.monotonic()
+        now = datetime.utcnow()
+        sweep_id = ObjectId()
+        result = await self.collection.update_many(
+            {"status": "active", "lastActionAt": {"$lt": now - self.ttl}},
+            {"$set": {"status": "ended", "endedAt": now, "reason": "timeout", "sweepId": sweep_id}},
+        )
+        expired = []
+        if result.modified_count:
+            expired = await self.collection.find(
+                {"sweepId": sweep_id}, {"deviceId": 1, "binId": 1, "userId": 1}
+            ).to_list(length=None)
+        for doc in expired:
+            session_id = str(doc["_id"])
+            self.index.end(session_id)
+            device_id = doc.get("deviceId") or self.default_device
+            self.publish(f"ecotionbuddy/ctrl/{device_id}", {"action": "deactivate", "sessionId": session_id, "reason": "timeout"})
+            if self.user_stats is not None:
+                await self.user_stats.record_session_end(doc.get("userId"), now)
+            if self.missions is not None:
+                await self.missions.on_session_end(doc.get("userId"), now)
+            if self.event_hub is not None:
+                self.event_hub.publish("session_ended", {"reason": "timeout", "endedAt": now},
+                                       user_id=doc.get("userId"), session_id=session_id, bin_id=doc.get("binId"))
+        self.sweeps += 1
+        self.expired += len(expired)
+        self.last_expired = len(expired)
+        self.last_sweep_at = now
+        self.duration_ms.observe((time.monotonic() - started) * 1000.0)
+        if expired:
+            logger.info("Session sweep ended %d idle sessions", len(expired))
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "intervalS": self.interval_s,
+            "ttlS": self.ttl.total_seconds(),
+            "sweeps": self.sweeps,
+            "expired": self.expired,
+            "lastExpired": self.last_expired,
+            "lastSweepAt": self.last_sweep_at.isoformat() if self.last_sweep_at else None,
+            "errors": self.errors,
+            "durationMs": self.duration_ms.snapshot(),
+        }
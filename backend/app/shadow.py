@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from .classifier import TrashClassifier
+from .inference import Prediction
+from .metrics import Histogram
+
+logger = logging.getLogger("ecotionbuddy.shadow")
+
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500]
+
+
+class ShadowEvaluator:
+    """Scores a sample of uploads with a candidate model, off the request path.
+
+    The candidate runs on its own single worker thread so it never occupies a slot
+    in the primary inference pool. ``cpu_budget`` is the fraction of one core it may
+    use: after a job that took ``t`` seconds the evaluator idles for
+    ``t * (1 / cpu_budget - 1)`` and uploads arriving meanwhile are not sampled.
+    Results are written next to the primary label as ``images.shadow``.
+    """
+
+    def __init__(self, images: AsyncIOMotorCollection,
+                 candidate_getter: Callable[[str], Optional[TrashClassifier]],
+                 sample_rate: float = 0.1, cpu_budget: float = 0.25, max_pending: int = 4) -> None:
+        self.images = images
+        self._get_candidate = candidate_getter
+        self.version: Optional[str] = None
+        self.sample_rate = sample_rate
+        self.cpu_budget = min(1.0, max(0.01, cpu_budget))
+        self.max_pending = max(1, max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+        self._tasks: Set[asyncio.Task] = set()
+        self._idle_until = 0.0
+        self._reset_counters()
+
+    def _reset_counters(self) -> None:
+        self.scored = 0
+        self.agreed = 0
+        self.failed = 0
+        self.skipped_budget = 0
+        self.skipped_busy = 0
+        self.shadow_latency = Histogram(LATENCY_BUCKETS_MS)
+        self.primary_latency = Histogram(LATENCY_BUCKETS_MS)
+
+    def configure(self, version: Optional[str], sample_rate: Optional[float] = None) -> None:
+        """Start shadowing ``version`` (None disables); counters restart per candidate"""
+        if version != self.version:
+            self._reset_counters()
+        self.version = version
+        if sample_rate is not None:
+            self.sample_rate = min(1.0, max(0.0, sample_rate))
+        logger.info("Shadow candidate: %s (sample rate %.2f)", version, self.sample_rate)
+
+    @property
+    def enabled(self) -> bool:
+        return self.version is not None and self.sample_rate > 0
+
+    def maybe_submit(self, image_id: ObjectId, data: bytes, primary: Prediction, primary_ms: float) -> bool:
+        """Schedule shadow scoring for a sampled upload; never blocks or raises"""
+        if not self.enabled or primary.model_version == self.version:
+            return False
+        if random.random() >= self.sample_rate:
+            return False
+        if len(self._tasks) >= self.max_pending:
+            self.skipped_busy += 1
+            return False
+        if time.monotonic() < self._idle_until:
+            self.skipped_budget += 1
+            return False
+        candidate = self._get_candidate(self.version)  # type: ignore[arg-type]
+        if candidate is None:
+            return False
+        task = asyncio.create_task(self._score(candidate, image_id, data, primary, primary_ms))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    def _predict(self, candidate: TrashClassifier, data: bytes):
+        start = time.perf_counter()
+        image = candidate.decode_image(data)
+        result = candidate.predict_arrays([image])[0] if image is not None else None
+        return result, time.perf_counter() - start
+
+    async def _score(self, candidate: TrashClassifier, image_id: ObjectId, data: bytes,
+                     primary: Prediction, primary_ms: float) -> None:
+        # Pin the candidate so retiring it waits for this job
+        candidate.inflight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result, elapsed = await loop.run_in_executor(self._pool, self._predict, candidate, data)
+        except Exception as e:  # noqa: BLE001
+            self.failed += 1
+            logger.warning("Shadow inference failed for image %s: %s", image_id, e)
+            return
+        finally:
+            candidate.inflight -= 1
+        self._idle_until = time.monotonic() + elapsed * (1.0 / self.cpu_budget - 1.0)
+        if result is None:
+            self.failed += 1
+            return
+        label, confidence = result
+        latency_ms = elapsed * 1000.0
+        agree = label == primary.label
+        self.scored += 1
+        self.agreed += agree
+        self.shadow_latency.observe(latency_ms)
+        self.primary_latency.observe(primary_ms)
+        try:
+            await self.images.update_one({"_id": image_id}, {"$set": {"shadow": {
+                "modelVersion": candidate.version,
+                "label": label,
+                "confidence": confidence,
+                "agree": agree,
+                "latencyMs": round(latency_ms, 2),
+                "primaryLatencyMs": round(primary_ms, 2),
+                "ts": datetime.utcnow(),
+            }}})
+        except Exception as e:  # noqa: BLE001
+            logger.warning("Failed to store shadow result for image %s: %s", image_id, e)
+
+    async def report(self, version: Optional[str] = None, since: Optional[datetime] = None) -> Dict[str, Any]:
+        """Agreement and latency per candidate, aggregated from stored shadow results"""
+        match: Dict[str, Any] = {"shadow.modelVersion": version or self.version}
+        if since is not None:
+            match["ts"] = {"$gte": since}
+        summary: List[Dict[str, Any]] = await self.images.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": "$modelVersion",
+                "count": {"$sum": 1},
+                "agreed": {"$sum": {"$cond": ["$shadow.agree", 1, 0]}},
+                "primaryConfidence": {"$avg": "$confidence"},
+                "shadowConfidence": {"$avg": "$shadow.confidence"},
+                "primaryLatencyMs": {"$avg": "$shadow.primaryLatencyMs"},
+                "shadowLatencyMs": {"$avg": "$shadow.latencyMs"},
+            }},
+        ]).to_list(length=None)
+        disagreements = await self.images.aggregate([
+            {"$match": {**match, "shadow.agree": False}},
+            {"$group": {"_id": {"primary": "$label", "shadow": "$shadow.label"}, "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": 20},
+        ]).to_list(length=20)
+        by_primary = []
+        for row in summary:
+            row["primaryVersion"] = row.pop("_id")
+            row["agreement"] = round(row["agreed"] / row["count"], 4) if row["count"] else None
+            by_primary.append(row)
+        return {
+            "candidate": version or self.version,
+            "byPrimaryVersion": by_primary,
+            "topDisagreements": [{**d["_id"], "count": d["count"]} for d in disagreements],
+            "live": self.stats(),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "candidate": self.version,
+            "sampleRate": self.sample_rate,
+            "cpuBudget": self.cpu_budget,
+            "pending": len(self._tasks),
+            "scored": self.scored,
+            "agreement": round(self.agreed / self.scored, 4) if self.scored else None,
+            "failed": self.failed,
+            "skippedBudget": self.skipped_budget,
+            "skippedBusy": self.skipped_busy,
+            "shadowLatencyMs": self.shadow_latency.snapshot(),
+            "primaryLatencyMs": self.primary_latency.snapshot(),
+        }
+
+    def shutdown(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .jobs import Job, Sink
+from .storage import write_atomic
+
+# Optional Telegram support
+try:  # Lazy import: keep backend running if package missing
+    from telegram import Bot, InputMediaPhoto  # type: ignore
+    from telegram.request import HTTPXRequest  # type: ignore
+    TELEGRAM_AVAILABLE = True
+except Exception:  # pragma: no cover
+    Bot = InputMediaPhoto = HTTPXRequest = None  # type: ignore
+    TELEGRAM_AVAILABLE = False
+
+logger = logging.getLogger("ecotionbuddy.sinks")
+
+# Reads stored image bytes back from a StoredImage.ref() (ImageStorage.load)
+ImageLoader = Callable[[Dict[str, Any]], Awaitable[bytes]]
+
+
+async def _image_bytes(load: ImageLoader, payload: Dict[str, Any]) -> bytes:
+    # Jobs hold a reference to the stored upload; older ones carried the bytes themselves
+    if payload.get("data") is not None:
+        return payload["data"]
+    return await load(payload["image"])
+
+# Telegram rejects media groups larger than this
+MEDIA_GROUP_MAX = 10
+
+
+class TelegramSink(Sink):
+    """Sends upload photos to a chat through one long-lived Bot.
+
+    Jobs are grouped by bin, so a burst from a busy bin goes out as a single
+    media group (up to 10 photos) instead of one message per photo.
+    """
+
+    name = "telegram"
+
+    def __init__(self, token: str, chat_id: str, load: ImageLoader, concurrency: int = 1,
+                 batch_size: int = MEDIA_GROUP_MAX) -> None:
+        super().__init__(concurrency, min(batch_size, MEDIA_GROUP_MAX))
+        self.load = load
+        self.token = token
+        self.chat_id = chat_id
+        self._bot: Optional[Any] = None
+        self._initialized = False
+
+    async def start(self) -> None:
+        assert Bot is not None and HTTPXRequest is not None  # for type checkers
+        # One connection per worker, reused for every send
+        self._bot = Bot(token=self.token, request=HTTPXRequest(connection_pool_size=self.concurrency))
+
+    async def close(self) -> None:
+        if self._bot is not None and self._initialized:
+            await self._bot.shutdown()
+
+    async def handle(self, jobs: List[Job]) -> None:
+        assert self._bot is not None
+        if not self._initialized:
+            # Deferred to the first send so startup does not depend on reaching Telegram
+            await self._bot.initialize()
+            self._initialized = True
+        photos = [await _image_bytes(self.load, job["payload"]) for job in jobs]
+        if len(jobs) == 1:
+            payload = jobs[0]["payload"]
+            await self._bot.send_photo(chat_id=self.chat_id, photo=photos[0], caption=payload.get("caption"))
+        else:
+            media = [
+                InputMediaPhoto(media=photo, caption=job["payload"].get("caption") if i == 0 else None)
+                for i, (job, photo) in enumerate(zip(jobs, photos))
+            ]
+            await self._bot.send_media_group(chat_id=self.chat_id, media=media)
+        logger.info("Telegram sent %d photo(s): %s", len(jobs), ", ".join(j["payload"]["filename"] for j in jobs))
+
+
+class MirrorSink(Sink):
+    """Copies upload bytes to a network share; an unmounted share is retried later"""
+
+    name = "mirror"
+
+    def __init__(self, share_path: str, load: ImageLoader, concurrency: int = 2) -> None:
+        super().__init__(concurrency)
+        self.share_path = share_path
+        self.load = load
+
+    def _write(self, filename: str, data: bytes) -> str:
+        # Validate dest directory exists (inside host or container namespace)
+        if not os.path.isdir(self.share_path):
+            raise FileNotFoundError(f"Mirror path not accessible: {self.share_path}")
+        dest_path = os.path.join(self.share_path, filename)
+        write_atomic(dest_path, data)
+        return dest_path
+
+    async def handle(self, jobs: List[Job]) -> None:
+        for job in jobs:
+            payload = job["payload"]
+            data = await _image_bytes(self.load, payload)
+            dest_path = await asyncio.to_thread(self._write, payload["filename"], data)
+            logger.info("Mirrored file to share: %s", dest_path)
@@ -0,0 +1,226 @@
+import asyncio
+import contextlib
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, NamedTuple, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo.errors import PyMongoError
+
+from .cache import LRUCache
+from .metrics import Histogram
+
+logger = logging.getLogger("ecotionbuddy.storage")
+
+STORAGE_KINDS = ("disk", "gridfs", "cas")
+
+
+class StoredImage(NamedTuple):
+    storage: str
+    filename: str
+    url: str
+    digest: str
+    path: Optional[str] = None
+    gridfs_id: Optional[ObjectId] = None
+    deduplicated: bool = False
+
+    def ref(self) -> Dict[str, Any]:
+        """Where the bytes live, for job payloads and other records that read them back later"""
+        return {"storage": self.storage, "path": self.path, "gridfsId": self.gridfs_id, "sha256": self.digest}
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write ``data`` to ``path`` so readers and crashes never see a partial file.
+
+    Blocking: call through ``asyncio.to_thread``. The bytes go to a temp file in
+    the same directory, are fsynced, then renamed over ``path``.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class ImageStorage:
+    """Base for upload persistence: hashing, recent-frame dedupe and counters.
+
+    ESP32 cameras often resend the same frame (retries, a static scene), so the
+    SHA-256 of every upload is remembered for the last ``dedupe_max_keys``
+    frames; a repeat returns the earlier ``StoredImage`` without writing again.
+    Subclasses implement ``_write`` and may dedupe further against what is
+    already stored.
+    """
+
+    kind = "base"
+
+    def __init__(self, dedupe_max_keys: int = 1024) -> None:
+        # Every entry has size 1, so the byte budget is a key count
+        self._recent: LRUCache[StoredImage] = LRUCache(dedupe_max_keys)
+        self.saved = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self.bytes_written = 0
+        self.write_ms = Histogram([1, 5, 10, 25, 50, 100, 250, 1000])
+
+    async def save(self, data: bytes, ts: datetime, metadata: Dict[str, Any]) -> StoredImage:
+        digest = hashlib.sha256(data).hexdigest()
+        recent = self._recent.get(digest)
+        if recent is not None:
+            self.deduplicated += 1
+            return recent._replace(deduplicated=True)
+        started = time.monotonic()
+        try:
+            stored = await self._write(data, digest, ts, metadata)
+        except Exception:
+            self.failed += 1
+            raise
+        self.write_ms.observe((time.monotonic() - started) * 1000.0)
+        if stored.deduplicated:
+            self.deduplicated += 1
+        else:
+            self.saved += 1
+            self.bytes_written += len(data)
+        self._recent.put(digest, stored._replace(deduplicated=False), 1)
+        return stored
+
+    async def _write(self, data: bytes, digest: str, ts: datetime, metadata: Dict[str, Any]) -> StoredImage:
+        raise NotImplementedError
+
+    async def load(self, ref: Dict[str, Any]) -> bytes:
+        """Read back the bytes of a ``StoredImage.ref()``"""
+        if not ref.get("path"):
+            raise FileNotFoundError(f"No file for stored image {ref.get('sha256')}")
+        return await asyncio.to_thread(_read_file, ref["path"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "saved": self.saved,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed,
+            "bytesWritten": self.bytes_written,
+            "writeMs": self.write_ms.snapshot(),
+        }
+
+
+class DiskStorage(ImageStorage):
+    """One timestamp-named file per upload under ``directory``, served at /uploads"""
+
+    kind = "disk"
+
+    def __init__(self, directory: str, dedupe_max_keys: int = 1024) -> None:
+        super().__init__(dedupe_max_keys)
+        self.directory = directory
+
+    async def _write(self, data: bytes, digest: str, ts: datetime, metadata: Dict[str, Any]) -> StoredImage:
+        filename = ts.strftime("%Y%m%dT%H%M%S%f") + ".jpg"
+        path = os.path.join(self.directory, filename)
+        await asyncio.to_thread(write_atomic, path, data)
+        return StoredImage(self.kind, filename, f"/uploads/{filename}", digest, path=path)
+
+
+class ContentAddressedStorage(ImageStorage):
+    """Files named by their SHA-256 under ``directory/cas``, so identical frames share one file"""
+
+    kind = "cas"
+
+    def __init__(self, directory: str, dedupe_max_keys: int = 1024) -> None:
+        super().__init__(dedupe_max_keys)
+        self.directory = directory
+
+    def _store(self, path: str, data: bytes) -> bool:
+        if os.path.exists(path):
+            return False
+        # Concurrent writers of the same digest race harmlessly: both rename identical bytes
+        write_atomic(path, data)
+        return True
+
+    async def _write(self, data: bytes, digest: str, ts: datetime, metadata: Dict[str, Any]) -> StoredImage:
+        relative = f"cas/{digest[:2]}/{digest}.jpg"
+        path = os.path.join(self.directory, *relative.split("/"))
+        written = await asyncio.to_thread(self._store, path, data)
+        return StoredImage(self.kind, f"{digest}.jpg", f"/uploads/{relative}", digest, path=path,
+                           deduplicated=not written)
+
+
+class GridFSStorage(ImageStorage):
+    """Uploads into GridFS, reusing an existing file with the same ``metadata.sha256``.
+
+    If GridFS rejects the write the upload goes to ``fallback`` (normally disk)
+    instead of being lost.
+    """
+
+    kind = "gridfs"
+
+    def __init__(self, bucket: AsyncIOMotorGridFSBucket, files: Any,
+                 fallback: Optional[ImageStorage] = None, dedupe_max_keys: int = 1024) -> None:
+        super().__init__(dedupe_max_keys)
+        self.bucket = bucket
+        self.files = files
+        self.fallback = fallback
+        self.fallbacks = 0
+
+    async def _write(self, data: bytes, digest: str, ts: datetime, metadata: Dict[str, Any]) -> StoredImage:
+        filename = ts.strftime("%Y%m%dT%H%M%S%f") + ".jpg"
+        try:
+            existing = await self.files.find_one({"metadata.sha256": digest}, {"_id": 1, "filename": 1})
+            if existing is not None:
+                return StoredImage(self.kind, existing.get("filename") or filename,
+                                   f"/images/{existing['_id']}", digest, gridfs_id=existing["_id"],
+                                   deduplicated=True)
+            file_id = await self.bucket.upload_from_stream(
+                filename, io.BytesIO(data), metadata={**metadata, "ts": ts, "sha256": digest},
+            )
+        except PyMongoError as e:
+            if self.fallback is None:
+                raise
+            self.fallbacks += 1
+            logger.error("GridFS upload failed, storing %s on %s instead: %s", filename, self.fallback.kind, e)
+            return await self.fallback.save(data, ts, metadata)
+        return StoredImage(self.kind, filename, f"/images/{file_id}", digest, gridfs_id=file_id)
+
+    async def load(self, ref: Dict[str, Any]) -> bytes:
+        if ref.get("gridfsId") is None:
+            # Stored on the fallback while GridFS was failing
+            return await super().load(ref)
+        grid_out = await self.bucket.open_download_stream(ref["gridfsId"])
+        return await grid_out.read()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["fallbacks"] = self.fallbacks
+        return stats
+
+
+def create_storage(kind: str, uploads_dir: str, bucket: Optional[AsyncIOMotorGridFSBucket] = None,
+                   files: Any = None, dedupe_max_keys: int = 1024) -> ImageStorage:
+    if kind == "gridfs":
+        if bucket is None:
+            raise ValueError("GridFS storage needs a bucket")
+        return GridFSStorage(bucket, files, fallback=DiskStorage(uploads_dir, dedupe_max_keys),
+                             dedupe_max_keys=dedupe_max_keys)
+    if kind == "cas":
+        return ContentAddressedStorage(uploads_dir, dedupe_max_keys)
+    if kind == "disk":
+        return DiskStorage(uploads_dir, dedupe_max_keys)
+    raise ValueError(f"Unknown IMAGE_STORAGE {kind!r}; expected one of {', '.join(STORAGE_KINDS)}")
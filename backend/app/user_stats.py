@@ -0,0 +1,182 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Collection, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+logger = logging.getLogger("ecotionbuddy.user_stats")
+
+
+def hour_bucket(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _category(value: Any) -> str:
+    # Field names cannot contain "." or start with "$"
+    return str(value or "unknown").strip().lower().replace(".", "_").lstrip("$") or "unknown"
+
+
+def _add(doc: Dict[str, Any], inc: Dict[str, float]) -> None:
+    for field, n in inc.items():
+        if "." in field:
+            parent, child = field.split(".", 1)
+            doc.setdefault(parent, {})[child] = doc.get(parent, {}).get(child, 0) + n
+        else:
+            doc[field] = doc.get(field, 0) + n
+
+
+# Counter groups and the collections they are counted from
+SOURCES = ("scans", "disposals", "sessions")
+
+
+async def _activity(db: AsyncIOMotorDatabase, user_id: Optional[str] = None, since: Optional[datetime] = None,
+                    until: Optional[datetime] = None, sources: Collection[str] = SOURCES,
+                    ) -> AsyncIterator[Tuple[str, datetime, Dict[str, float]]]:
+    """(userId, ts, increments) for every counted event in the source collections, in ``[since, until)``.
+
+    ``sources`` limits the read to some of ``SOURCES``: scans come from
+    ``events`` and ``images``, disposals from ``claims``, sessions from
+    ``sessions``.
+    """
+    scope: Dict[str, Any] = {"userId": user_id} if user_id else {"userId": {"$ne": None}}
+    window: Dict[str, Any] = {}
+    if since is not None:
+        window["$gte"] = since
+    if until is not None:
+        window["$lt"] = until
+
+    def timed(field: str) -> Dict[str, Any]:
+        return {**scope, field: window} if window else dict(scope)
+
+    if "scans" in sources:
+        async for event in db.events.find({**timed("ts"), "$or": [{"eventType": "scan"}, {"action": "scan"}]}):
+            payload = event.get("payload") or {}
+            points = payload.get("points") if isinstance(payload.get("points"), (int, float)) else 0
+            if isinstance(event.get("ts"), datetime):
+                yield event["userId"], event["ts"], {
+                    "scans": 1, f"scansByCategory.{_category(event.get('category') or payload.get('category'))}": 1,
+                    "points": points,
+                }
+        # Bin-camera classifications made during a user's session (flagged at upload)
+        async for image in db.images.find({**timed("ts"), "scanCounted": True}, {"userId": 1, "ts": 1, "label": 1}):
+            if isinstance(image.get("ts"), datetime):
+                yield image["userId"], image["ts"], {"scans": 1, f"scansByCategory.{_category(image.get('label'))}": 1}
+    if "disposals" in sources:
+        async for claim in db.claims.find({**timed("ts"), "source": "disposal_complete"}):
+            if isinstance(claim.get("ts"), datetime):
+                yield claim["userId"], claim["ts"], {"disposals": 1, "points": claim.get("points", 0)}
+    if "sessions" in sources:
+        async for session in db.sessions.find({**timed("endedAt"), "status": "ended"}, {"userId": 1, "endedAt": 1}):
+            if isinstance(session.get("endedAt"), datetime):
+                yield session["userId"], session["endedAt"], {"sessionsEnded": 1}
+
+
+class UserStats:
+    """Per-user activity counters in hourly buckets (``user_stats`` collection).
+
+    Each bucket document holds ``scans``, ``scansByCategory.<category>``,
+    ``disposals``, ``sessionsEnded`` and ``points`` for one user and hour, and is
+    incremented when the event is ingested. Mission progress and history
+    summaries then read a handful of buckets instead of scanning the user's
+    events and sessions. A window that starts mid-hour has that first hour
+    counted exactly from the source collections (``totals_since``).
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection) -> None:
+        self.collection = collection
+        self.updates = 0
+        self.errors = 0
+
+    @staticmethod
+    def _key(user_id: str, bucket: datetime) -> str:
+        return f"{user_id}:{bucket.strftime('%Y%m%d%H')}"
+
+    async def _inc(self, user_id: Optional[str], ts: datetime, inc: Dict[str, float]) -> None:
+        if not user_id:
+            return
+        bucket = hour_bucket(ts)
+        try:
+            await self.collection.update_one(
+                {"_id": self._key(user_id, bucket)},
+                {"$inc": inc, "$setOnInsert": {"userId": user_id, "bucket": bucket}},
+                upsert=True,
+            )
+            self.updates += 1
+        except Exception as e:  # noqa: BLE001 - counters must not fail the request that fed them
+            self.errors += 1
+            logger.warning("user_stats update for %s failed: %s", user_id, e)
+
+    async def record_scan(self, user_id: Optional[str], category: Any, ts: datetime, points: float = 0) -> None:
+        inc = {"scans": 1, f"scansByCategory.{_category(category)}": 1}
+        if points:
+            inc["points"] = points
+        await self._inc(user_id, ts, inc)
+
+    async def record_disposal(self, user_id: Optional[str], ts: datetime, points: float = 0) -> None:
+        await self._inc(user_id, ts, {"disposals": 1, "points": points})
+
+    async def record_session_end(self, user_id: Optional[str], ts: datetime) -> None:
+        await self._inc(user_id, ts, {"sessionsEnded": 1})
+
+    async def buckets(self, user_id: str, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        query: Dict[str, Any] = {"userId": user_id}
+        if since is not None:
+            query["bucket"] = {"$gte": hour_bucket(since)}
+        return await self.collection.find(query, {"_id": 0, "userId": 0}).to_list(length=None)
+
+    @staticmethod
+    def summarize(buckets: List[Dict[str, Any]], since: Optional[datetime] = None) -> Dict[str, Any]:
+        """Sum buckets at or after ``since`` (all of them when None)"""
+        floor = hour_bucket(since) if since is not None else None
+        totals: Dict[str, Any] = {"scans": 0, "disposals": 0, "sessionsEnded": 0, "points": 0, "scansByCategory": {}}
+        for bucket in buckets:
+            if floor is not None and bucket["bucket"] < floor:
+                continue
+            for field in ("scans", "disposals", "sessionsEnded", "points"):
+                totals[field] += bucket.get(field, 0)
+            for category, n in (bucket.get("scansByCategory") or {}).items():
+                totals["scansByCategory"][category] = totals["scansByCategory"].get(category, 0) + n
+        totals["uniqueCategories"] = sum(1 for n in totals["scansByCategory"].values() if n > 0)
+        return totals
+
+    async def totals_since(self, db: AsyncIOMotorDatabase, user_id: str, since: datetime,
+                           buckets: List[Dict[str, Any]], sources: Collection[str] = SOURCES) -> Dict[str, Any]:
+        """Totals from ``since`` on, with ``buckets`` as read by ``buckets(user_id, since)``.
+
+        The bucket ``since`` falls in also holds activity from before it, so
+        unless ``since`` is on the hour that hour is recounted from the source
+        collections instead; only the counters of ``sources`` are exact then.
+        """
+        first = hour_bucket(since)
+        if since == first:
+            return self.summarize(buckets, since)
+        head: Dict[str, Any] = {}
+        async for _, _, inc in _activity(db, user_id, since, first + timedelta(hours=1), sources):
+            _add(head, inc)
+        return self.summarize([b for b in buckets if b["bucket"] > first] + [head])
+
+    async def rebuild(self, db: AsyncIOMotorDatabase, user_id: Optional[str] = None) -> int:
+        """Recompute buckets from ``events``, ``images``, ``claims`` and ``sessions``; returns buckets written.
+
+        For backfilling data recorded before the counters existed, or after a
+        counter update was lost. Increments landing while it runs may be lost,
+        so run it when the affected users are idle.
+        """
+        counts: Dict[str, Dict[str, Any]] = {}
+        async for uid, ts, inc in _activity(db, user_id):
+            if not uid:
+                continue
+            bucket = hour_bucket(ts)
+            _add(counts.setdefault(self._key(uid, bucket), {"userId": uid, "bucket": bucket}), inc)
+
+        await self.collection.delete_many({"userId": user_id} if user_id else {})
+        if counts:
+            await self.collection.bulk_write([
+                UpdateOne({"_id": key}, {"$set": doc}, upsert=True) for key, doc in counts.items()
+            ], ordered=False)
+        logger.info("Rebuilt %d user_stats buckets%s", len(counts), f" for {user_id}" if user_id else "")
+        return len(counts)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"updates": self.updates, "errors": self.errors}
@@ -0,0 +1,106 @@
+"""Compare inference backends against the SavedModel for accuracy parity and speed.
+
+Every candidate is scored on the same images as the reference SavedModel:
+top-1 agreement, mean |confidence delta|, per-image latency at batch 1, batch
+throughput, load time and resident memory added by loading the model.
+
+Usage (from backend/):
+    python -m scripts.benchmark_backends --reference ../model \\
+        --candidate ../model_int8.tflite --candidate ../model.onnx --images uploads
+"""
+import argparse
+import glob
+import os
+import resource
+import statistics
+import sys
+import time
+from typing import List, Optional
+
+from app.classifier import TrashClassifier
+
+
+def _rss_mb() -> float:
+    # ru_maxrss is KiB on Linux; peak RSS is what a small box has to provision for
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load(path: str, backend: str, threads: Optional[int]) -> dict:
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    classifier = TrashClassifier(path, backend=backend, num_threads=threads)
+    if not classifier.load_model():
+        raise SystemExit(f"Could not load {path}")
+    return {
+        "classifier": classifier,
+        "load_s": time.perf_counter() - start,
+        "rss_mb": _rss_mb() - rss_before,
+    }
+
+
+def measure(classifier: TrashClassifier, images: list, batch_size: int, repeats: int) -> dict:
+    latencies: List[float] = []
+    for _ in range(repeats):
+        for image in images:
+            start = time.perf_counter()
+            classifier.predict_arrays([image])
+            latencies.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(0, len(images), batch_size):
+            classifier.predict_arrays(images[i:i + batch_size])
+    elapsed = time.perf_counter() - start
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": sorted(latencies)[int(0.95 * (len(latencies) - 1))],
+        "batch_ips": repeats * len(images) / elapsed,
+        "predictions": classifier.predict_arrays(images),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reference", default=os.getenv("MODEL_PATH", "../model"))
+    parser.add_argument("--candidate", action="append", default=[], help="model file/dir; repeatable")
+    parser.add_argument("--backend", default="auto", help="backend for candidates (default: by extension)")
+    parser.add_argument("--images", default=os.getenv("UPLOADS_DIR", "uploads"))
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.images, "*.jp*g")))
+    if not paths:
+        print(f"No images found in {args.images}")
+        return 2
+
+    # Load candidates first: TF's own footprint would otherwise hide theirs
+    runs = [(path, load(path, args.backend, args.threads or None)) for path in args.candidate]
+    runs.append((args.reference, load(args.reference, "savedmodel", args.threads or None)))
+
+    decoder = runs[-1][1]["classifier"]
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            image = decoder.decode_image(f.read())
+        if image is not None:
+            images.append(image)
+
+    results = [(path, run, measure(run["classifier"], images, args.batch_size, args.repeats)) for path, run in runs]
+    reference = results[-1][2]["predictions"]
+
+    print(f"{len(images)} images, batch {args.batch_size}, threads {args.threads or 'default'}")
+    print(f"{'model':<40} {'backend':<10} {'top1':>6} {'|dconf|':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'img/s':>8} {'load s':>7} {'+RSS MB':>8}")
+    for path, run, stats in results:
+        predictions = stats["predictions"]
+        agree = sum(p[0] == r[0] for p, r in zip(predictions, reference)) / len(reference)
+        delta = statistics.mean(abs(p[1] - r[1]) for p, r in zip(predictions, reference))
+        print(f"{os.path.basename(os.path.normpath(path)):<40} {run['classifier'].model.name:<10} "
+              f"{agree:>6.1%} {delta:>8.4f} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+              f"{stats['batch_ips']:>8.1f} {run['load_s']:>7.2f} {run['rss_mb']:>8.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Convert the SavedModel into a compact CPU inference artefact.
+
+TFLite variants (needs tensorflow at conversion time only):
+    float16  - weights stored as fp16, float I/O (about half the size)
+    dynamic  - int8 weights, float activations
+    int8     - full integer quantization calibrated on sample images, float I/O
+
+ONNX (needs tf2onnx):
+    onnx     - float32 graph for onnxruntime
+
+Usage (from backend/):
+    python -m scripts.convert_model --saved-model ../model --quantization int8 \\
+        --representative uploads --output ../model_int8.tflite
+"""
+import argparse
+import glob
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from app.classifier import TrashClassifier
+
+
+def representative_dataset(images_dir: str, limit: int):
+    """Yield preprocessed samples exactly as the serving path produces them"""
+    classifier = TrashClassifier("")
+    paths = sorted(glob.glob(os.path.join(images_dir, "*.jp*g")))[:limit]
+    if not paths:
+        raise SystemExit(f"No calibration images found in {images_dir}")
+
+    def _gen():
+        for path in paths:
+            with open(path, "rb") as f:
+                image = classifier.decode_image(f.read())
+            if image is not None:
+                yield [np.array(classifier._normalize([image]))]
+
+    return _gen
+
+
+def convert_tflite(saved_model: str, output: str, quantization: str, images_dir: str, limit: int) -> None:
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model)
+    if quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "dynamic":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif quantization == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(images_dir, limit)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(output, "wb") as f:
+        f.write(converter.convert())
+
+
+def convert_onnx(saved_model: str, output: str, opset: int) -> None:
+    subprocess.run(
+        [sys.executable, "-m", "tf2onnx.convert", "--saved-model", saved_model,
+         "--output", output, "--opset", str(opset)],
+        check=True,
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--saved-model", default=os.getenv("MODEL_PATH", "../model"))
+    parser.add_argument("--quantization", choices=["float32", "float16", "dynamic", "int8", "onnx"], default="int8")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--representative", default=os.getenv("UPLOADS_DIR", "uploads"),
+                        help="folder of sample JPEGs used to calibrate int8 ranges")
+    parser.add_argument("--calibration-limit", type=int, default=200)
+    parser.add_argument("--opset", type=int, default=13)
+    args = parser.parse_args()
+
+    if args.quantization == "onnx":
+        convert_onnx(args.saved_model, args.output, args.opset)
+    else:
+        convert_tflite(args.saved_model, args.output, args.quantization, args.representative, args.calibration_limit)
+    size_mb = os.path.getsize(args.output) / (1024 * 1024)
+    print(f"Wrote {args.output} ({size_mb:.1f} MB). Serve it with MODEL_PATH={args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from app.batch_inputs import ArchiveTooLarge, UnsupportedArchive, read_archive_images
+
+MIB = 1024 * 1024
+
+
+def _zip(members):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return out.getvalue()
+
+
+def test_zip_members_in_order_with_oversized_ones_marked():
+    body = _zip([("a.jpg", b"a" * 10), ("notes.txt", b"skip"), ("big.jpg", b"b" * 100), ("c.png", b"c")])
+    images = read_archive_images("application/zip", body, max_files=10, max_file_bytes=50, max_total_bytes=MIB)
+    assert images == [("a.jpg", b"a" * 10), ("big.jpg", None), ("c.png", b"c")]
+
+
+def test_zip_bomb_is_refused_before_inflating():
+    # 64 members of 1 MiB zeros compress to a few KiB but would inflate to 64 MiB
+    body = _zip([(f"{i}.jpg", bytes(MIB)) for i in range(64)])
+    assert len(body) < 256 * 1024
+    with pytest.raises(ArchiveTooLarge):
+        read_archive_images("application/zip", body, max_files=500, max_file_bytes=2 * MIB,
+                            max_total_bytes=8 * MIB)
+
+
+def test_tar_total_limit():
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode="w:gz") as archive:
+        for i in range(4):
+            info = tarfile.TarInfo(f"{i}.jpg")
+            info.size = MIB
+            archive.addfile(info, io.BytesIO(bytes(MIB)))
+    with pytest.raises(ArchiveTooLarge):
+        read_archive_images("application/gzip", out.getvalue(), max_files=500, max_file_bytes=2 * MIB,
+                            max_total_bytes=3 * MIB)
+
+
+def test_unsupported_body():
+    with pytest.raises(UnsupportedArchive):
+        read_archive_images("image/jpeg", b"\xff\xd8 not an archive", max_files=1, max_file_bytes=1,
+                            max_total_bytes=1)
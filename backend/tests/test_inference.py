@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from app.inference import InferenceExecutor
+
+
+class _SlowClassifier:
+    """Stand-in for TrashClassifier that records how many forward passes overlap"""
+
+    cache = None
+    version = "test"
+
+    def __init__(self) -> None:
+        self.inflight = 0
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def decode_image(self, data: bytes) -> np.ndarray:
+        return np.zeros((2, 2, 3), dtype=np.uint8)
+
+    def predict_arrays(self, images):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.1)
+        with self._lock:
+            self.running -= 1
+        return [("plastic", 0.9)] * len(images)
+
+
+def _run_concurrently(workers: int, uploads: int) -> _SlowClassifier:
+    classifier = _SlowClassifier()
+    executor = InferenceExecutor(lambda: classifier, max_workers=workers, max_pending=32, max_batch=2, max_wait_ms=1)
+
+    async def main():
+        try:
+            results = await asyncio.gather(*[executor.predict_async(b"x") for _ in range(uploads)])
+        finally:
+            executor.shutdown()
+        assert [r.label for r in results] == ["plastic"] * uploads
+
+    asyncio.run(main())
+    return classifier
+
+
+def test_batches_run_in_parallel_up_to_workers():
+    assert _run_concurrently(workers=2, uploads=8).peak == 2
+
+
+def test_single_worker_runs_one_batch_at_a_time():
+    assert _run_concurrently(workers=1, uploads=8).peak == 1
@@ -0,0 +1,81 @@
+"""Fast JPEG preprocessing (draft decode + bilinear) against the original full decode + LANCZOS.
+
+Decode parity runs on every JPEG in backend/uploads. The top-1 check needs
+TensorFlow and the model at MODEL_PATH (default: the repo's model/) and is
+skipped without them.
+"""
+import io
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.classifier import TrashClassifier
+
+BACKEND = Path(__file__).resolve().parents[1]
+UPLOADS = sorted(p for p in (BACKEND / "uploads").glob("*") if p.suffix.lower() in (".jpg", ".jpeg"))
+MODEL_PATH = os.getenv("MODEL_PATH") or str(BACKEND.parent / "model")
+
+
+def legacy_decode(image_bytes: bytes, size) -> np.ndarray:
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image = image.resize(size, Image.Resampling.LANCZOS)
+    return np.array(image, dtype=np.uint8)
+
+
+@pytest.fixture
+def classifier() -> TrashClassifier:
+    return TrashClassifier("unused")
+
+
+@pytest.fixture(scope="module")
+def model() -> TrashClassifier:
+    pytest.importorskip("tensorflow")
+    if not os.path.exists(MODEL_PATH):
+        pytest.skip(f"No model at {MODEL_PATH}")
+    clf = TrashClassifier(MODEL_PATH)
+    if not clf.load_model():
+        pytest.skip(f"Could not load model from {MODEL_PATH}")
+    return clf
+
+
+@pytest.mark.parametrize("path", UPLOADS, ids=lambda p: p.name)
+def test_decode_matches_legacy(classifier, path):
+    data = path.read_bytes()
+    fast = classifier.decode_image(data)
+    reference = legacy_decode(data, classifier.input_size)
+    assert fast is not None
+    assert fast.shape == reference.shape == (224, 224, 3)
+    assert fast.dtype == np.uint8
+    assert np.abs(fast.astype(np.float32) - reference).mean() < 3.0
+
+
+@pytest.mark.parametrize("path", UPLOADS, ids=lambda p: p.name)
+def test_top1_unchanged(model, path):
+    data = path.read_bytes()
+    fast = model.decode_image(data)
+    reference = legacy_decode(data, model.input_size)
+    (fast_label, fast_conf), (ref_label, ref_conf) = model.predict_arrays([fast, reference])
+    assert fast_label == ref_label, f"fast={fast_label} ({fast_conf:.3f}) legacy={ref_label} ({ref_conf:.3f})"
+
+
+def test_normalize_scales_to_unit_range(classifier):
+    images = [np.full((224, 224, 3), value, dtype=np.uint8) for value in (0, 51, 255)]
+    batch = classifier._normalize(images)
+    assert batch.dtype == np.float32
+    assert batch.shape == (3, 224, 224, 3)
+    expected = np.array([-1.0, 51 / 127.5 - 1.0, 1.0], dtype=np.float32)[:, None, None, None]
+    np.testing.assert_allclose(batch, np.broadcast_to(expected, batch.shape), atol=1e-6)
+
+
+def test_small_and_non_jpeg_inputs_skip_draft(classifier):
+    out = io.BytesIO()
+    Image.new("L", (100, 80), 128).save(out, format="PNG")
+    decoded = classifier.decode_image(out.getvalue())
+    assert decoded is not None
+    assert decoded.shape == (224, 224, 3)
+    assert classifier.decode_image(b"not an image") is None
@@ -13,6 +13,7 @@
 #include <HTTPClient.h>
 #include <ESP32Servo.h>
 #include <PubSubClient.h>
+#include <Preferences.h>
 #include "esp_camera.h"
 #include "soc/soc.h"
 #include "soc/rtc_cntl_reg.h"
@@ -65,6 +66,11 @@ PubSubClient mqttClient(espClient);
 
 // Session & control state
 String currentSessionId = "";
+// Idempotency for disposal_complete: per-session sequence + unique message id per boot
+uint32_t bootNonce = 0;
+uint32_t bootCount = 0;   // persisted in NVS, so msgIds never repeat across reboots
+uint32_t disposalSeq = 0;
+uint32_t eventCounter = 0;
 unsigned long scheduledCaptureAt = 0; // millis timestamp to trigger takeAndSendPhoto()
 
 enum LidState { STATE_CLOSED, STATE_OPEN, STATE_WAITING_TO_CLOSE };
@@ -95,8 +101,13 @@ void publishDisposalComplete(const char* label) {
   ev["binId"] = BIN_ID;
   ev["label"] = label;
   ev["confidence"] = 1.0;
+  char msgId[40];
+  snprintf(msgId, sizeof(msgId), "%lu-%08lx-%lu", (unsigned long)bootCount, (unsigned long)bootNonce,
+           (unsigned long)++eventCounter);
+  ev["msgId"] = msgId;
   if (currentSessionId.length() > 0) {
     ev["sessionId"] = currentSessionId;
+    ev["seq"] = ++disposalSeq;
   }
   char payload[256];
   size_t n = serializeJson(ev, payload, sizeof(payload));
@@ -122,6 +133,7 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
   const char* action = doc["action"] | "";
   const char* sid = doc["sessionId"] | "";
   if (sid && strlen(sid) > 0) {
+    if (currentSessionId != sid) disposalSeq = 0;
     currentSessionId = String(sid);
   }
   if (strcmp(action, "activate") == 0) {
@@ -421,6 +433,15 @@ void setup() {
     Serial.print(".");
   }
   Serial.println("\nWiFi connected");
+
+  // msgId prefix: a boot counter in NVS plus a nonce drawn now that the radio is on
+  // (esp_random is only pseudo-random before that); the nonce covers an NVS erase
+  Preferences prefs;
+  prefs.begin("ecotion", false);
+  bootCount = prefs.getUInt("boots", 0) + 1;
+  prefs.putUInt("boots", bootCount);
+  prefs.end();
+  bootNonce = esp_random();
   
   // PERBAIKAN: Atur timeout untuk koneksi Telegram
   client.setInsecure(); // Gunakan jika Anda tidak perlu validasi sertifikat SSL